@@ -1,11 +1,33 @@
+import json
+
 from django.contrib import admin
+from django.utils.html import format_html
+from django.utils.translation import ugettext_lazy as _
 
 from excel_import.models import Document
 
 
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ['name', 'file', 'status', 'created', 'current']
+    list_display = ['name', 'file', 'status', 'created', 'current',
+                    'import_seconds', 'imported_cells']
     list_filter = ['current','created', 'status']
     search_fields = ['name']
+    readonly_fields = ['import_statistics_table']
+
+    def import_seconds(self, document):
+        return document.get_import_statistics().get('seconds', {}) \
+            .get('total')
+    import_seconds.short_description = _("Import seconds")
+
+    def imported_cells(self, document):
+        return document.get_import_statistics().get('cells')
+    imported_cells.short_description = _("Imported cells")
+
+    def import_statistics_table(self, document):
+        statistics = document.get_import_statistics()
+        if not statistics:
+            return ""
+        return format_html('<pre>{}</pre>', json.dumps(statistics, indent=2))
+    import_statistics_table.short_description = _("Import statistics")
 
 admin.site.register(Document, DocumentAdmin)
@@ -0,0 +1,237 @@
+"""
+Import benchmark suite.
+
+Generates workbooks from the cases in SUITE_CASES and measures wall time,
+peak RSS and database rows written for Document.create_merged_index,
+Document.parse_file and Document.create_xlsx. Results are written as JSON,
+so runs of different releases can be compared.
+
+Run with ``python -m excel_import.benchmark_suite [output.json]``.
+
+Every case runs in a process of its own, the peak RSS of a phase is the
+high-water mark of that process after the phase. Database writes are
+rolled back.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+
+import django
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, PatternFill
+from openpyxl.styles.colors import Color
+from openpyxl.utils import get_column_letter
+
+SUITE_CASES = [
+    {'name': 'plain', 'rows': 5000, 'columns': 20},
+    {'name': 'merged', 'rows': 5000, 'columns': 20, 'merged_density': 0.2},
+    {'name': 'filled', 'rows': 5000, 'columns': 20, 'fill_density': 1.0},
+    {'name': 'long values', 'rows': 5000, 'columns': 20, 'value_size': 200},
+    {'name': 'wide', 'rows': 500, 'columns': 200, 'merged_density': 0.05,
+     'fill_density': 0.5},
+]
+
+FILL_COLORS = {
+    'rgb': [Color(rgb='FF99CCFF'), Color(rgb='FFFFCC99')],
+    'indexed': [Color(indexed=22), Color(indexed=44)],
+    'theme': [Color(theme=4, tint=0.4), Color(theme=9, tint=-0.25)],
+}
+
+
+def generate_workbook(path, rows, columns, merged_density=0.0,
+                      fill_density=0.0,
+                      fill_types=('rgb', 'indexed', 'theme'), value_size=8,
+                      seed=0):
+    """
+    Saves a workbook with a single rows x columns sheet to path.
+
+    merged_density is the share of 2x2 blocks that are merged,
+    fill_density the share of cells with a fill of one of fill_types.
+    Cells hold strings of value_size characters, or numbers if value_size
+    is 0. The content only depends on the arguments.
+    """
+    generator = random.Random(seed)
+    fills = [PatternFill(fill_type='solid', fgColor=color)
+             for fill_type in fill_types
+             for color in FILL_COLORS[fill_type]]
+    alignment = Alignment(horizontal='center')
+
+    workbook = Workbook()
+    work_sheet = workbook.active
+    for row in range(1, rows + 1):
+        for column in range(1, columns + 1):
+            cell = work_sheet.cell(row=row, column=column)
+            if value_size:
+                cell.value = ('%d:%d ' % (row, column) * value_size
+                              )[:value_size]
+            else:
+                cell.value = row * column
+            if fills and generator.random() < fill_density:
+                cell.fill = generator.choice(fills)
+                cell.alignment = alignment
+
+    for row in range(1, rows, 2):
+        for column in range(1, columns, 2):
+            if generator.random() < merged_density:
+                work_sheet.merge_cells('%s%d:%s%d' % (
+                    get_column_letter(column), row,
+                    get_column_letter(column + 1), row + 1))
+    workbook.save(path)
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of the process in KiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes instead of KiB on macOS.
+        peak //= 1024
+    return peak
+
+
+def count_db_rows(document):
+    from excel_import.models import DocumentColors, DocumentGrid
+
+    return (document.cell_set.count() +
+            DocumentColors.objects.filter(document=document).count() +
+            DocumentGrid.objects.filter(document=document).count())
+
+
+def measure(phase, function, document):
+    rss_before = get_peak_rss()
+    rows_before = count_db_rows(document)
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    peak_rss = get_peak_rss()
+    return {
+        'phase': phase,
+        'seconds': round(seconds, 4),
+        'peak_rss_kb': peak_rss,
+        'rss_growth_kb': peak_rss - rss_before,
+        'db_rows': count_db_rows(document) - rows_before,
+    }
+
+
+def run_case(case):
+    """
+    Generates the workbook of case and measures the phases of its import
+    in a transaction that is rolled back. Returns a result per phase.
+    """
+    from django.conf import settings
+    from django.db import transaction
+    from excel_import.models import Document
+
+    options = dict(case)
+    name = options.pop('name')
+    # Files of documents have to be inside of MEDIA_ROOT.
+    if not os.path.isdir(settings.MEDIA_ROOT):
+        os.makedirs(settings.MEDIA_ROOT)
+    directory = tempfile.mkdtemp(dir=settings.MEDIA_ROOT)
+    path = os.path.join(directory, 'benchmark.xlsx')
+    try:
+        generate_workbook(path, **options)
+        file_size = os.path.getsize(path)
+        results = []
+        with transaction.atomic():
+            # bulk_create does not start an import like Document.save.
+            Document.objects.bulk_create([Document(
+                file=path, name=path, current=False,
+                import_status=Document.PARSING)])
+            document = Document.objects.get(name=path)
+
+            for phase in ('create_merged_index', 'parse_file',
+                          'create_xlsx'):
+                # Every phase loads the workbook itself.
+                document._context = document._workbook = None
+                results.append(measure(phase, getattr(document, phase),
+                                       document))
+            transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(directory)
+
+    for result in results:
+        result.update(case, case=name, file_size=file_size)
+        del result['name']
+    return results
+
+
+def _run_case_in_process(case, queue):
+    try:
+        queue.put((run_case(case), None))
+    except Exception:
+        queue.put((None, traceback.format_exc()))
+
+
+def run_suite(cases=SUITE_CASES, isolated=True):
+    """
+    Runs every case, each in a process of its own unless isolated is
+    False, and returns the suite results with the environment they were
+    measured in.
+    """
+    from django.conf import settings
+    from django.db import connection, connections
+
+    results = []
+    for case in cases:
+        if isolated:
+            # The child must not share the connection of the parent.
+            connections.close_all()
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_run_case_in_process,
+                                              args=(case, queue))
+            process.start()
+            case_results, error = queue.get()
+            process.join()
+            if error is not None:
+                raise RuntimeError('Case %s failed:\n%s'
+                                   % (case['name'], error))
+            results.extend(case_results)
+        else:
+            results.extend(run_case(case))
+
+    return {
+        'created': datetime.utcnow().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'openpyxl': openpyxl.__version__,
+            'database': connection.vendor,
+            'streaming': getattr(settings, 'EXCEL_IMPORT_STREAMING', False),
+            'grid_storage': getattr(settings, 'EXCEL_IMPORT_GRID_STORAGE',
+                                    False),
+            'cell_writer': getattr(settings, 'EXCEL_IMPORT_CELL_WRITER',
+                                   None),
+            'workers': getattr(settings, 'EXCEL_IMPORT_WORKERS', 1),
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'excel_viewer.settings')
+    django.setup()
+
+    output = sys.argv[1] if len(sys.argv) > 1 else 'benchmark_results.json'
+    suite = run_suite()
+    with open(output, 'w') as file:
+        json.dump(suite, file, indent=2, sort_keys=True)
+
+    print('%-12s %-20s %9s %12s %9s' % ('case', 'phase', 'seconds',
+                                       'peak RSS KiB', 'db rows'))
+    for result in suite['results']:
+        print('%-12s %-20s %9.3f %12d %9d' % (
+            result['case'], result['phase'], result['seconds'],
+            result['peak_rss_kb'], result['db_rows']))
+    print('Results written to %s' % output)
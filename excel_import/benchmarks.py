@@ -0,0 +1,170 @@
+"""
+Micro benchmarks for the import pipeline.
+
+Run with ``python -m excel_import.benchmarks``.
+"""
+import os
+import shutil
+import tempfile
+import time
+import timeit
+from io import BytesIO
+
+import django
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+
+from excel_import.merged import MergedCellIndex
+
+
+def generate_merged_cell_ranges(count, columns=50):
+    """
+    Returns count merged ranges of 2x2 cells tiled row by row over a sheet
+    that is columns wide.
+    """
+    per_row = columns // 2
+    ranges = []
+    for i in range(count):
+        row = (i // per_row) * 2 + 1
+        column = (i % per_row) * 2 + 1
+        ranges.append('%s%d:%s%d' % (get_column_letter(column), row,
+                                     get_column_letter(column + 1), row + 1))
+    return ranges
+
+
+def benchmark_merged_index(merge_counts=(10, 100, 1000, 10000),
+                           rows=200, columns=50, repeat=3):
+    """
+    Measures the cost of the skip and span lookups per cell of a
+    rows x columns sheet for a growing number of merged ranges.
+
+    Returns a list of (merge_count, seconds_per_cell) tuples.
+    """
+    results = []
+    cells = rows * columns
+    for count in merge_counts:
+        index = MergedCellIndex(generate_merged_cell_ranges(count, columns))
+
+        def lookup():
+            for row in range(1, rows + 1):
+                for column in range(1, columns + 1):
+                    if not index.is_hidden(row, column):
+                        index.get_span(row, column)
+
+        seconds = min(timeit.repeat(lookup, number=1, repeat=repeat))
+        results.append((count, seconds / cells))
+    return results
+
+
+def generate_styled_workbook(rows, columns, styles=8):
+    """
+    Returns an xlsx file as BytesIO with a single rows x columns sheet
+    whose cells cycle through styles combinations of fill and alignment.
+    """
+    fills = [PatternFill(fill_type='solid', fgColor='FF%02X%02X%02X'
+                         % (i * 30 % 256, i * 70 % 256, i * 110 % 256))
+             for i in range(styles)]
+    alignments = [Alignment(horizontal=horizontal) for horizontal
+                  in ('left', 'center', 'right')]
+
+    workbook = Workbook()
+    work_sheet = workbook.active
+    for row in range(1, rows + 1):
+        for column in range(1, columns + 1):
+            cell = work_sheet.cell(row=row, column=column)
+            cell.value = row * column
+            index = row + column
+            cell.fill = fills[index % styles]
+            cell.alignment = alignments[index % len(alignments)]
+
+    file = BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+def benchmark_cell_styles(rows=2000, columns=50, repeat=3):
+    """
+    Measures the cost of resolving color name and alignment of every cell
+    of a rows x columns read-only sheet, once per cell as before and once
+    per style with Document.get_cell_style.
+
+    Returns a (seconds_per_cell_uncached, seconds_per_cell_cached) tuple.
+    """
+    from excel_import.context import ImportContext
+    from excel_import.models import Document
+
+    workbook = load_workbook(generate_styled_workbook(rows, columns),
+                             read_only=True)
+    cells = [cell for row in workbook.active.rows for cell in row]
+    document = Document()
+
+    def uncached():
+        for cell in cells:
+            document.get_color_from_cell(cell)
+            cell.alignment.horizontal
+
+    def cached():
+        document._context = ImportContext()
+        for cell in cells:
+            document.get_cell_style(cell)
+
+    return (min(timeit.repeat(uncached, number=1, repeat=repeat)) / len(cells),
+            min(timeit.repeat(cached, number=1, repeat=repeat)) / len(cells))
+
+
+def benchmark_parallel_import(rows=20000, columns=20,
+                              workers=(1, 2, 4, 8)):
+    """
+    Measures the time to prepare the cells of a rows x columns sheet with
+    excel_import.parallel for a growing number of worker processes, the
+    cells are not written to the database. One worker prepares the sheet
+    in the calling process like a serial import.
+
+    Returns a list of (workers, seconds) tuples.
+    """
+    from excel_import.parallel import prepare_band, prepare_bands
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'parallel.xlsx')
+    with open(path, 'wb') as file:
+        file.write(generate_styled_workbook(rows, columns).getvalue())
+    merged_index = MergedCellIndex()
+
+    results = []
+    try:
+        for count in workers:
+            start = time.time()
+            if count == 1:
+                prepare_band(path, 0, 1, rows, columns, merged_index)
+            else:
+                for band in prepare_bands(path, 0, rows, columns,
+                                          merged_index, workers=count):
+                    pass
+            results.append((count, time.time() - start))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'excel_viewer.settings')
+    django.setup()
+
+    print('merged ranges   ns per cell')
+    for count, seconds in benchmark_merged_index():
+        print('%13d   %11.1f' % (count, seconds * 1e9))
+
+    print('')
+    print('cell styles of 100000 cells   ns per cell')
+    uncached, cached = benchmark_cell_styles()
+    print('%-28s   %11.1f' % ('per cell', uncached * 1e9))
+    print('%-28s   %11.1f' % ('per style id', cached * 1e9))
+
+    print('')
+    print('prepare 20000 x 20 cells   seconds   speedup')
+    timings = benchmark_parallel_import()
+    for count, seconds in timings:
+        print('%12d workers   %7.2f   %7.2f'
+              % (count, seconds, timings[0][1] / seconds))
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ImportContext(object):
+    """
+    State of the import of one worksheet.
+
+    workbook, theme_colors and styles belong to the file and are shared
+    with the contexts of further sheets, see for_sheet. colors,
+    merged_index and cell_writer belong to the sheet. A context lives only
+    as long as its import, nothing is kept between imports.
+
+    timings and cells collect the statistics of the import, see
+    get_statistics.
+    """
+
+    def __init__(self, workbook=None, theme_colors=None, styles=None):
+        # Loaded workbook, None until a parse method loads it.
+        self.workbook = workbook
+        # Theme palette, None until parsed.
+        self.theme_colors = theme_colors
+        # (color name, horizontal alignment, color) per style key.
+        self.styles = dict() if styles is None else styles
+        # Colors used by the cells of the sheet.
+        self.colors = set()
+        self.merged_index = None
+        # Differences to the previous revision, see
+        # Document.import_revision.
+        self.diff = None
+        # Writer overriding the one of the storage engine.
+        self.cell_writer = None
+        # Seconds spent per phase, in the order the phases ran.
+        self.timings = OrderedDict()
+        # Number of cells written.
+        self.cells = 0
+        self._start = time.time()
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Adds the time spent in the with block to the timing of phase.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_timing(phase, time.time() - start)
+
+    def add_timing(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def get_statistics(self, method):
+        """
+        Returns the durations of the phases and the cell, merged range and
+        color counts of an import done by method, e.g. 'parse', and the
+        differences of a revision.
+        """
+        seconds = OrderedDict((phase, round(value, 4)) for phase, value
+                              in self.timings.items())
+        seconds['total'] = round(time.time() - self._start, 4)
+        statistics = OrderedDict([
+            ('method', method),
+            ('seconds', seconds),
+            ('cells', self.cells),
+            ('colors', len(self.colors)),
+        ])
+        if self.merged_index is not None:
+            statistics['merged_cells'] = len(self.merged_index)
+        if self.diff is not None:
+            statistics['diff'] = self.diff
+        return statistics
+
+    def for_sheet(self):
+        """
+        Returns a context for another sheet of the same workbook.
+        """
+        return ImportContext(self.workbook, self.theme_colors, self.styles)
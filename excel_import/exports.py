@@ -0,0 +1,128 @@
+"""
+Cached xlsx exports of documents.
+
+An export is written once per document, file and change version, see
+Document.change_version, to EXCEL_EXPORT_CACHE_DIR while it is streamed to
+the first download. Later downloads read the file, or get a 304 response
+if their ETag, the key of get_export_key, matches.
+"""
+import glob
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_export_directory():
+    directory = getattr(settings, 'EXCEL_EXPORT_CACHE_DIR', None) or \
+        os.path.join(tempfile.gettempdir(), 'excel_viewer_exports')
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def get_export_key(document):
+    """
+    Returns the key of the current export of document, it changes with
+    the file and with every accepted or revoked change request.
+    """
+    return '%d-%s-%d' % (document.pk, document.content_hash[:16] or 'file',
+                         document.change_version)
+
+
+def get_export_path(document):
+    return os.path.join(get_export_directory(),
+                        '%s.xlsx' % get_export_key(document))
+
+
+def iter_export(document, report=None):
+    """
+    Yields the bytes of the xlsx export of document. With
+    EXCEL_EXPORT_PATCH_ORIGINAL the changed cells are patched into a copy
+    of an original xlsx file by Document.iter_patched_xlsx. Otherwise, with
+    EXCEL_EXPORT_STREAMING it is written from the database by
+    Document.iter_xlsx, or into the original workbook by
+    Document.create_xlsx. report is called with the number of every row
+    written, if the engine reports progress.
+    """
+    if getattr(settings, 'EXCEL_EXPORT_PATCH_ORIGINAL', False) and \
+            document.get_importer().patches_original and \
+            os.path.exists(document.file.path):
+        return document.iter_patched_xlsx(report)
+    if getattr(settings, 'EXCEL_EXPORT_STREAMING', False):
+        return document.iter_xlsx(report)
+    return iter([document.create_xlsx()])
+
+
+def stream_export(document, report=None):
+    """
+    Yields the bytes of the export of document and writes them to the
+    cache on the way. The cache file appears once the export is complete,
+    concurrent downloads never read a partial file. If the document changed
+    meanwhile, the export is outdated and removed again, the exports of
+    the newer version are kept.
+    """
+    path = get_export_path(document)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path),
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            for data in iter_export(document, report):
+                file.write(data)
+                yield data
+        os.replace(temporary, path)
+    finally:
+        # Left over if the export failed or the download was aborted.
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    document.refresh_from_db(fields=['content_hash', 'change_version'])
+    if get_export_path(document) != path:
+        logger.debug("Removing outdated export %s of document %d"
+                     % (path, document.pk))
+        try:
+            os.remove(path)
+        except OSError:
+            # Removed by invalidate_exports of the change.
+            pass
+        return
+    logger.debug("Cached export %s of document %d" % (path, document.pk))
+    invalidate_exports(document, keep=path)
+
+
+def export_in_background(document):
+    """
+    Returns whether the export of document is written by an ExportJob
+    instead of while it is downloaded, for documents with more rows than
+    EXCEL_EXPORT_ASYNC_ROWS.
+    """
+    rows = getattr(settings, 'EXCEL_EXPORT_ASYNC_ROWS', None)
+    return rows is not None and (document.rows_total or 0) > rows
+
+
+def get_cached_export(document):
+    """
+    Returns the path of the xlsx export of document, which is created on
+    the first request of a change version.
+    """
+    path = get_export_path(document)
+    if not os.path.exists(path):
+        for data in stream_export(document):
+            pass
+    return path
+
+
+def invalidate_exports(document, keep=None):
+    """
+    Removes the cached exports of document except keep.
+    """
+    pattern = os.path.join(get_export_directory(), '%d-*.xlsx' % document.pk)
+    for path in glob.glob(pattern):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                # Removed by a concurrent request.
+                pass
@@ -0,0 +1,390 @@
+"""
+Evaluation of cell formulas.
+
+Supported are numbers, strings, references like A1, $B$2, A1:C3 and A:A,
+the operators + - * / ^ & % and comparisons, and the functions SUM,
+COUNTA and COUNTIF. Formulas using anything else cannot be parsed and
+are left as they are by Document.calculate.
+
+parse_formula returns an expression tree of tuples, get_references the
+ranges it reads and evaluate its value, with cell values provided by a
+callable. Values are the strings stored in Cell.value.
+"""
+import fnmatch
+import operator
+import re
+
+from openpyxl.utils import column_index_from_string
+
+# Rows of a whole column reference like A:A.
+MAX_ROW = 1048576
+
+ERRORS = ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!',
+          '#N/A')
+
+TOKEN_PATTERN = re.compile(r'''\s*(?:
+    (?P<string>"(?:[^"]|"")*")|
+    (?P<range>\$?[A-Za-z]{1,3}\$?[0-9]+(?::\$?[A-Za-z]{1,3}\$?[0-9]+)?
+              (?![\w(!])|
+              \$?[A-Za-z]{1,3}:\$?[A-Za-z]{1,3}(?![\w(!]))|
+    (?P<number>(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)|
+    (?P<function>[A-Za-z_][A-Za-z0-9_.]*)\s*\(|
+    (?P<operator><>|<=|>=|[-+*/^&=<>(),%])
+)''', re.VERBOSE)
+REFERENCE_PATTERN = re.compile(r'\$?([A-Za-z]{1,3})\$?([0-9]*)')
+
+COMPARISONS = {
+    '=': operator.eq,
+    '<>': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+# Binary operators from lowest to highest precedence.
+PRECEDENCE = [tuple(COMPARISONS), ('&',), ('+', '-'), ('*', '/'), ('^',)]
+
+
+class FormulaError(Exception):
+    """
+    Raised for formulas that cannot be evaluated, args[0] is the error
+    value shown in the cell, e.g. #DIV/0!.
+    """
+
+    @property
+    def value(self):
+        return self.args[0]
+
+
+def split_formula(value):
+    """
+    Returns (value, formula) for the value of an imported cell. Formulas
+    start with =, their value is set by the recalculation.
+    """
+    if isinstance(value, str) and value.startswith('=') and len(value) > 1:
+        return value, value
+    return value, ''
+
+
+def parse_reference(text):
+    """
+    Returns (min_row, min_column, max_row, max_column) of a reference like
+    A1, $A$1:B2 or A:B.
+    """
+    bounds = []
+    for part in text.split(':'):
+        letters, digits = REFERENCE_PATTERN.match(part).groups()
+        bounds.append((int(digits) if digits else None,
+                       column_index_from_string(letters.upper())))
+    if len(bounds) == 1:
+        bounds.append(bounds[0])
+    (first_row, first_column), (last_row, last_column) = bounds
+    if first_row is None:
+        first_row, last_row = 1, MAX_ROW
+    return (min(first_row, last_row), min(first_column, last_column),
+            max(first_row, last_row), max(first_column, last_column))
+
+
+def tokenize(formula):
+    tokens = []
+    position = 1 if formula.startswith('=') else 0
+    while position < len(formula):
+        if not formula[position:].strip():
+            break
+        match = TOKEN_PATTERN.match(formula, position)
+        if match is None:
+            raise FormulaError('#NAME?')
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string':
+            tokens.append((kind, text[1:-1].replace('""', '"')))
+        elif kind == 'range':
+            tokens.append((kind, parse_reference(text)))
+        elif kind == 'number':
+            tokens.append((kind, float(text)))
+        elif kind == 'function':
+            tokens.append((kind, text.upper()))
+        else:
+            tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+
+class Parser(object):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, text=None):
+        token = self.peek()
+        if token[0] is None or text is not None and token[1] != text:
+            raise FormulaError('#NAME?')
+        self.position += 1
+        return token
+
+    def parse(self):
+        expression = self.parse_binary(0)
+        if self.peek()[0] is not None:
+            raise FormulaError('#NAME?')
+        return expression
+
+    def parse_binary(self, level):
+        if level == len(PRECEDENCE):
+            return self.parse_unary()
+        expression = self.parse_binary(level + 1)
+        while self.peek() in [('operator', op) for op in PRECEDENCE[level]]:
+            op = self.take()[1]
+            expression = ('binary', op, expression,
+                          self.parse_binary(level + 1))
+        return expression
+
+    def parse_unary(self):
+        if self.peek() in (('operator', '-'), ('operator', '+')):
+            return ('unary', self.take()[1], self.parse_unary())
+        expression = self.parse_primary()
+        while self.peek() == ('operator', '%'):
+            self.take()
+            expression = ('binary', '/', expression, ('number', 100.0))
+        return expression
+
+    def parse_primary(self):
+        kind, value = self.take()
+        if kind in ('number', 'string', 'range'):
+            return (kind, value)
+        if kind == 'operator' and value == '(':
+            expression = self.parse_binary(0)
+            self.take(')')
+            return expression
+        if kind == 'function':
+            if value not in FUNCTIONS:
+                raise FormulaError('#NAME?')
+            arguments = []
+            if self.peek() != ('operator', ')'):
+                arguments.append(self.parse_binary(0))
+                while self.peek() == ('operator', ','):
+                    self.take()
+                    arguments.append(self.parse_binary(0))
+            self.take(')')
+            return ('call', value, arguments)
+        raise FormulaError('#NAME?')
+
+
+def parse_formula(formula):
+    """
+    Returns the expression tree of formula, raises FormulaError for
+    unsupported syntax.
+    """
+    return Parser(tokenize(formula)).parse()
+
+
+def get_references(expression):
+    """
+    Returns the (min_row, min_column, max_row, max_column) of every
+    reference in expression.
+    """
+    kind = expression[0]
+    if kind == 'range':
+        return [expression[1]]
+    if kind == 'binary':
+        return get_references(expression[2]) + get_references(expression[3])
+    if kind == 'unary':
+        return get_references(expression[2])
+    if kind == 'call':
+        return [reference for argument in expression[2]
+                for reference in get_references(argument)]
+    return []
+
+
+def to_number(value):
+    """
+    Converts a cell value or intermediate result to a float, empty cells
+    are 0.
+    """
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, float):
+        return value
+    if value in ERRORS:
+        raise FormulaError(value)
+    if value == '':
+        return 0.0
+    if value.upper() in ('TRUE', 'FALSE'):
+        return float(value.upper() == 'TRUE')
+    try:
+        return float(value)
+    except ValueError:
+        raise FormulaError('#VALUE!')
+
+
+def to_string(value):
+    """
+    Formats a result the way it is stored in Cell.value.
+    """
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return '%.15g' % value
+    return value
+
+
+def is_number(value):
+    if isinstance(value, float):
+        return True
+    if isinstance(value, bool) or value in ERRORS:
+        return False
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def match_criteria(criteria):
+    """
+    Returns a predicate for the values counted by COUNTIF(range, criteria).
+    """
+    if isinstance(criteria, str):
+        match = re.match(r'(<>|<=|>=|=|<|>)?(.*)$', criteria, re.DOTALL)
+        comparison, operand = match.group(1) or '=', match.group(2)
+    else:
+        comparison, operand = '=', criteria
+    compare = COMPARISONS[comparison]
+
+    if is_number(operand):
+        number = to_number(operand)
+        return lambda value: is_number(value) and compare(
+            to_number(value), number)
+
+    operand = to_string(operand).lower()
+    if comparison in ('=', '<>') and ('*' in operand or '?' in operand):
+        return lambda value: compare(
+            fnmatch.fnmatchcase(to_string(value).lower(), operand), True)
+    if comparison == '=' and operand == '':
+        return lambda value: value == ''
+    return lambda value: not is_number(value) and value != '' and compare(
+        to_string(value).lower(), operand)
+
+
+def values_of(argument):
+    if isinstance(argument, list):
+        return argument
+    return [argument]
+
+
+def function_sum(arguments):
+    total = 0.0
+    for argument in arguments:
+        if isinstance(argument, list):
+            for value in argument:
+                if value in ERRORS:
+                    raise FormulaError(value)
+                if is_number(value):
+                    total += to_number(value)
+        else:
+            total += to_number(argument)
+    return total
+
+
+def function_counta(arguments):
+    return float(sum(1 for argument in arguments
+                     for value in values_of(argument) if value != ''))
+
+
+def function_countif(arguments):
+    if len(arguments) != 2 or not isinstance(arguments[0], list):
+        raise FormulaError('#VALUE!')
+    predicate = match_criteria(values_of(arguments[1])[0])
+    return float(sum(1 for value in arguments[0] if predicate(value)))
+
+
+FUNCTIONS = {
+    'SUM': function_sum,
+    'COUNTA': function_counta,
+    'COUNTIF': function_countif,
+}
+
+
+def evaluate_expression(expression, get_range):
+    kind = expression[0]
+    if kind in ('number', 'string'):
+        return expression[1]
+    if kind == 'range':
+        values = get_range(*expression[1])
+        min_row, min_column, max_row, max_column = expression[1]
+        if min_row == max_row and min_column == max_column:
+            return values[0]
+        return values
+    if kind == 'call':
+        return FUNCTIONS[expression[1]](
+            [evaluate_expression(argument, get_range)
+             for argument in expression[2]])
+    if kind == 'unary':
+        value = to_number(scalar(evaluate_expression(expression[2],
+                                                     get_range)))
+        return -value if expression[1] == '-' else value
+
+    op = expression[1]
+    left = scalar(evaluate_expression(expression[2], get_range))
+    right = scalar(evaluate_expression(expression[3], get_range))
+    if op == '&':
+        for value in (left, right):
+            if value in ERRORS:
+                raise FormulaError(value)
+        return to_string(left) + to_string(right)
+    if op in COMPARISONS:
+        if is_number(left) or is_number(right):
+            if not (is_number(left) or left == '') or \
+                    not (is_number(right) or right == ''):
+                # Numbers sort before text.
+                left, right = not is_number(left), not is_number(right)
+            else:
+                left, right = to_number(left), to_number(right)
+        else:
+            left, right = to_string(left).lower(), to_string(right).lower()
+        return COMPARISONS[op](left, right)
+
+    left, right = to_number(left), to_number(right)
+    if op == '+':
+        return left + right
+    if op == '-':
+        return left - right
+    if op == '*':
+        return left * right
+    if op == '/':
+        if right == 0:
+            raise FormulaError('#DIV/0!')
+        return left / right
+    try:
+        return float(left ** right)
+    except (OverflowError, ZeroDivisionError, TypeError):
+        raise FormulaError('#NUM!')
+
+
+def scalar(value):
+    """
+    Returns the value of a single cell, ranges are not implicitly
+    intersected.
+    """
+    if isinstance(value, list):
+        raise FormulaError('#VALUE!')
+    return value
+
+
+def evaluate(expression, get_range):
+    """
+    Returns the value of expression as string. get_range(min_row,
+    min_column, max_row, max_column) returns the values of a range row by
+    row, '' for empty cells.
+    """
+    try:
+        return to_string(scalar(evaluate_expression(expression, get_range)))
+    except FormulaError as error:
+        return error.value
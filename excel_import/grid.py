@@ -0,0 +1,136 @@
+import json
+import zlib
+from bisect import bisect_left
+
+from openpyxl.utils import coordinate_to_tuple, get_column_letter
+
+
+class CellDisplayMixin(object):
+    """
+    Attributes used to render a cell as html table cell.
+    """
+
+    @property
+    def attributes(self):
+        attributes = str()
+        if self.row_span:
+            attributes = 'rowspan=%d' % self.row_span
+        if self.column_span:
+            attributes = ''.join([attributes, 'colspan=%d' % self.column_span])
+        return attributes
+
+    @property
+    def class_tags(self):
+        classes = self.color_name
+        if self.horizontal_alignment:
+            classes = ''.join([classes, ' ', self.horizontal_alignment])
+        return classes
+
+
+class GridCell(CellDisplayMixin):
+    """
+    Read-only cell of a Grid, it offers the same attributes as
+    excel_import.models.Cell but has no id.
+    """
+    id = None
+    pk = None
+
+    def __init__(self, row, column, value, color_name, horizontal_alignment,
+                 column_span, row_span, first_cell, last_cell):
+        self.row = row
+        self.column = column
+        self.value = value
+        self.color_name = color_name
+        self.horizontal_alignment = horizontal_alignment
+        self.column_span = column_span
+        self.row_span = row_span
+        self.first_cell = first_cell
+        self.last_cell = last_cell
+
+    @property
+    def coordinate(self):
+        return '%s%d' % (get_column_letter(self.column), self.row)
+
+
+class Grid(object):
+    """
+    Columnar representation of the visible cells of a worksheet.
+
+    Every cell attribute is kept in its own list, styles are stored once
+    and referenced by index. dumps() serializes the grid to a compressed
+    blob.
+    """
+    COLUMNS = ('rows', 'columns', 'values', 'style_ids', 'column_spans',
+               'row_spans')
+
+    def __init__(self):
+        for name in self.COLUMNS:
+            setattr(self, name, [])
+        self.styles = []
+        self._style_index = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, cell):
+        """
+        Appends a Cell instance.
+        """
+        if cell.row and cell.column:
+            row, column = cell.row, cell.column
+        else:
+            row, column = coordinate_to_tuple(cell.coordinate)
+        style = (cell.color_name, cell.horizontal_alignment)
+        if style not in self._style_index:
+            self._style_index[style] = len(self.styles)
+            self.styles.append(style)
+
+        self.rows.append(row)
+        self.columns.append(column)
+        self.values.append(str(cell.value))
+        self.style_ids.append(self._style_index[style])
+        self.column_spans.append(cell.column_span)
+        self.row_spans.append(cell.row_span)
+
+    def get_cell(self, index):
+        color_name, horizontal_alignment = self.styles[self.style_ids[index]]
+        return GridCell(
+            row=self.rows[index],
+            column=self.columns[index],
+            value=self.values[index],
+            color_name=color_name,
+            horizontal_alignment=horizontal_alignment,
+            column_span=self.column_spans[index],
+            row_span=self.row_spans[index],
+            first_cell=index == 0 or self.rows[index - 1] != self.rows[index],
+            last_cell=index == len(self) - 1)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get_cell(index)
+
+    def find(self, row, column):
+        """
+        Returns the GridCell at row and column or None.
+        """
+        index = bisect_left(self.rows, row)
+        while index < len(self) and self.rows[index] == row:
+            if self.columns[index] == column:
+                return self.get_cell(index)
+            index += 1
+        return None
+
+    def dumps(self):
+        data = dict((name, getattr(self, name)) for name in self.COLUMNS)
+        data['styles'] = self.styles
+        return zlib.compress(json.dumps(data, separators=(',', ':'))
+                             .encode('utf-8'))
+
+    @classmethod
+    def loads(cls, blob):
+        data = json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+        grid = cls()
+        for name in cls.COLUMNS:
+            setattr(grid, name, data[name])
+        grid.styles = [tuple(style) for style in data['styles']]
+        return grid
@@ -0,0 +1,503 @@
+"""
+Importers turn the worksheets of uploaded files into cells of a Document.
+
+The importer of a file is chosen by its extension, see get_importer_class
+and EXCEL_IMPORT_IMPORTERS. XlsxImporter reads xlsx files with openpyxl,
+CsvImporter and OdsImporter stream csv and OpenDocument spreadsheets
+straight to the cell writer. All importers produce the same cells, spans
+and colors as an xlsx file with the same content.
+"""
+import codecs
+import csv
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from xml.etree import ElementTree
+from zipfile import ZipFile
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from openpyxl import Workbook, load_workbook
+from openpyxl.reader.workbook import detect_worksheets
+from openpyxl.utils import get_column_letter
+
+from excel_import.context import ImportContext
+from excel_import.reader import get_used_range, read_sheet_size
+
+# Cell of a csv or ods sheet, hidden cells are covered by a merged range.
+SourceCell = namedtuple('SourceCell', ['value', 'color', 'horizontal',
+                                       'column_span', 'row_span', 'hidden'])
+EMPTY_SOURCE_CELL = SourceCell('', None, None, None, None, False)
+
+
+@contextmanager
+def open_file(file):
+    """
+    Opens file, a path or a file object, for binary reading. File objects
+    are rewound instead and left open.
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as opened:
+            yield opened
+    else:
+        file.seek(0)
+        try:
+            yield file
+        finally:
+            file.seek(0)
+
+
+class Importer(object):
+    """
+    Base class of importers, subclasses implement read_size, parse,
+    read_values and create_workbook.
+    """
+    extensions = ()
+    # Whether create_workbook returns the original workbook, so only the
+    # changed cells need to be written to it, see Document.create_xlsx.
+    patches_original = False
+
+    def __init__(self, document):
+        self.document = document
+
+    @classmethod
+    def list_worksheets(cls, file):
+        """
+        Returns (index, title) of every worksheet of file.
+        """
+        return [(0, 'Sheet1')]
+
+    @classmethod
+    def read_size(cls, file, index):
+        """
+        Returns the number of rows and columns of the used range and the
+        number of merged cell ranges of the worksheet at index, like
+        excel_import.reader.read_sheet_size.
+        """
+        raise NotImplementedError
+
+    def parse(self):
+        """
+        Imports the worksheet of the document.
+        """
+        raise NotImplementedError
+
+    def read_values(self, positions):
+        """
+        Returns the values of the file at positions, (row, column) tuples,
+        as dict.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def shared_context(self):
+        """
+        Returns the ImportContext shared by the sheets of a file, see
+        Document.import_worksheets.
+        """
+        yield ImportContext()
+
+    def create_workbook(self):
+        """
+        Returns an openpyxl workbook and the worksheet the cells of the
+        document are written to by Document.create_xlsx.
+        """
+        raise NotImplementedError
+
+
+class SourceRowsImporter(Importer):
+    """
+    Base class of importers of files that openpyxl cannot read.
+
+    Subclasses implement iter_source_rows, which yields the rows of a
+    worksheet as (row_repeat, runs) tuples. runs is a list of
+    (column_repeat, SourceCell) tuples, so long runs of identical rows
+    and cells are never expanded beyond the used range.
+    """
+
+    @classmethod
+    def iter_source_rows(cls, file, index):
+        raise NotImplementedError
+
+    @classmethod
+    def read_size(cls, file, index):
+        rows, columns, merged_cell_ranges = cls.read_used_range(file, index)
+        return rows, columns, len(merged_cell_ranges)
+
+    @classmethod
+    def read_used_range(cls, file, index):
+        """
+        Returns the used range of the worksheet at index, as
+        excel_import.reader.get_used_range does for xlsx files, and its
+        merged cell ranges.
+        """
+        max_row = max_column = 0
+        merged_cell_ranges = []
+        with open_file(file) as opened:
+            row = 1
+            for row_repeat, runs in cls.iter_source_rows(opened, index):
+                column = 1
+                for column_repeat, cell in runs:
+                    if cell.value or cell.color:
+                        max_row = max(max_row, row + row_repeat - 1)
+                        max_column = max(max_column,
+                                         column + column_repeat - 1)
+                    if cell.column_span or cell.row_span:
+                        for merged_row in range(row, row + row_repeat):
+                            for merged_column in range(
+                                    column, column + column_repeat):
+                                merged_cell_ranges.append('%s%d:%s%d' % (
+                                    get_column_letter(merged_column),
+                                    merged_row,
+                                    get_column_letter(merged_column +
+                                                      (cell.column_span or 1)
+                                                      - 1),
+                                    merged_row + (cell.row_span or 1) - 1))
+                    column += column_repeat
+                row += row_repeat
+        max_row, max_column = get_used_range((max_row, max_column),
+                                             merged_cell_ranges)
+        return max_row, max_column, merged_cell_ranges
+
+    @classmethod
+    def iter_cells(cls, file, index, max_row, max_column):
+        """
+        Yields (row, column, SourceCell) for every cell of the worksheet
+        at index up to max_row and max_column, row by row.
+        """
+        row = 1
+        with open_file(file) as opened:
+            for row_repeat, runs in cls.iter_source_rows(opened, index):
+                for row_index in range(row, min(row + row_repeat,
+                                                max_row + 1)):
+                    column = 1
+                    for column_repeat, cell in runs:
+                        for column_index in range(
+                                column, min(column + column_repeat,
+                                            max_column + 1)):
+                            yield row_index, column_index, cell
+                        column += column_repeat
+                    # Pad short rows.
+                    for column_index in range(column, max_column + 1):
+                        yield row_index, column_index, EMPTY_SOURCE_CELL
+                row += row_repeat
+                if row > max_row:
+                    return
+        # An empty sheet still has a cell, like in openpyxl.
+        for row_index in range(row, max_row + 1):
+            for column_index in range(1, max_column + 1):
+                yield row_index, column_index, EMPTY_SOURCE_CELL
+
+    def iter_rows(self, max_row, max_column):
+        """
+        Yields the Cell instances of every row, see
+        Document.write_prepared_rows.
+        """
+        document = self.document
+        cells = []
+        current_row = 1
+        for row, column, source in self.iter_cells(
+                document.file.path, document.worksheet, max_row,
+                max_column):
+            if row != current_row:
+                yield cells
+                cells = []
+                current_row = row
+            if source.hidden:
+                continue
+            cells.append(document.build_cell(
+                row, column, source.value, not cells, source.color,
+                source.horizontal, source.column_span, source.row_span))
+        yield cells
+
+    def parse(self):
+        """
+        Imports the worksheet of the document. The file is read twice, to
+        find the used range first, memory use does not depend on the
+        size of the file.
+        """
+        document = self.document
+        context = document.import_context
+        with context.timer('used_range'):
+            max_row, max_column, merged_cell_ranges = self.read_used_range(
+                document.file.path, document.worksheet)
+        document._update_import_state(rows_total=max_row)
+        document.write_prepared_rows(self.iter_rows(max_row, max_column))
+        with context.timer('save_colors'):
+            document.save_colors()
+
+    def read_values(self, positions):
+        max_row = max(row for row, column in positions)
+        max_column = max(column for row, column in positions)
+        return dict(((row, column), cell.value) for row, column, cell
+                    in self.iter_cells(self.document.file.path,
+                                       self.document.worksheet,
+                                       max_row, max_column)
+                    if (row, column) in positions)
+
+    def create_workbook(self):
+        """
+        The workbook is rebuilt with the merged cells of the document,
+        the cells are written by Document.create_xlsx.
+        """
+        workbook = Workbook()
+        work_sheet = workbook.active
+        titles = dict(self.list_worksheets(self.document.file.path))
+        work_sheet.title = titles.get(self.document.worksheet,
+                                      work_sheet.title)
+        for cell in self.document.get_cells():
+            if cell.column_span or cell.row_span:
+                work_sheet.merge_cells('%s:%s%d' % (
+                    cell.coordinate,
+                    get_column_letter(cell.column +
+                                      (cell.column_span or 1) - 1),
+                    cell.row + (cell.row_span or 1) - 1))
+        return workbook, work_sheet
+
+
+class XlsxImporter(Importer):
+    """
+    Imports xlsx files with openpyxl, see Document.parse_file_streaming
+    and Document.parse_workbook.
+    """
+    extensions = ('.xlsx', '.xlsm')
+    patches_original = True
+
+    @classmethod
+    def list_worksheets(cls, file):
+        """
+        Only the workbook part and its relationships are read from the
+        archive, no sheet is parsed, so the cost does not depend on the
+        size of the workbook.
+        """
+        with open_file(file) as opened, ZipFile(opened) as archive:
+            return [(index, sheet['title']) for index, sheet
+                    in enumerate(detect_worksheets(archive))]
+
+    @classmethod
+    def read_size(cls, file, index):
+        with open_file(file) as opened, ZipFile(opened) as archive:
+            path = list(detect_worksheets(archive))[index]['path']
+            with archive.open(path) as xml_source:
+                return read_sheet_size(xml_source)
+
+    def parse(self):
+        if getattr(settings, 'EXCEL_IMPORT_STREAMING', False):
+            self.document.parse_file_streaming()
+        else:
+            self.document.parse_workbook()
+
+    def read_values(self, positions):
+        workbook = load_workbook(self.document.file.path, read_only=True)
+        try:
+            work_sheet = workbook.worksheets[self.document.worksheet]
+            range_string = 'A1:%s%d' % (
+                get_column_letter(max(column for row, column in positions)),
+                max(row for row, column in positions))
+            values = dict()
+            for row_index, row in enumerate(
+                    work_sheet.iter_rows(range_string), start=1):
+                for column_index, cell in enumerate(row, start=1):
+                    if (row_index, column_index) in positions:
+                        values[(row_index, column_index)] = cell.value or ""
+            return values
+        finally:
+            workbook._archive.close()
+
+    @contextmanager
+    def shared_context(self):
+        """
+        The workbook is loaded in the mode set by EXCEL_IMPORT_STREAMING,
+        together with its theme colors.
+        """
+        streaming = getattr(settings, 'EXCEL_IMPORT_STREAMING', False)
+        context = ImportContext()
+        with context.timer('load_workbook'):
+            context.workbook = load_workbook(self.document.file.path,
+                                             read_only=streaming)
+        try:
+            context.theme_colors = self.document.parse_theme_colors(
+                context.workbook)
+            yield context
+        finally:
+            if streaming:
+                context.workbook._archive.close()
+
+    def create_workbook(self):
+        workbook = self.document.workbook
+        return workbook, workbook.worksheets[self.document.worksheet]
+
+
+class CsvImporter(SourceRowsImporter):
+    """
+    Imports csv files with a single worksheet. The delimiter is detected,
+    the encoding is EXCEL_IMPORT_CSV_ENCODING.
+    """
+    extensions = ('.csv', '.txt')
+    delimiters = ',;\t'
+
+    @classmethod
+    def get_delimiter(cls, file, encoding):
+        """
+        Returns the delimiter of delimiters found most often in the first
+        line of file, which is rewound.
+        """
+        line = file.readline(64 * 1024).decode(encoding, 'ignore')
+        file.seek(0)
+        return max(cls.delimiters, key=line.count)
+
+    @classmethod
+    def iter_source_rows(cls, file, index):
+        encoding = getattr(settings, 'EXCEL_IMPORT_CSV_ENCODING',
+                           'utf-8-sig')
+        delimiter = cls.get_delimiter(file, encoding)
+        for values in csv.reader(codecs.iterdecode(file, encoding),
+                                 delimiter=delimiter):
+            yield 1, [(1, EMPTY_SOURCE_CELL._replace(value=value))
+                      for value in values]
+
+
+OFFICE_NS = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
+TABLE_NS = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+TEXT_NS = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+STYLE_NS = 'urn:oasis:names:tc:opendocument:xmlns:style:1.0'
+FO_NS = 'urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0'
+
+ODS_TABLE_TAG = '{%s}table' % TABLE_NS
+ODS_ROW_TAG = '{%s}table-row' % TABLE_NS
+ODS_CELL_TAG = '{%s}table-cell' % TABLE_NS
+ODS_COVERED_CELL_TAG = '{%s}covered-table-cell' % TABLE_NS
+ODS_STYLE_TAG = '{%s}style' % STYLE_NS
+ODS_PARAGRAPH_TAG = '{%s}p' % TEXT_NS
+
+# Attributes holding the value of non-string cells.
+ODS_VALUE_ATTRIBUTES = ['{%s}%s' % (OFFICE_NS, name) for name in
+                        ('value', 'date-value', 'time-value',
+                         'boolean-value')]
+ODS_ALIGNMENTS = {
+    'start': 'left',
+    'left': 'left',
+    'center': 'center',
+    'end': 'right',
+    'right': 'right',
+    'justify': 'justify',
+}
+
+
+def get_ods_int(element, name):
+    return int(element.get('{%s}%s' % (TABLE_NS, name), 1))
+
+
+class OdsImporter(SourceRowsImporter):
+    """
+    Imports OpenDocument spreadsheets. content.xml is streamed, finished
+    rows are dropped, so memory use does not depend on the number of rows.
+
+    Fill colors and alignments are read from the automatic cell styles.
+    """
+    extensions = ('.ods',)
+
+    @classmethod
+    def iterparse_content(cls, file):
+        """
+        Yields (event, element) of content.xml, finished rows are removed
+        from the tree.
+        """
+        with ZipFile(file) as archive:
+            with archive.open('content.xml') as xml_source:
+                parents = []
+                for event, element in ElementTree.iterparse(
+                        xml_source, events=('start', 'end')):
+                    if event == 'start':
+                        parents.append(element)
+                    else:
+                        parents.pop()
+                    yield event, element
+                    if event == 'end' and element.tag == ODS_ROW_TAG:
+                        parents[-1].remove(element)
+                        element.clear()
+
+    @classmethod
+    def list_worksheets(cls, file):
+        with open_file(file) as opened:
+            return [(index, element.get('{%s}name' % TABLE_NS)) for index,
+                    element in enumerate(
+                        element for event, element
+                        in cls.iterparse_content(opened)
+                        if event == 'start' and element.tag == ODS_TABLE_TAG)]
+
+    @classmethod
+    def read_style(cls, element):
+        color = horizontal = None
+        for properties in element:
+            background = properties.get('{%s}background-color' % FO_NS)
+            if background and background.startswith('#'):
+                color = 'FF' + background[1:].upper()
+            text_align = properties.get('{%s}text-align' % FO_NS)
+            if text_align:
+                horizontal = ODS_ALIGNMENTS.get(text_align)
+        return color, horizontal
+
+    @classmethod
+    def read_cell(cls, element, styles):
+        if element.tag == ODS_COVERED_CELL_TAG:
+            return EMPTY_SOURCE_CELL._replace(hidden=True)
+
+        value = None
+        for name in ODS_VALUE_ATTRIBUTES:
+            value = element.get(name)
+            if value is not None:
+                break
+        if value is None:
+            value = '\n'.join(''.join(paragraph.itertext()) for paragraph
+                              in element.iter(ODS_PARAGRAPH_TAG))
+        color, horizontal = styles.get(
+            element.get('{%s}style-name' % TABLE_NS), (None, None))
+        column_span = get_ods_int(element, 'number-columns-spanned')
+        row_span = get_ods_int(element, 'number-rows-spanned')
+        return SourceCell(value, color, horizontal,
+                          column_span if column_span > 1 else None,
+                          row_span if row_span > 1 else None,
+                          False)
+
+    @classmethod
+    def iter_source_rows(cls, file, index):
+        styles = dict()
+        table_index = -1
+        for event, element in cls.iterparse_content(file):
+            if event == 'start':
+                if element.tag == ODS_TABLE_TAG:
+                    table_index += 1
+                continue
+
+            if element.tag == ODS_STYLE_TAG and \
+                    element.get('{%s}family' % STYLE_NS) == 'table-cell':
+                styles[element.get('{%s}name' % STYLE_NS)] = \
+                    cls.read_style(element)
+            elif element.tag == ODS_ROW_TAG and table_index == index:
+                yield get_ods_int(element, 'number-rows-repeated'), [
+                    (get_ods_int(cell, 'number-columns-repeated'),
+                     cls.read_cell(cell, styles))
+                    for cell in element
+                    if cell.tag in (ODS_CELL_TAG, ODS_COVERED_CELL_TAG)]
+            elif element.tag == ODS_TABLE_TAG and table_index == index:
+                return
+
+
+IMPORTERS = dict((extension, importer)
+                 for importer in (XlsxImporter, CsvImporter, OdsImporter)
+                 for extension in importer.extensions)
+
+
+def get_importer_class(file):
+    """
+    Returns the importer class for file, a path or file object, by its
+    extension. EXCEL_IMPORT_IMPORTERS maps further extensions to dotted
+    paths of importer classes. Files of unknown type are read as xlsx.
+    """
+    name = file if isinstance(file, str) else file.name
+    extension = os.path.splitext(name or '')[1].lower()
+    importers = getattr(settings, 'EXCEL_IMPORT_IMPORTERS', {})
+    if extension in importers:
+        return import_string(importers[extension])
+    return IMPORTERS.get(extension, XlsxImporter)
@@ -0,0 +1,51 @@
+from openpyxl.utils import range_boundaries
+
+
+class MergedCellIndex(object):
+    """
+    Index of the merged cell ranges of a worksheet keyed by integer row and
+    column.
+
+    Hidden cells are kept as one bitmask per row, span information as a
+    dict keyed by the upper left cell of each range. Both lookups are
+    constant time, independent of the number of merged ranges.
+    """
+
+    def __init__(self, merged_cell_ranges=()):
+        self._hidden = dict()
+        self._spans = dict()
+        for cell_range in merged_cell_ranges:
+            self.add(cell_range)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def add(self, cell_range):
+        min_column, min_row, max_column, max_row = \
+            range_boundaries(cell_range.upper())
+
+        mask = ((1 << (max_column - min_column + 1)) - 1) << min_column
+        for row in range(min_row, max_row + 1):
+            self._hidden[row] = self._hidden.get(row, 0) | mask
+        # The upper left cell is the one that stays visible.
+        self._hidden[min_row] &= ~(1 << min_column)
+
+        column_span = max_column - min_column + 1
+        row_span = max_row - min_row + 1
+        self._spans[(min_row, min_column)] = (
+            column_span if column_span > 1 else None,
+            row_span if row_span > 1 else None)
+
+    def is_hidden(self, row, column):
+        """
+        Returns True if the cell is covered by a merged range but is not
+        its upper left cell.
+        """
+        return bool(self._hidden.get(row, 0) >> column & 1)
+
+    def get_span(self, row, column):
+        """
+        Returns a (column_span, row_span) tuple for the upper left cell of
+        a merged range, spans of a single row or column are None.
+        """
+        return self._spans.get((row, column), (None, None))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0012_document_worksheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='import_status',
+            field=models.IntegerField(default=3, choices=[(1, 'Queued'), (2, 'Parsing'), (3, 'Ready'), (4, 'Failed')]),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='rows_imported',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='rows_total',
+            field=models.IntegerField(default=0),
+        ),
+    ]
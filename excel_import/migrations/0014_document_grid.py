@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0013_document_import_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentGrid',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='storage',
+            field=models.IntegerField(default=1, choices=[(1, 'One row per cell'), (2, 'Columnar grid')]),
+        ),
+        migrations.AddField(
+            model_name='documentgrid',
+            name='document',
+            field=models.OneToOneField(to='excel_import.Document'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+from openpyxl.utils import column_index_from_string
+
+
+def set_row_and_column(apps, schema):
+    """
+    Runs one update per column instead of per cell, the row is cast from
+    the digits after the column letters of the coordinate.
+    """
+    Cell = apps.get_model("excel_import", "Cell")
+    cells = Cell.objects.filter(row__isnull=True)
+    columns = set(
+        re.match('[A-Z]*', coordinate.upper()).group() for coordinate
+        in cells.values_list('coordinate', flat=True).distinct().iterator())
+    columns.discard('')
+    for letters in columns:
+        cells.filter(coordinate__iregex=r'^%s[0-9]+$' % letters).update(
+            column=column_index_from_string(letters),
+            row=models.Func(Substr('coordinate', len(letters) + 1),
+                            template='CAST(%(expressions)s AS INTEGER)',
+                            output_field=models.IntegerField()))
+
+
+def noop(apps, schema):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0014_document_grid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='column',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='row',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_row_and_column, noop),
+        migrations.AlterIndexTogether(
+            name='cell',
+            index_together=set([('document', 'row', 'column')]),
+        ),
+    ]
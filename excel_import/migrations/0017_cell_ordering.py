@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0016_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cell',
+            options={'ordering': ['row', 'column', 'id']},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0017_cell_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='extra_worksheets',
+            field=models.CommaSeparatedIntegerField(max_length=255, blank=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='sheet_of',
+            field=models.ForeignKey(blank=True, null=True, related_name='sheets', to='excel_import.Document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='worksheet_name',
+            field=models.CharField(max_length=31, blank=True),
+        ),
+    ]
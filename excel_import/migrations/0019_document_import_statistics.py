@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0018_document_sheets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='import_statistics',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0019_document_import_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormulaReference',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('min_row', models.IntegerField()),
+                ('min_column', models.IntegerField()),
+                ('max_row', models.IntegerField()),
+                ('max_column', models.IntegerField()),
+                ('document', models.ForeignKey(to='excel_import.Document')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='formula',
+            field=models.CharField(max_length=255, blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='formulareference',
+            name='formula_cell',
+            field=models.ForeignKey(related_name='references', to='excel_import.Cell'),
+        ),
+        migrations.AlterIndexTogether(
+            name='formulareference',
+            index_together=set([('document', 'min_row', 'max_row')]),
+        ),
+    ]
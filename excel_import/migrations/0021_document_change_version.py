@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0020_cell_formula'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='change_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='changed_on',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+    ]
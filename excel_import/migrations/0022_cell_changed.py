@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0021_document_change_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='changed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
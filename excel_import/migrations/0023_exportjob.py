@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_import', '0022_cell_changed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('key', models.CharField(max_length=100)),
+                ('status', models.IntegerField(default=1, choices=[(1, 'Queued'), (2, 'Exporting'), (3, 'Ready'), (4, 'Failed')])),
+                ('rows_exported', models.IntegerField(default=0)),
+                ('rows_total', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(to='excel_import.Document')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportjob',
+            unique_together=set([('document', 'key')]),
+        ),
+    ]
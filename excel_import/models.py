@@ -1,15 +1,63 @@
+import json
+import time
+import uuid
+from collections import OrderedDict
 from xml.etree import ElementTree
 
 import struct
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import Case, F, Q, Value, When
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
 from openpyxl import load_workbook
 from openpyxl.styles.colors import COLOR_INDEX
+from openpyxl.utils import (
+    coordinate_to_tuple,
+    get_column_letter,
+    range_boundaries,
+)
+from openpyxl.utils.exceptions import CellCoordinatesException
 from openpyxl.writer.excel import save_virtual_workbook
 
+from excel_import.context import ImportContext
+from excel_import.exports import get_export_key, invalidate_exports, \
+    stream_export
+from excel_import.formulas import (
+    FormulaError,
+    evaluate,
+    get_references,
+    parse_formula,
+    split_formula,
+)
+from excel_import.grid import CellDisplayMixin, Grid
+from excel_import.importers import get_importer_class
+from excel_import.merged import MergedCellIndex
+from excel_import.parallel import (
+    BAND_FIELDS,
+    get_import_workers,
+    prepare_bands,
+)
+from excel_import.reader import (
+    get_content_bounds,
+    get_style_key,
+    get_used_range,
+    iter_sheet_rows,
+    scan_sheet,
+)
+from excel_import.signals import document_copied, document_imported
+from excel_import.storage import hash_file
+from excel_import.writers import (
+    DiffCellWriter,
+    GridCellWriter,
+    copy_document_rows,
+    get_cell_writer,
+)
+from excel_import.xlsx import iter_patched_xlsx, iter_xlsx
+
 import logging
 
 logger = logging.getLogger(__name__)
@@ -57,6 +105,18 @@ class Document(models.Model):
     STATUS = ((OPEN, _("Open")),
               (REQUEST_ONLY, _("Semi locked")),
               (LOCKED, _("Locked")))
+    QUEUED = 1
+    PARSING = 2
+    READY = 3
+    FAILED = 4
+    IMPORT_STATUS = ((QUEUED, _("Queued")),
+                     (PARSING, _("Parsing")),
+                     (READY, _("Ready")),
+                     (FAILED, _("Failed")))
+    ROWS = 1
+    GRID = 2
+    STORAGE = ((ROWS, _("One row per cell")),
+               (GRID, _("Columnar grid")))
     file = models.FileField(blank=True, null=True)
     replaces = models.ForeignKey('self', blank=True, null=True, )
     name = models.CharField(max_length=100)
@@ -64,11 +124,30 @@ class Document(models.Model):
     current = models.BooleanField(default=True)
     status = models.IntegerField(choices=STATUS, default=OPEN)
     worksheet = models.IntegerField(default=0)
+    import_status = models.IntegerField(choices=IMPORT_STATUS, default=READY)
+    rows_imported = models.IntegerField(default=0)
+    rows_total = models.IntegerField(default=0)
+    storage = models.IntegerField(choices=STORAGE, default=ROWS)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    worksheet_name = models.CharField(max_length=31, blank=True)
+    extra_worksheets = models.CommaSeparatedIntegerField(max_length=255,
+                                                         blank=True)
+    sheet_of = models.ForeignKey('self', blank=True, null=True,
+                                 related_name='sheets')
+    # JSON, see get_import_statistics.
+    import_statistics = models.TextField(blank=True, editable=False)
+    # Incremented whenever cell values change after the import, see
+    # mark_changed.
+    change_version = models.IntegerField(default=0, editable=False)
+    changed_on = models.DateTimeField(null=True, blank=True, editable=False)
 
     objects = DocumentManager()
 
-    _theme_colors = []
-    _color_set = set()
+    _context = None
+    # Set on the documents of further sheets by create_sheet, they are
+    # imported by import_worksheets of the document of the upload instead
+    # of on save. Revisions of a sheet are imported on save again.
+    imported_by_parent = False
 
     def __str__(self):
         return self.name
@@ -77,14 +156,670 @@ class Document(models.Model):
         parse_file = False
         if not self.pk:
             if self.current:
-                Document.objects.filter(
+                replaced = Document.objects.filter(
                     (Q(replaces=self.replaces) & Q(replaces__isnull=False)) |
-                    Q(id=self.replaces_id)).update(current=False)
+                    Q(id=self.replaces_id))
+                Document.objects.filter(sheet_of__in=replaced) \
+                    .update(current=False)
+                replaced.update(current=False)
             parse_file = True
+            self.import_status = Document.QUEUED
+            if getattr(settings, 'EXCEL_IMPORT_GRID_STORAGE', False):
+                self.storage = Document.GRID
+            if self.file and not self.content_hash:
+                self.content_hash = hash_file(self.file)
         super(Document, self).save(*args, **kwargs)
 
-        if parse_file:
-            self.parse_file()
+        # With EXCEL_IMPORT_ASYNC the import is queued by
+        # frontend.signals.document_save_handler instead. Further sheets
+        # are imported together with the document of the upload.
+        if parse_file and not self.imported_by_parent and \
+                not getattr(settings, 'EXCEL_IMPORT_ASYNC', False):
+            self.import_file()
+
+    def mark_changed(self):
+        """
+        Records that cell values changed, which invalidates the cached
+        exports of the document, see excel_import.exports.
+        """
+        self._update_import_state(change_version=F('change_version') + 1,
+                                  changed_on=timezone.now())
+        self.refresh_from_db(fields=['change_version'])
+        invalidate_exports(self)
+        # Jobs of older versions are not polled anymore.
+        self.exportjob_set.exclude(key=get_export_key(self)).delete()
+
+    @property
+    def last_modified(self):
+        return self.changed_on or self.created
+
+    def get_import_statistics(self):
+        """
+        Returns the statistics of the last import as dict: the method,
+        'parse', 'revision' or 'copy', the seconds spent per phase and in
+        total, and the number of cells, colors and merged cell ranges.
+        Revisions have the numbers of added, changed, removed and unchanged
+        cells as 'diff'.
+        """
+        if not self.import_statistics:
+            return {}
+        return json.loads(self.import_statistics,
+                          object_pairs_hook=OrderedDict)
+
+    @property
+    def is_ready(self):
+        return self.import_status == Document.READY
+
+    @property
+    def import_progress(self):
+        if not self.rows_total:
+            return 0
+        return min(100, 100 * self.rows_imported // self.rows_total)
+
+    def _update_import_state(self, **kwargs):
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+        # Use update() to leave all other fields and post_save alone.
+        Document.objects.filter(pk=self.pk).update(**kwargs)
+
+    def report_progress(self, rows_imported, force=False):
+        interval = getattr(settings, 'EXCEL_IMPORT_PROGRESS_INTERVAL', 100)
+        if force or rows_imported % interval == 0:
+            self._update_import_state(rows_imported=rows_imported)
+
+    def find_duplicate(self):
+        """
+        Returns the latest imported document with the same content hash,
+        worksheet and storage engine, or None.
+        """
+        if not self.content_hash or \
+                not getattr(settings, 'EXCEL_IMPORT_DEDUPLICATE', False):
+            return None
+        return Document.objects.filter(
+            content_hash=self.content_hash,
+            worksheet=self.worksheet,
+            storage=self.storage,
+            import_status=Document.READY) \
+            .exclude(pk=self.pk).order_by('-pk').first()
+
+    def copy_cells(self, source):
+        """
+        Copies the imported cells and colors of source, a document with
+        identical content, in the database instead of parsing the file.
+
+        Cell rows may carry values of accepted change requests, receivers
+        of document_copied reset those with reset_cells.
+        """
+        context = self.import_context
+        with context.timer('copy'):
+            if self.storage == Document.GRID:
+                # Changed cells of a grid live in materialized Cell rows,
+                # the grid itself keeps the values of the file.
+                copy_document_rows(DocumentGrid, source.pk, self.pk)
+            else:
+                context.cells = copy_document_rows(Cell, source.pk, self.pk)
+            copy_document_rows(DocumentColors, source.pk, self.pk)
+        self._update_import_state(rows_total=source.rows_total)
+        document_copied.send(sender=Document, document=self, source=source)
+
+    def get_previous_revision(self):
+        """
+        Returns the latest imported revision before this document, or
+        None.
+        """
+        if not self.replaces_id:
+            return None
+        return Document.objects.filter(
+            Q(pk=self.replaces_id) | Q(replaces_id=self.replaces_id),
+            pk__lt=self.pk,
+            import_status=Document.READY) \
+            .order_by('-pk').first()
+
+    def import_revision(self, previous):
+        """
+        Imports the file as changes to the cells of the previous revision.
+
+        The cells of previous are copied in the database, afterwards only
+        changed, added and removed cells are written. The result is the
+        same as a full import. Returns a summary of the differences, which
+        is kept in the import statistics as well.
+        """
+        context = self.import_context
+        with context.timer('copy'):
+            copy_document_rows(Cell, previous.pk, self.pk)
+        writer = context.cell_writer = DiffCellWriter(Cell, self)
+        self.parse_file()
+
+        logger.info("Imported document %d as revision of document %d: "
+                    "%d cells added, %d changed, %d removed, %d unchanged"
+                    % (self.pk, previous.pk, writer.added, writer.changed,
+                       writer.removed, writer.unchanged))
+        context.diff = writer.summary
+        return writer.summary
+
+    def reset_cells(self, coordinates):
+        """
+        Sets the cells at coordinates back to their values in the file.
+        """
+        cells = dict(((cell.row, cell.column), cell) for cell in
+                     self.cell_set.in_bulk_coordinates(coordinates).values())
+        if not cells:
+            return
+
+        values = self.get_importer().read_values(set(cells))
+        for position, value in values.items():
+            cell = cells[position]
+            cell.value, cell.formula = split_formula(value)
+            cell.changed = False
+            Cell.objects.filter(pk=cell.pk).update(value=cell.value,
+                                                   formula=cell.formula,
+                                                   changed=False)
+        self.recalculate(cells.values())
+        self.mark_changed()
+
+    def build_formulas(self):
+        """
+        Builds the dependency graph of the formula cells, a
+        FormulaReference per range a formula reads, and calculates their
+        values. Cells of a grid keep their formulas as values.
+        """
+        if self.storage == Document.GRID:
+            return
+        FormulaReference.objects.filter(document=self).delete()
+        cells = list(self.cell_set.exclude(formula=''))
+        self.save_references(cells)
+        self.calculate(cells, preload=True)
+
+    def recalculate(self, cells):
+        """
+        Recalculates the formulas that depend on cells, directly or
+        through other formulas, after their values or formulas changed.
+        Formulas of cells are calculated as well. Only the dependent cells
+        and the ranges their formulas read are loaded, see
+        get_dependent_cells. The dependent cells are marked as changed if
+        a cell they read is, see update_changed.
+        """
+        cells = list(cells)
+        FormulaReference.objects.filter(formula_cell__in=cells).delete()
+        formula_cells = [cell for cell in cells if cell.formula]
+        self.save_references(formula_cells)
+        dependents = dict((cell.pk, cell)
+                          for cell in self.get_dependent_cells(cells))
+        dependents.update((cell.pk, cell) for cell in formula_cells)
+        self.calculate(dependents.values())
+        for cell in cells:
+            dependents.pop(cell.pk, None)
+        self.update_changed(dependents.values())
+
+    def update_changed(self, cells):
+        """
+        Sets Cell.changed of the formula cells, which is True if a cell
+        they read, directly or through other formulas, is changed. Their
+        values equal those calculated by the import otherwise, e.g. after
+        a change request was revoked.
+        """
+        cells = dict((cell.pk, cell) for cell in cells)
+        if not cells:
+            return
+        references = dict((pk, []) for pk in cells)
+        for reference in FormulaReference.objects.filter(
+                formula_cell__in=list(cells)).values_list(
+                    'formula_cell', 'min_row', 'min_column', 'max_row',
+                    'max_column'):
+            references[reference[0]].append(reference[1:])
+        # Only edited cells are changed, there are few of them.
+        changed = set(self.cell_set.filter(changed=True)
+                      .exclude(pk__in=list(cells))
+                      .values_list('row', 'column'))
+
+        unchanged = set(cells)
+        found = True
+        while found:
+            found = False
+            for pk in list(unchanged):
+                if any(min_row <= row <= max_row and
+                       min_column <= column <= max_column
+                       for min_row, min_column, max_row, max_column
+                       in references[pk]
+                       for row, column in changed):
+                    unchanged.discard(pk)
+                    changed.add((cells[pk].row, cells[pk].column))
+                    found = True
+        for pk, cell in cells.items():
+            cell.changed = pk not in unchanged
+        Cell.objects.filter(pk__in=list(unchanged)).update(changed=False)
+        Cell.objects.filter(pk__in=[pk for pk in cells
+                                    if pk not in unchanged]) \
+            .update(changed=True)
+
+    def save_references(self, cells):
+        """
+        Saves the ranges read by the formulas of cells as
+        FormulaReference rows.
+        """
+        references = []
+        for cell in cells:
+            try:
+                ranges = get_references(parse_formula(cell.formula))
+            except FormulaError:
+                continue
+            references.extend(
+                FormulaReference(document=self, formula_cell=cell,
+                                 min_row=min_row, min_column=min_column,
+                                 max_row=max_row, max_column=max_column)
+                for min_row, min_column, max_row, max_column in ranges)
+        FormulaReference.objects.bulk_create(references)
+
+    def get_dependent_cells(self, cells):
+        """
+        Returns the formula cells that read one of cells, directly or
+        through other formulas.
+        """
+        dependents = dict()
+        positions = set((cell.row, cell.column) for cell in cells
+                        if cell.row is not None)
+        pending = list(positions)
+        while pending:
+            # Keeps the number of query terms below the limits of SQLite.
+            batch, pending = pending[:100], pending[100:]
+            query = Q()
+            for row, column in batch:
+                query |= Q(min_row__lte=row, max_row__gte=row,
+                           min_column__lte=column, max_column__gte=column)
+            for reference in FormulaReference.objects.filter(
+                    query, document=self).select_related('formula_cell'):
+                cell = reference.formula_cell
+                dependents[cell.pk] = cell
+                if (cell.row, cell.column) not in positions:
+                    positions.add((cell.row, cell.column))
+                    pending.append((cell.row, cell.column))
+        return list(dependents.values())
+
+    def calculate(self, cells, preload=False):
+        """
+        Calculates the formulas of cells in dependency order and saves the
+        changed values. Formulas in a circular reference evaluate to #REF!,
+        unsupported formulas are kept as value. Returns the cells with a
+        new value.
+
+        The ranges read by the formulas are loaded one by one, which suits
+        the few formulas of recalculate. With preload, the values of the
+        area spanning all ranges are loaded in one query instead, e.g. for
+        all formulas of an import.
+        """
+        expressions = dict()
+        references = dict()
+        for cell in cells:
+            try:
+                expression = parse_formula(cell.formula)
+            except FormulaError:
+                expression = cell.formula
+            expressions[(cell.row, cell.column)] = (cell, expression)
+            references[(cell.row, cell.column)] = \
+                [] if isinstance(expression, str) \
+                else get_references(expression)
+
+        # Formulas of cells read by other formulas of cells come first.
+        precedents = dict((position, set()) for position in expressions)
+        for position, ranges in references.items():
+            for min_row, min_column, max_row, max_column in ranges:
+                area = (max_row - min_row + 1) * (max_column - min_column + 1)
+                if area <= len(expressions):
+                    candidates = ((row, column)
+                                  for row in range(min_row, max_row + 1)
+                                  for column in range(min_column,
+                                                      max_column + 1))
+                else:
+                    candidates = expressions
+                precedents[position].update(
+                    (row, column) for row, column in candidates
+                    if min_row <= row <= max_row and
+                    min_column <= column <= max_column and
+                    (row, column) in expressions)
+        dependents = dict((position, []) for position in expressions)
+        for position, positions in precedents.items():
+            for precedent in positions:
+                dependents[precedent].append(position)
+        order = [position for position, positions in precedents.items()
+                 if not positions]
+        for position in order:
+            for dependent in dependents[position]:
+                precedents[dependent].discard(position)
+                if not precedents[dependent]:
+                    order.append(dependent)
+
+        values = dict()
+        loaded = set()
+
+        def load(min_row, min_column, max_row, max_column):
+            if (min_row, min_column, max_row, max_column) not in loaded:
+                loaded.add((min_row, min_column, max_row, max_column))
+                for row, column, value in self.cell_set \
+                        .in_rows(min_row, max_row) \
+                        .in_columns(min_column, max_column) \
+                        .values_list('row', 'column', 'value'):
+                    values.setdefault((row, column), value)
+
+        ranges = [area for areas in references.values() for area in areas]
+        if preload and ranges:
+            load(min(area[0] for area in ranges),
+                 min(area[1] for area in ranges),
+                 max(area[2] for area in ranges),
+                 max(area[3] for area in ranges))
+
+        def get_range(min_row, min_column, max_row, max_column):
+            if self.rows_total:
+                # Cells beyond the imported rows are empty.
+                max_row = min(max_row, max(self.rows_total, min_row))
+            if not preload:
+                load(min_row, min_column, max_row, max_column)
+            return [calculated.get((row, column),
+                                   values.get((row, column), ''))
+                    for row in range(min_row, max_row + 1)
+                    for column in range(min_column, max_column + 1)]
+
+        calculated = dict()
+        for position in order:
+            cell, expression = expressions[position]
+            if isinstance(expression, str):
+                calculated[position] = expression
+            else:
+                calculated[position] = evaluate(expression, get_range)[:255]
+        for position in expressions:
+            if position not in calculated:
+                calculated[position] = '#REF!'
+
+        changed = []
+        for position, value in calculated.items():
+            cell = expressions[position][0]
+            if cell.value != value:
+                cell.value = value
+                changed.append(cell)
+        # One query per batch of cells instead of per cell, the batches
+        # stay below the limit of query variables of SQLite.
+        for start in range(0, len(changed), 300):
+            batch = changed[start:start + 300]
+            Cell.objects.filter(pk__in=[cell.pk for cell in batch]).update(
+                value=Case(*[When(pk=cell.pk, then=Value(cell.value))
+                             for cell in batch],
+                           output_field=models.CharField()))
+        return changed
+
+    def parse_scratch_copy(self):
+        """
+        Parses the file of the document into a new document that is not
+        current and returns it. Unlike import_file, cells are never copied
+        from duplicates or previous revisions, so the result reflects the
+        current import code. See replace_cells.
+        """
+        name = 'reimport %d %s' % (self.pk, uuid.uuid4().hex)
+        # bulk_create does not start an import like save.
+        Document.objects.bulk_create([Document(
+            file=self.file.name, name=name, current=False,
+            status=self.status, worksheet=self.worksheet,
+            worksheet_name=self.worksheet_name, storage=self.storage,
+            content_hash=self.content_hash,
+            import_status=Document.PARSING)])
+        scratch = Document.objects.get(name=name)
+
+        scratch._context = ImportContext()
+        try:
+            scratch.parse_file()
+            with scratch.import_context.timer('formulas'):
+                scratch.build_formulas()
+            scratch._update_import_state(
+                import_status=Document.READY,
+                rows_imported=scratch.rows_total,
+                import_statistics=json.dumps(
+                    scratch.import_context.get_statistics('parse')))
+        except Exception:
+            scratch.delete()
+            raise
+        finally:
+            scratch._context = None
+        return scratch
+
+    def replace_cells(self, source, keep=(), keep_values=()):
+        """
+        Replaces the cells, colors and grid of the document with those of
+        source, see parse_scratch_copy, in a single transaction and
+        deletes source.
+
+        The cells with a primary key in keep, e.g. targets of change
+        requests, stay in place and take the attributes of the cell of
+        source at the same position, except for their value and formula if
+        they are in keep_values as well. Returns the number of kept cells
+        without such a cell, these are left unchanged.
+        """
+        keep = set(keep)
+        keep_values = set(keep_values)
+        fields = ['coordinate', 'value', 'formula', 'color_name',
+                  'row_span', 'column_span', 'horizontal_alignment',
+                  'first_cell', 'last_cell']
+        with transaction.atomic():
+            kept = list(self.cell_set.filter(pk__in=keep))
+            if source.storage == Document.GRID:
+                grid = source.documentgrid.grid
+                replacements = dict(
+                    (cell.pk, grid.find(cell.row, cell.column))
+                    for cell in kept)
+            else:
+                source_cells = source.cell_set.in_bulk_coordinates(
+                    cell.coordinate for cell in kept)
+                replacements = dict(
+                    (cell.pk, source_cells.get(cell.coordinate))
+                    for cell in kept)
+                Cell.objects.filter(pk__in=[
+                    cell.pk for cell in source_cells.values()]).delete()
+
+            orphaned = 0
+            for cell in kept:
+                replacement = replacements[cell.pk]
+                if replacement is None:
+                    orphaned += 1
+                    continue
+                for field in fields:
+                    if field in ('value', 'formula') and \
+                            cell.pk in keep_values:
+                        continue
+                    setattr(cell, field, getattr(replacement, field, ''))
+                cell.changed = cell.pk in keep_values
+                cell.save()
+
+            FormulaReference.objects.filter(
+                document__in=[self, source]).delete()
+            self.cell_set.exclude(pk__in=keep).delete()
+            Cell.objects.filter(document=source).update(document=self)
+            self.documentcolors_set.all().delete()
+            DocumentColors.objects.filter(document=source).update(
+                document=self)
+            DocumentGrid.objects.filter(document=self).delete()
+            DocumentGrid.objects.filter(document=source).update(
+                document=self)
+            self._update_import_state(
+                rows_total=source.rows_total,
+                rows_imported=source.rows_total,
+                import_statistics=source.import_statistics,
+                import_status=Document.READY)
+            source.delete()
+            self.build_formulas()
+            # Formulas reading kept values are calculated from them.
+            changed = [cell for cell in kept if cell.changed]
+            self.update_changed(
+                cell for cell in self.get_dependent_cells(changed)
+                if cell.pk not in keep_values)
+        self.mark_changed()
+        return orphaned
+
+    def get_extra_worksheets(self):
+        """
+        Returns the indexes of the further sheets to import with this
+        document.
+        """
+        indexes = set(int(index) for index
+                      in self.extra_worksheets.split(',') if index)
+        indexes.discard(self.worksheet)
+        return sorted(indexes)
+
+    def create_sheet(self, index, title):
+        """
+        Creates the document of a further sheet of the file, its import
+        is left to import_worksheets.
+        """
+        replaces = None
+        previous = self.get_previous_revision()
+        if previous is not None:
+            replaces = previous.sheets.filter(worksheet=index).first()
+        sheet = Document(
+            file=self.file.name,
+            name=('%s - %s' % (self.name, title))[:100],
+            status=self.status,
+            worksheet=index,
+            worksheet_name=title,
+            content_hash=self.content_hash,
+            sheet_of=self,
+            replaces_id=replaces and (replaces.replaces_id or replaces.pk))
+        sheet.imported_by_parent = True
+        sheet.save()
+        return sheet
+
+    def import_worksheets(self):
+        """
+        Imports the sheet of this document and every sheet of
+        extra_worksheets in a single pass. The workbook, its styles and
+        theme colors are loaded only once and shared by all sheets, see
+        ImportContext.for_sheet and Importer.shared_context.
+        """
+        importer = self.get_importer()
+        titles = dict(importer.list_worksheets(self.file.path))
+        with importer.shared_context() as context:
+            self.import_file(context)
+
+            for index in self.get_extra_worksheets():
+                sheet = self.create_sheet(index, titles[index])
+                try:
+                    sheet.import_file(context.for_sheet())
+                except Exception:
+                    # Logged and marked as failed by import_file, the
+                    # other sheets are imported anyway.
+                    pass
+
+    @property
+    def import_context(self):
+        """
+        The ImportContext of the running import, see import_file.
+        """
+        if self._context is None:
+            self._context = ImportContext()
+        return self._context
+
+    def import_file(self, context=None):
+        """
+        Parses the file and tracks the import in import_status. Cells of
+        a document with identical content are copied instead, see
+        EXCEL_IMPORT_DEDUPLICATE, new revisions are imported as changes
+        to their previous revision, see EXCEL_IMPORT_INCREMENTAL.
+
+        Documents with extra_worksheets are imported by import_worksheets,
+        which passes a context holding the workbook loaded in the mode set
+        by EXCEL_IMPORT_STREAMING. The context of the import is released
+        afterwards, whether it succeeded or not.
+
+        Cells of a failed import are removed again before the exception
+        is re-raised. document_imported is sent once the cells exist.
+        """
+        if context is None and self.get_extra_worksheets():
+            self.import_worksheets()
+            return
+
+        self._context = context or ImportContext()
+        try:
+            self._import_file()
+        finally:
+            self._context = None
+
+    def update_worksheet_name(self):
+        """
+        Sets worksheet_name to the title of the imported sheet. Revisions
+        inherit the name of the document they replace, but may import
+        another sheet.
+        """
+        workbook = self.import_context.workbook
+        if workbook is not None:
+            title = workbook.worksheets[self.worksheet].title
+        elif self.file:
+            titles = dict(self.get_importer().list_worksheets(
+                self.file.path))
+            title = titles.get(self.worksheet, '')
+        else:
+            return
+        title = title[:31]
+        if title != self.worksheet_name:
+            self.worksheet_name = title
+            Document.objects.filter(pk=self.pk).update(
+                worksheet_name=self.worksheet_name)
+
+    def _import_file(self):
+        self._update_import_state(import_status=Document.PARSING,
+                                  rows_imported=0)
+        try:
+            self.update_worksheet_name()
+            source = self.find_duplicate()
+            previous = self.get_previous_revision()
+            if source is not None:
+                logger.info("Copying cells of document %d with identical "
+                            "content to document %d" % (source.pk, self.pk))
+                method = 'copy'
+                self.copy_cells(source)
+            elif previous is not None and \
+                    previous.storage == self.storage == Document.ROWS and \
+                    getattr(settings, 'EXCEL_IMPORT_INCREMENTAL', False):
+                method = 'revision'
+                self.import_revision(previous)
+            else:
+                method = 'parse'
+                self.parse_file()
+            with self.import_context.timer('formulas'):
+                self.build_formulas()
+        except Exception:
+            logger.exception("Importing document %s failed" % self.pk)
+            self.cell_set.all().delete()
+            self.documentcolors_set.all().delete()
+            DocumentGrid.objects.filter(document=self).delete()
+            self._update_import_state(import_status=Document.FAILED)
+            raise
+
+        self._update_import_state(import_status=Document.READY,
+                                  rows_imported=self.rows_total)
+        # Exports made from a previous import are not served anymore.
+        self.mark_changed()
+        self.import_statistics = json.dumps(
+            self.import_context.get_statistics(method))
+        # save() instead of update(), so that post_save receivers like
+        # frontend.signals.document_save_handler log the statistics.
+        self.save(update_fields=['import_statistics'])
+        document_imported.send(sender=Document, document=self)
+
+    def get_cells(self):
+        """
+        Returns the cells of the document in display order, independent of
+        the storage engine.
+        """
+        if self.storage == Document.GRID:
+            return self.documentgrid.get_cells()
+        return self.cell_set.all()
+
+    def get_cell(self, coordinate):
+        """
+        Returns the Cell at coordinate. Cells of a grid are materialized
+        as Cell rows on first access, so change requests can refer to them.
+        """
+        try:
+            return self.cell_set.at(coordinate)
+        except Cell.DoesNotExist:
+            if not self.storage == Document.GRID:
+                raise
+        return self.documentgrid.materialize(coordinate)
 
     _workbook = None
 
@@ -94,41 +829,17 @@ class Document(models.Model):
             self._workbook = load_workbook(self.file.path)
         return self._workbook
 
-    _skip_list = None
-
     @property
-    def skip_list(self):
-        if not self._skip_list:
-            self.create_skip_and_start_list()
-        return self._skip_list
-
-    _start_cells = None
+    def merged_index(self):
+        if self.import_context.merged_index is None:
+            self.create_merged_index()
+        return self.import_context.merged_index
 
-    @property
-    def start_cells(self):
-        if not self._start_cells:
-            self.create_skip_and_start_list()
-        return self._start_cells
-
-    def create_skip_and_start_list(self):
-        start_cells = dict()
-        work_sheet = self.workbook.worksheets[self.worksheet]
-
-        skip_list = work_sheet.merged_cells.copy()
-        for cell_range in work_sheet.merged_cell_ranges:
-            start, end = cell_range.split(':')
-            skip_list.remove(start)
-
-            column_span, row_span = get_span(start, end)
-            cell_span = dict()
-            if row_span:
-                cell_span['row_span'] = row_span
-            if column_span:
-                cell_span['column_span'] = column_span
-            start_cells[start] = cell_span
-
-        self._start_cells = start_cells
-        self._skip_list = skip_list
+    def create_merged_index(self):
+        workbook = self.import_context.workbook or self.workbook
+        work_sheet = workbook.worksheets[self.worksheet]
+        self.import_context.merged_index = MergedCellIndex(
+            work_sheet.merged_cell_ranges)
 
     def get_theme_color(self, cell):
         fg_color = cell.fill.fgColor
@@ -136,33 +847,93 @@ class Document(models.Model):
             return None
 
         theme_index = fg_color.value
-        if not self._theme_colors:
-            self._theme_colors = self.parse_theme_colors()
+        context = self.import_context
+        if context.theme_colors is None:
+            context.theme_colors = self.parse_theme_colors(context.workbook)
         try:
-            return self._theme_colors[theme_index]
+            return context.theme_colors[theme_index]
         except IndexError:
             return None
 
-    def create_xlsx(self):
-        workbook = self.workbook
-        work_sheet = workbook.worksheets[self.worksheet]
+    def get_importer(self):
+        """
+        Returns the importer for the type of the file, see
+        excel_import.importers.get_importer_class.
+        """
+        return get_importer_class(self.file.name)(self)
+
+    def iter_xlsx(self, report=None):
+        """
+        Yields an xlsx file of the cells in chunks, see excel_import.xlsx.
+        Unlike create_xlsx, the original file is not read and memory use
+        does not depend on the number of cells. report is called with the
+        number of every row written.
+        """
+        cells = self.get_cells()
+        if self.storage == Document.ROWS:
+            # Rows are fetched in chunks instead of all at once.
+            cells = cells.iterator()
+        colors = dict(self.documentcolors_set.values_list('name', 'color'))
+        return iter_xlsx(cells, colors, self.worksheet_name or 'Sheet1',
+                         report)
+
+    def iter_values(self):
+        """
+        Returns an iterator over (row, column, value) of the cells in row
+        order, see excel_import.values. Cells stored in rows are fetched
+        in chunks without creating model instances.
+        """
+        if self.storage == Document.GRID:
+            return ((cell.row, cell.column, cell.value)
+                    for cell in self.get_cells())
+        return self.cell_set.order_by('row', 'column') \
+            .values_list('row', 'column', 'value').iterator()
+
+    def get_changed_cells(self):
+        """
+        Returns an iterator over (row, column, value, formula) of the cells
+        changed after the import, the only ones that can differ from the
+        file.
+        """
+        return self.cell_set.filter(changed=True).order_by() \
+            .values_list('row', 'column', 'value', 'formula').iterator()
+
+    def iter_patched_xlsx(self, report=None):
+        """
+        Yields a copy of the original file with the changed cells replaced,
+        see excel_import.xlsx. Only works for xlsx files, see
+        Importer.patches_original.
+        """
+        return iter_patched_xlsx(self.file.path, self.worksheet,
+                                 self.get_changed_cells(), report)
 
-        for cell in self.cell_set.all():
-            work_sheet[cell.coordinate].value = cell.value
+    def create_xlsx(self):
+        importer = self.get_importer()
+        workbook, work_sheet = importer.create_workbook()
+
+        if importer.patches_original:
+            cells = self.get_changed_cells()
+        else:
+            cells = ((cell.row, cell.column, cell.value,
+                      getattr(cell, 'formula', ''))
+                     for cell in self.get_cells())
+        for row, column, value, formula in cells:
+            work_sheet.cell(row=row, column=column).value = formula or value
         return save_virtual_workbook(workbook)
 
     @property
     def url_id(self):
         return self.replaces_id or self.pk
 
-    def parse_theme_colors(self):
+    def parse_theme_colors(self, workbook=None):
+        workbook = workbook or self.workbook
         colors = []
-        if not self.workbook.loaded_theme:
+        if not workbook.loaded_theme:
             return colors
         try:
             name_space = {
                 'ns': "http://schemas.openxmlformats.org/drawingml/2006/main"}
-            root = ElementTree.fromstring(self.workbook.loaded_theme)
+            root = ElementTree.fromstring(workbook.loaded_theme)
             theme_elements = root.find('ns:themeElements', name_space)
             color_schemes = theme_elements.findall('ns:clrScheme', name_space)
             first_color_scheme = color_schemes[0]
@@ -184,13 +955,19 @@ class Document(models.Model):
         return ''.join(['color_', color])
 
     def save_colors(self):
-        for color in self._color_set:
-            name = Document.get_name_for_color(color)
-            DocumentColors.objects.create(document=self,
-                                          color=color,
-                                          name=name)
-
-    def get_color_from_cell(self, cell):
+        """
+        Saves the colors used by the imported cells with a single insert.
+        """
+        DocumentColors.objects.bulk_create(
+            DocumentColors(document=self,
+                           color=color,
+                           name=Document.get_name_for_color(color))
+            for color in sorted(self.import_context.colors))
+
+    def get_color_value(self, cell):
+        """
+        Returns the fill color of cell as ARGB hex string or None.
+        """
         color = cell.fill.fgColor
         color_value = None
 
@@ -206,60 +983,307 @@ class Document(models.Model):
             tint = "%02X" % int(color.tint * 255)
             color_value = ''.join([tint, theme_color])
 
+        return color_value or None
+
+    def get_color_from_cell(self, cell):
+        color_value = self.get_color_value(cell)
         if not color_value:
             return ""
 
-        name = Document.get_name_for_color(color_value)
-        self._color_set.add(color_value)
-        return name
+        self.import_context.colors.add(color_value)
+        return Document.get_name_for_color(color_value)
 
-    def prepare_cell(self, cell, is_first_cell):
-        color_name = self.get_color_from_cell(cell)
-        row_span = None
-        column_span = None
+    def get_cell_style(self, cell):
+        """
+        Returns the color name and horizontal alignment of cell.
 
-        if cell.coordinate in self.start_cells:
-            row_span = self.start_cells[cell.coordinate].get('row_span',  None)
-            column_span = self.start_cells[cell.coordinate].get('column_span',
-                                                                None)
+        Most cells share a few styles, so both are resolved once per style
+        and workbook, see get_style_key. The styles are kept in the import
+        context, which is shared by all sheets of a workbook.
+        """
+        context = self.import_context
+        key = get_style_key(cell)
+        try:
+            color_name, horizontal, color_value = context.styles[key]
+        except KeyError:
+            color_value = self.get_color_value(cell)
+            color_name = ""
+            if color_value:
+                color_name = Document.get_name_for_color(color_value)
+            horizontal = cell.alignment.horizontal
+            context.styles[key] = (color_name, horizontal, color_value)
+        if color_value:
+            # A cached style may come from another sheet.
+            context.colors.add(color_value)
+        return color_name, horizontal
+
+    def prepare_cell(self, cell, row, column, is_first_cell,
+                     column_span=None, row_span=None):
+        color_name, horizontal_alignment = self.get_cell_style(cell)
+        value, formula = split_formula(cell.value or "")
         db_cell = Cell(coordinate=cell.coordinate,
-                       value=cell.value or "",
+                       row=row,
+                       column=column,
+                       value=value,
+                       formula=formula,
                        color_name=color_name,
                        row_span=row_span,
                        column_span=column_span,
                        document=self,
-                       horizontal_alignment=cell.alignment.horizontal,
+                       horizontal_alignment=horizontal_alignment,
                        first_cell=is_first_cell, )
         return db_cell
 
-    def parse_file(self):
-        work_sheet = self.workbook.worksheets[self.worksheet]
-
-        cell_list = list()
-        for row in work_sheet.rows:
-            # TODO: Check if all columns have same length
-            # TODO: skip empty cells/rows. E.g. skip row if first X(=10?)
-            #       columns are empty
-
-            is_first_cell = True
-            for cell in row:
-                if cell.coordinate in self.skip_list:
-                    continue
-                db_cell = self.prepare_cell(cell, is_first_cell)
-                if db_cell:
-                    cell_list.append(db_cell)
-
-                is_first_cell = False
-                logger.debug("created cell %s" % cell.coordinate)
+    def build_cell(self, row, column, value, is_first_cell,
+                   color_value=None, horizontal_alignment=None,
+                   column_span=None, row_span=None):
+        """
+        Returns a Cell for a cell of a file that is not read with openpyxl,
+        see excel_import.importers.
+        """
+        color_name = ""
+        if color_value:
+            color_name = Document.get_name_for_color(color_value)
+            self.import_context.colors.add(color_value)
+        value, formula = split_formula(value or "")
+        return Cell(coordinate='%s%d' % (get_column_letter(column), row),
+                    row=row,
+                    column=column,
+                    value=value,
+                    formula=formula,
+                    color_name=color_name,
+                    row_span=row_span,
+                    column_span=column_span,
+                    document=self,
+                    horizontal_alignment=horizontal_alignment,
+                    first_cell=is_first_cell, )
+
+    def prepare_row(self, row, row_index):
+        """
+        Returns Cell instances for the cells of row, the worksheet row at
+        row_index, that are not hidden by a merged range.
+        """
+        cells = []
+        for column_index, cell in enumerate(row, start=1):
+            if self.merged_index.is_hidden(row_index, column_index):
+                continue
+            cells.append(self.prepare_cell(
+                cell, row_index, column_index, not cells,
+                *self.merged_index.get_span(row_index, column_index)))
+        return cells
+
+    def write_cells(self, rows):
+        """
+        Converts the worksheet rows to Cell instances and writes them, see
+        write_prepared_rows.
+        """
+        return self.write_prepared_rows(
+            self.prepare_row(row, row_index)
+            for row_index, row in enumerate(rows, start=1))
+
+    def write_prepared_rows(self, rows):
+        """
+        Writes the Cell instances of rows, one list per worksheet row, with
+        the cell writer of the database, in batches of
+        EXCEL_IMPORT_CHUNK_SIZE.
+
+        Whether batches are committed one by one, so that other
+        connections see the progress, depends on the writer. import_file
+        cleans up if the import fails.
+        """
+        if self.import_context.cell_writer is not None:
+            writer = self.import_context.cell_writer
+        elif self.storage == Document.GRID:
+            writer = GridCellWriter(DocumentGrid, self)
+        else:
+            writer = get_cell_writer(Cell)
+
+        context = self.import_context
+        start = time.time()
+        with writer:
+            # The most recent cell is held back, it might have to be
+            # flagged as last cell.
+            db_cell = None
+            for row_index, cells in enumerate(rows, start=1):
+                for cell in cells:
+                    if db_cell is not None:
+                        writer.write(db_cell)
+                    db_cell = cell
+                context.cells += len(cells)
+                self.report_progress(row_index)
+
+            if db_cell is not None:
+                db_cell.last_cell = True
+                writer.write(db_cell)
+        # Reading and preparing cells, rows is consumed lazily.
+        context.add_timing('cells', time.time() - start - writer.seconds)
+        context.add_timing('write', writer.seconds)
+        return writer
+
+    def write_cells_parallel(self, max_row, max_column):
+        """
+        Prepares the cells of the worksheet in row bands in a pool of
+        EXCEL_IMPORT_WORKERS processes and writes them in order, see
+        excel_import.parallel. The result is the same as of write_cells.
+        """
+        context = self.import_context
+
+        def rows():
+            for band, colors in prepare_bands(
+                    self.file.path, self.worksheet, max_row, max_column,
+                    context.merged_index):
+                context.colors.update(colors)
+                for cells in band:
+                    yield [Cell(document=self, **dict(zip(BAND_FIELDS,
+                                                          values)))
+                           for values in cells]
+
+        return self.write_prepared_rows(rows())
 
-        cell_list[len(cell_list) - 1].last_cell = True
-        Cell.objects.bulk_create(cell_list)
-        self.save_colors()
-
-
-class Cell(models.Model):
+    def parse_file(self):
+        """
+        Imports the worksheet with the importer for the type of the file.
+        """
+        self.get_importer().parse()
+
+    def parse_workbook(self):
+        """
+        Imports the worksheet of an xlsx file loaded completely by
+        openpyxl, see EXCEL_IMPORT_STREAMING for the alternative.
+        """
+        context = self.import_context
+        if context.workbook is None:
+            with context.timer('load_workbook'):
+                context.workbook = load_workbook(self.file.path)
+        work_sheet = context.workbook.worksheets[self.worksheet]
+        with context.timer('merged_index'):
+            context.merged_index = MergedCellIndex(
+                work_sheet.merged_cell_ranges)
+        with context.timer('used_range'):
+            # Must run before iterating the rows, which creates missing
+            # cells.
+            max_row, max_column = get_used_range(
+                get_content_bounds(work_sheet.get_cell_collection()),
+                work_sheet.merged_cell_ranges,
+                work_sheet.max_row,
+                work_sheet.max_column)
+        self._update_import_state(rows_total=max_row)
+
+        self.write_cells(work_sheet.iter_rows(
+            'A1:%s%d' % (get_column_letter(max_column), max_row)))
+        with context.timer('save_colors'):
+            self.save_colors()
+
+    def parse_file_streaming(self):
+        """
+        Imports the worksheet with openpyxl's read-only mode. The workbook
+        is loaded unless the import context holds one.
+
+        Merged ranges and the used range are read from the sheet xml before
+        the rows are streamed to the cell writer, so memory use stays flat
+        for any sheet size. Sheets of at least
+        EXCEL_IMPORT_PARALLEL_MIN_ROWS rows are prepared in parallel if
+        EXCEL_IMPORT_WORKERS is above 1, see write_cells_parallel.
+        """
+        context = self.import_context
+        workbook = context.workbook
+        close_workbook = workbook is None
+        if close_workbook:
+            with context.timer('load_workbook'):
+                workbook = load_workbook(self.file.path, read_only=True)
+        try:
+            work_sheet = workbook.worksheets[self.worksheet]
+            if context.theme_colors is None:
+                context.theme_colors = self.parse_theme_colors(workbook)
+            with context.timer('merged_index'):
+                # Reads the merged ranges and the used range in one pass.
+                content_bounds, merged_cell_ranges = scan_sheet(
+                    work_sheet.xml_source, workbook)
+                context.merged_index = MergedCellIndex(merged_cell_ranges)
+            # Trailing empty rows and columns are never read.
+            work_sheet.max_row, work_sheet.max_column = get_used_range(
+                content_bounds,
+                merged_cell_ranges,
+                work_sheet.max_row,
+                work_sheet.max_column)
+            self._update_import_state(rows_total=work_sheet.max_row)
+
+            if get_import_workers() > 1 and work_sheet.max_row >= getattr(
+                    settings, 'EXCEL_IMPORT_PARALLEL_MIN_ROWS', 10000):
+                self.write_cells_parallel(work_sheet.max_row,
+                                          work_sheet.max_column)
+            else:
+                self.write_cells(iter_sheet_rows(work_sheet))
+            with context.timer('save_colors'):
+                self.save_colors()
+        finally:
+            if close_workbook:
+                workbook._archive.close()
+
+
+class CellQuerySet(models.QuerySet):
+    """
+    Lookups by integer row and column, served by the (document, row,
+    column) index when filtered by document, e.g. on document.cell_set.
+    """
+
+    def in_rows(self, min_row, max_row=None):
+        return self.filter(row__gte=min_row, row__lte=max_row or min_row)
+
+    def in_columns(self, min_column, max_column=None):
+        return self.filter(column__gte=min_column,
+                           column__lte=max_column or min_column)
+
+    def in_range(self, cell_range):
+        """
+        Returns the cells inside of a range like 'A1:C10'.
+        """
+        min_column, min_row, max_column, max_row = \
+            range_boundaries(cell_range.upper())
+        return self.in_rows(min_row, max_row).in_columns(min_column,
+                                                         max_column)
+
+    def at(self, coordinate):
+        """
+        Returns the cell at coordinate, e.g. 'B3'.
+        """
+        try:
+            row, column = coordinate_to_tuple(coordinate.upper())
+        except CellCoordinatesException:
+            raise self.model.DoesNotExist("Invalid coordinate %s"
+                                          % coordinate)
+        return self.get(row=row, column=column)
+
+    def in_bulk_coordinates(self, coordinates):
+        """
+        Returns a dict mapping each of coordinates to its cell, with a
+        query per 100 coordinates. Coordinates without a cell are left
+        out.
+        """
+        pending = sorted(set(coordinate_to_tuple(coordinate.upper())
+                             for coordinate in coordinates))
+        cells = dict()
+        while pending:
+            # Keeps the number of query terms below the limits of SQLite.
+            batch, pending = pending[:100], pending[100:]
+            query = Q()
+            for row, column in batch:
+                query |= Q(row=row, column=column)
+            cells.update((cell.coordinate, cell)
+                         for cell in self.filter(query))
+        return cells
+
+
+class Cell(CellDisplayMixin, models.Model):
     coordinate = models.CharField(max_length=15)
+    row = models.IntegerField(null=True, blank=True)
+    column = models.IntegerField(null=True, blank=True)
     value = models.CharField(max_length=255, default="", blank=True)
+    # Formula of the cell, value holds its result, see Document.calculate.
+    formula = models.CharField(max_length=255, default="", blank=True)
+    # Set when the value differs from the file, e.g. by an accepted change
+    # request, see Document.get_changed_cells.
+    changed = models.BooleanField(default=False)
     color_name = models.CharField(max_length=20, blank=True)
     row_span = models.IntegerField(blank=True,
                                    null=True,
@@ -274,27 +1298,88 @@ class Cell(models.Model):
     first_cell = models.BooleanField(default=False)
     last_cell = models.BooleanField(default=False)
 
+    objects = CellQuerySet.as_manager()
+
     class Meta:
-        ordering = ['id', ]
+        ordering = ['row', 'column', 'id']
+        index_together = [['document', 'row', 'column']]
 
     def __str__(self):
         return '%s (Document: %d)' % (self.coordinate, self.document_id)
 
-    @property
-    def attributes(self):
-        attributes = str()
-        if self.row_span:
-            attributes = 'rowspan=%d' % self.row_span
-        if self.column_span:
-            attributes = ''.join([attributes, 'colspan=%d' % self.column_span])
-        return attributes
 
-    @property
-    def class_tags(self):
-        classes = self.color_name
-        if self.horizontal_alignment:
-            classes = ''.join([classes, ' ', self.horizontal_alignment])
-        return classes
+class FormulaReference(models.Model):
+    """
+    A range read by the formula of formula_cell. The references of a
+    document form the dependency graph of its formulas, see
+    Document.recalculate.
+    """
+    document = models.ForeignKey(Document)
+    formula_cell = models.ForeignKey(Cell, related_name='references')
+    min_row = models.IntegerField()
+    min_column = models.IntegerField()
+    max_row = models.IntegerField()
+    max_column = models.IntegerField()
+
+    class Meta:
+        index_together = [['document', 'min_row', 'max_row']]
+
+    def __str__(self):
+        return '%s reads R%dC%d:R%dC%d' % (
+            self.formula_cell_id, self.min_row, self.min_column,
+            self.max_row, self.max_column)
+
+
+class DocumentGrid(models.Model):
+    """
+    Cells of a document stored as one compressed columnar blob, see
+    excel_import.grid. Only cells that are referenced by change requests
+    are materialized as Cell rows of the document.
+    """
+    document = models.OneToOneField(Document)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return 'Grid (Document: %d)' % self.document_id
+
+    @cached_property
+    def grid(self):
+        return Grid.loads(self.data)
+
+    def get_cells(self):
+        materialized = dict((cell.coordinate, cell)
+                            for cell in self.document.cell_set.all())
+        for grid_cell in self.grid:
+            yield materialized.get(grid_cell.coordinate, grid_cell)
+
+    def materialize(self, coordinate):
+        try:
+            grid_cell = self.grid.find(*coordinate_to_tuple(coordinate))
+        except CellCoordinatesException:
+            grid_cell = None
+        if grid_cell is None:
+            raise Cell.DoesNotExist("No cell %s in grid of document %d"
+                                    % (coordinate, self.document_id))
+
+        with transaction.atomic():
+            # Lock the grid, so a cell is materialized only once.
+            list(DocumentGrid.objects.select_for_update()
+                 .filter(pk=self.pk).values_list('pk', flat=True))
+            cell, created = Cell.objects.get_or_create(
+                document_id=self.document_id,
+                row=grid_cell.row,
+                column=grid_cell.column,
+                defaults={
+                    'coordinate': grid_cell.coordinate,
+                    'value': grid_cell.value,
+                    'color_name': grid_cell.color_name,
+                    'horizontal_alignment': grid_cell.horizontal_alignment,
+                    'row_span': grid_cell.row_span,
+                    'column_span': grid_cell.column_span,
+                    'first_cell': grid_cell.first_cell,
+                    'last_cell': grid_cell.last_cell,
+                })
+        return cell
 
 
 class DocumentColors(models.Model):
@@ -322,3 +1407,68 @@ class DocumentColors(models.Model):
         if len(self.color) == 6:
             return ''.join(['#', self.color])
         return DocumentColors.hex_to_rgba(self.color)
+
+
+class ExportJob(models.Model):
+    """
+    Writes the export of a change version of a document, see
+    excel_import.exports, in the background. Large documents are exported
+    by a job instead of while they are downloaded, see
+    frontend.views.download_document.
+    """
+    QUEUED = 1
+    RUNNING = 2
+    READY = 3
+    FAILED = 4
+    STATUS = ((QUEUED, _("Queued")),
+              (RUNNING, _("Exporting")),
+              (READY, _("Ready")),
+              (FAILED, _("Failed")))
+
+    document = models.ForeignKey(Document)
+    # See excel_import.exports.get_export_key.
+    key = models.CharField(max_length=100)
+    status = models.IntegerField(choices=STATUS, default=QUEUED)
+    rows_exported = models.IntegerField(default=0)
+    rows_total = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['document', 'key']]
+
+    def __str__(self):
+        return '%s (Document: %d)' % (self.key, self.document_id)
+
+    @property
+    def progress(self):
+        if not self.rows_total:
+            return 0
+        return min(100, 100 * self.rows_exported // self.rows_total)
+
+    def _update_status(self, **kwargs):
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+        ExportJob.objects.filter(pk=self.pk).update(**kwargs)
+
+    def report_progress(self, row):
+        interval = getattr(settings, 'EXCEL_IMPORT_PROGRESS_INTERVAL', 100)
+        if row - self.rows_exported >= interval:
+            self._update_status(rows_exported=row)
+
+    def run(self):
+        """
+        Writes the export to the cache. The status is FAILED if that
+        failed, the exception is re-raised.
+        """
+        self._update_status(status=ExportJob.RUNNING, rows_exported=0,
+                            rows_total=self.document.rows_total or 0)
+        try:
+            for data in stream_export(self.document, self.report_progress):
+                pass
+        except Exception:
+            logger.exception("Exporting document %d failed"
+                             % self.document_id)
+            self._update_status(status=ExportJob.FAILED)
+            raise
+        self._update_status(status=ExportJob.READY,
+                            rows_exported=self.rows_total)
@@ -0,0 +1,152 @@
+"""
+Parallel preparation of the cells of a worksheet.
+
+The rows of a sheet are split into bands of EXCEL_IMPORT_CHUNK_SIZE rows.
+Every band is read and converted to cells in a worker process, the results
+are returned in band order, so the cells are written in the same order as
+by a serial import. Only about two bands per worker are prepared ahead of
+the writer, memory use does not depend on the size of the sheet.
+
+Read-only worksheets can only be read from the top. A worker keeps its
+workbook open and continues with the rows after its last band, bands are
+handed to the workers in order, so every worker parses the sheet about
+once.
+
+Workers never touch the database, only the calling process writes.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from openpyxl import load_workbook
+
+from excel_import.context import ImportContext
+from excel_import.reader import iter_sheet_rows
+
+# Cell fields prepared by the workers, all others are set by the caller.
+BAND_FIELDS = ('coordinate', 'row', 'column', 'value', 'formula',
+               'color_name', 'row_span', 'column_span',
+               'horizontal_alignment', 'first_cell')
+
+
+def get_import_workers():
+    return max(getattr(settings, 'EXCEL_IMPORT_WORKERS', 1), 1)
+
+
+def get_bands(max_row, band_rows):
+    """
+    Returns the (min_row, max_row) tuples of the bands of band_rows rows
+    of a sheet with max_row rows.
+    """
+    return [(min_row, min(min_row + band_rows - 1, max_row))
+            for min_row in range(1, max_row + 1, band_rows)]
+
+
+class BandReader(object):
+    """
+    The rows of a worksheet read by a worker process, kept open between
+    the bands it prepares.
+    """
+
+    def __init__(self, path, worksheet, max_row, max_column):
+        self.key = (path, worksheet, max_row, max_column)
+        self.workbook = load_workbook(path, read_only=True)
+        work_sheet = self.workbook.worksheets[worksheet]
+        work_sheet.max_row, work_sheet.max_column = max_row, max_column
+        self.rows = iter_sheet_rows(work_sheet)
+        self.next_row = 1
+        self.max_row = max_row
+
+    def read(self, min_row, max_row):
+        """
+        Returns the rows min_row to max_row, min_row must not be before
+        next_row. The rows before min_row are parsed and skipped.
+        """
+        for row_index in range(self.next_row, min_row):
+            next(self.rows)
+        rows = [next(self.rows) for row_index in range(min_row, max_row + 1)]
+        self.next_row = max_row + 1
+        return rows
+
+    def close(self):
+        self.workbook._archive.close()
+
+
+# The reader of the last band prepared by this process.
+_reader = None
+
+
+def get_reader(path, worksheet, min_row, sheet_max_row, max_column):
+    """
+    Returns the BandReader for a band starting at min_row, the reader of
+    the last band is continued if the band comes after it.
+    """
+    global _reader
+    key = (path, worksheet, sheet_max_row, max_column)
+    if _reader is not None and (_reader.key != key or
+                                _reader.next_row > min_row):
+        _reader.close()
+        _reader = None
+    if _reader is None:
+        _reader = BandReader(path, worksheet, sheet_max_row, max_column)
+    return _reader
+
+
+def prepare_band(path, worksheet, min_row, max_row, max_column,
+                 merged_index, sheet_max_row=None):
+    """
+    Prepares the cells of the rows min_row to max_row of the worksheet at
+    index worksheet of the xlsx file at path, runs in a worker process.
+    sheet_max_row is the number of rows of the worksheet, by default
+    max_row.
+
+    Returns the values of BAND_FIELDS of the visible cells of every row
+    and the set of colors the cells use.
+    """
+    global _reader
+    from excel_import.models import Document
+
+    sheet_max_row = sheet_max_row or max_row
+    reader = get_reader(path, worksheet, min_row, sheet_max_row, max_column)
+    try:
+        document = Document(worksheet=worksheet)
+        document._context = ImportContext(reader.workbook)
+        document._context.merged_index = merged_index
+
+        rows = [[tuple(getattr(cell, name) for name in BAND_FIELDS)
+                 for cell in document.prepare_row(row, row_index)]
+                for row_index, row in enumerate(
+                    reader.read(min_row, max_row), start=min_row)]
+    except Exception:
+        reader.close()
+        _reader = None
+        raise
+    if reader.next_row > sheet_max_row:
+        # The sheet is complete.
+        reader.close()
+        _reader = None
+    return rows, document._context.colors
+
+
+def prepare_bands(path, worksheet, max_row, max_column, merged_index,
+                  workers=None, band_rows=None):
+    """
+    Yields the result of prepare_band for every band of the worksheet in
+    order, the bands are prepared by a pool of workers processes, see
+    EXCEL_IMPORT_WORKERS. Bands have EXCEL_IMPORT_CHUNK_SIZE rows unless
+    band_rows is given, at most two bands per worker are submitted ahead
+    of the band yielded.
+    """
+    workers = workers or get_import_workers()
+    band_rows = band_rows or getattr(settings, 'EXCEL_IMPORT_CHUNK_SIZE',
+                                     1000)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for min_row, band_max_row in get_bands(max_row, band_rows):
+            pending.append(executor.submit(
+                prepare_band, path, worksheet, min_row, band_max_row,
+                max_column, merged_index, max_row))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,229 @@
+from xml.etree import ElementTree
+
+from openpyxl.cell.read_only import EMPTY_CELL
+from openpyxl.styles import Alignment, PatternFill
+from openpyxl.utils import (
+    coordinate_to_tuple,
+    get_column_letter,
+    range_boundaries,
+)
+from openpyxl.xml.constants import SHEET_MAIN_NS
+
+SHEET_DATA_TAG = '{%s}sheetData' % SHEET_MAIN_NS
+ROW_TAG = '{%s}row' % SHEET_MAIN_NS
+CELL_TAG = '{%s}c' % SHEET_MAIN_NS
+VALUE_TAGS = ('{%s}v' % SHEET_MAIN_NS,
+              '{%s}f' % SHEET_MAIN_NS,
+              '{%s}is' % SHEET_MAIN_NS)
+MERGE_CELL_TAG = '{%s}mergeCell' % SHEET_MAIN_NS
+DIMENSION_TAG = '{%s}dimension' % SHEET_MAIN_NS
+
+# fgColor value of cells without a fill
+NO_FILL_COLOR = '00000000'
+
+
+class BlankCell(object):
+    """
+    Stand-in for cells missing from the sheet xml.
+
+    openpyxl pads read-only rows with a shared EMPTY_CELL that has neither
+    a coordinate nor styles, whereas the importer needs both.
+    """
+    __slots__ = ('row', 'column')
+
+    value = None
+    fill = PatternFill()
+    alignment = Alignment()
+
+    def __init__(self, row, column):
+        self.row = row
+        self.column = column
+
+    @property
+    def coordinate(self):
+        return '%s%d' % (get_column_letter(self.column), self.row)
+
+
+def iterparse_sheet(xml_source):
+    """
+    Yields every element of a worksheet xml stream once it is complete.
+
+    Finished rows are dropped from the tree, so memory use does not depend
+    on the number of rows.
+    """
+    sheet_data = None
+    for event, element in ElementTree.iterparse(xml_source,
+                                                events=('start', 'end')):
+        if event == 'start':
+            if element.tag == SHEET_DATA_TAG:
+                sheet_data = element
+            continue
+
+        yield element
+        if element.tag == ROW_TAG and sheet_data is not None:
+            sheet_data.remove(element)
+            element.clear()
+
+
+def read_merged_cell_ranges(xml_source):
+    """
+    Returns the ``ref`` of every ``<mergeCell>`` in a worksheet xml stream.
+    """
+    return [element.get('ref') for element in iterparse_sheet(xml_source)
+            if element.tag == MERGE_CELL_TAG]
+
+
+def read_sheet_size(xml_source):
+    """
+    Returns the number of rows and columns and of merged cell ranges of a
+    worksheet xml stream in constant memory.
+
+    Rows and columns are taken from the ``<dimension>`` element, sheets
+    without one are measured by the coordinates of their cells.
+    """
+    dimension = None
+    max_row = max_column = merged_cell_ranges = 0
+    for element in iterparse_sheet(xml_source):
+        if element.tag == DIMENSION_TAG:
+            dimension = element.get('ref')
+        elif element.tag == CELL_TAG and dimension is None:
+            row, column = coordinate_to_tuple(element.get('r'))
+            max_row = max(max_row, row)
+            max_column = max(max_column, column)
+        elif element.tag == MERGE_CELL_TAG:
+            merged_cell_ranges += 1
+
+    if dimension is not None:
+        max_column, max_row = range_boundaries(dimension.upper())[2:]
+    return max_row, max_column, merged_cell_ranges
+
+
+def has_fill(fill):
+    return fill.fgColor.value != NO_FILL_COLOR
+
+
+def has_content(cell):
+    """
+    Returns True for cells that have a value or a fill color.
+    """
+    return cell.value not in (None, '') or has_fill(cell.fill)
+
+
+def get_style_key(cell):
+    """
+    Returns a hashable key that is equal for cells with the same style.
+
+    This is the style id of read-only cells and the style array of other
+    cells, BlankCell instances have no style and share the key None.
+    """
+    style_id = getattr(cell, '_style_id', None)
+    if style_id is not None:
+        return style_id
+    style = getattr(cell, '_style', None)
+    if style is not None:
+        return tuple(style)
+    return None
+
+
+def get_content_bounds(cells):
+    """
+    Returns the largest row and column of all cells with content.
+    """
+    max_row = max_column = 0
+    for cell in cells:
+        if has_content(cell):
+            max_row = max(max_row, cell.row)
+            max_column = max(max_column, cell.col_idx)
+    return max_row, max_column
+
+
+def scan_sheet(xml_source, workbook):
+    """
+    Reads the raw worksheet xml of a read-only workbook once and returns
+    the content bounds as get_content_bounds does, together with the
+    merged cell ranges.
+
+    Cells are not materialized, the fill of each style id is looked up
+    only once.
+    """
+    style_has_fill = dict()
+    max_row = max_column = 0
+    merged_cell_ranges = []
+    for element in iterparse_sheet(xml_source):
+        if element.tag == CELL_TAG:
+            content = any(child.tag in VALUE_TAGS for child in element)
+            if not content:
+                style_id = int(element.get('s', 0))
+                if style_id not in style_has_fill:
+                    style = workbook._cell_styles[style_id]
+                    style_has_fill[style_id] = has_fill(
+                        workbook._fills[style.fillId])
+                content = style_has_fill[style_id]
+
+            if content:
+                row, column = coordinate_to_tuple(element.get('r'))
+                max_row = max(max_row, row)
+                max_column = max(max_column, column)
+        elif element.tag == MERGE_CELL_TAG:
+            merged_cell_ranges.append(element.get('ref'))
+    return (max_row, max_column), merged_cell_ranges
+
+
+def get_used_range(content_bounds, merged_cell_ranges, max_row=None,
+                   max_column=None):
+    """
+    Returns the number of rows and columns that have to be imported.
+
+    This is the bounding box of all cells with content, extended by merged
+    ranges starting inside of it, so trailing empty rows and columns are
+    dropped. The box never exceeds the sheet dimension given by max_row
+    and max_column and covers at least one cell.
+    """
+    used_row = max(content_bounds[0], 1)
+    used_column = max(content_bounds[1], 1)
+    for cell_range in merged_cell_ranges:
+        min_col, min_row, range_max_col, range_max_row = \
+            range_boundaries(cell_range.upper())
+        if min_row <= used_row and min_col <= used_column:
+            used_row = max(used_row, range_max_row)
+            used_column = max(used_column, range_max_col)
+
+    if max_row:
+        used_row = min(used_row, max_row)
+    if max_column:
+        used_column = min(used_column, max_column)
+    return used_row, used_column
+
+
+def calculate_dimension(work_sheet):
+    """
+    Sets the size of a read-only worksheet whose xml has no
+    ``<dimension>`` element by scanning its rows once.
+    """
+    max_row = max_column = 0
+    for row in work_sheet.rows:
+        for cell in row:
+            if cell is not EMPTY_CELL:
+                max_row = max(max_row, cell.row)
+                max_column = max(max_column, cell.column)
+    work_sheet.max_row = max_row
+    work_sheet.max_column = max_column
+
+
+def iter_sheet_rows(work_sheet, min_row=1, max_row=None):
+    """
+    Iterates over the rows of a read-only worksheet, or the rows min_row
+    to max_row of it, and replaces padding cells with BlankCell instances,
+    so every yielded cell has a coordinate, a fill and an alignment.
+
+    The worksheet dimension is known once this function returns.
+    """
+    if work_sheet.max_column is None or work_sheet.max_row is None:
+        calculate_dimension(work_sheet)
+
+    rows = work_sheet.get_squared_range(1, min_row, work_sheet.max_column,
+                                        max_row or work_sheet.max_row)
+    return ([BlankCell(row_index, column_index) if cell is EMPTY_CELL
+             else cell
+             for column_index, cell in enumerate(row, start=1)]
+            for row_index, row in enumerate(rows, start=min_row))
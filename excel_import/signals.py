@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent once all cells of a newly saved document have been imported.
+document_imported = Signal(providing_args=['document'])
+
+# Sent after the cells of document have been copied from source, a
+# previous document with identical content, instead of being imported.
+document_copied = Signal(providing_args=['document', 'source'])
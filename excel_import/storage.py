@@ -0,0 +1,26 @@
+import hashlib
+import os
+
+
+def hash_file(file):
+    """
+    Returns the sha256 hex digest of a django File, which is rewound
+    afterwards.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def content_addressed_path(instance, filename):
+    """
+    upload_to callable naming a file after the content_hash of instance,
+    e.g. documents/ab/ab12...ef.xlsx, so identical files share a name.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return 'documents/%s/%s%s' % (instance.content_hash[:2],
+                                  instance.content_hash,
+                                  extension)
+
@@ -1,13 +1,46 @@
+import hashlib
+import json
 import os
-from unittest.mock import patch
+import tempfile
+from importlib import import_module
+from io import BytesIO
+from zipfile import ZipFile
+from unittest.mock import ANY, patch
+from celery.exceptions import Retry
+from django.apps import apps
+from django.contrib.auth.models import Permission, User
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase, override_settings
-from excel_import.models import Document, Cell, DocumentColors
+from django.test.utils import CaptureQueriesContext
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, PatternFill
+from excel_import.benchmark_suite import generate_workbook, run_suite
+from excel_import.formulas import MAX_ROW, FormulaError, evaluate, \
+    get_references, parse_formula
+from excel_import.grid import Grid
+from excel_import.importers import CsvImporter, OdsImporter, \
+    XlsxImporter, get_importer_class
+from excel_import.models import Document, Cell, DocumentColors, \
+    DocumentGrid, FormulaReference
+from excel_import.merged import MergedCellIndex
+from excel_import.parallel import get_bands, prepare_band, prepare_bands
+from excel_import.reader import get_style_key, read_merged_cell_ranges, \
+    read_sheet_size
+from excel_import.storage import content_addressed_path
+from excel_import.utils import list_worksheets_from_file
+from excel_import.writers import BulkCreateCellWriter, DiffCellWriter, \
+    ExecuteManyCellWriter, format_copy_value, get_cell_writer
+from excel_import.values import iter_csv, iter_json, iter_rows
+from excel_import.xlsx import patch_row
+from frontend.tasks import import_document
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-@override_settings(MEDIA_ROOT=os.path.join(BASE_DIR, "excel_import/testdata/"))
+@override_settings(MEDIA_ROOT=os.path.join(BASE_DIR, "excel_import/testdata/"),
+                   CELERY_ALWAYS_EAGER=True)
 class ImportTest(TestCase):
 
     def test_simple_import(self):
@@ -18,6 +51,270 @@ class ImportTest(TestCase):
         self.assertEqual(67, Cell.objects.count())
         self.assertEqual(3, DocumentColors.objects.count())
 
+    def test_streaming_import_matches_full_import(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        fields = ('coordinate', 'value', 'color_name', 'row_span',
+                  'column_span', 'horizontal_alignment', 'first_cell',
+                  'last_cell')
+
+        with self.settings(EXCEL_IMPORT_STREAMING=False):
+            full = Document.objects.create(file=file, name="full")
+        with self.settings(EXCEL_IMPORT_STREAMING=True):
+            streamed = Document.objects.create(file=file, name="streamed")
+
+        self.assertListEqual(list(full.cell_set.values_list(*fields)),
+                             list(streamed.cell_set.values_list(*fields)))
+
+    @override_settings(EXCEL_IMPORT_STREAMING=True)
+    def test_parallel_import_matches_serial_import(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        fields = ('coordinate', 'row', 'column', 'value', 'color_name',
+                  'row_span', 'column_span', 'horizontal_alignment',
+                  'first_cell', 'last_cell')
+
+        serial = Document.objects.create(file=file, name="serial")
+        # Bands of two rows split the merged range A2:A4.
+        with self.settings(EXCEL_IMPORT_WORKERS=2,
+                           EXCEL_IMPORT_PARALLEL_MIN_ROWS=2,
+                           EXCEL_IMPORT_CHUNK_SIZE=2,
+                           EXCEL_IMPORT_DEDUPLICATE=False), \
+                patch('excel_import.models.prepare_bands',
+                      wraps=prepare_bands) as bands:
+            parallel = Document.objects.create(file=file, name="parallel")
+
+        self.assertTrue(bands.called)
+        self.assertListEqual(list(serial.cell_set.values_list(*fields)),
+                             list(parallel.cell_set.values_list(*fields)))
+        self.assertSetEqual(
+            set(serial.documentcolors_set.values_list('color', 'name')),
+            set(parallel.documentcolors_set.values_list('color', 'name')))
+
+    def test_prepare_band_continues_previous_band(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        merged_index = MergedCellIndex(['A1:Q1', 'A2:A4', 'A5:A7'])
+        rows, colors = prepare_band(file, 0, 1, 5, 17, merged_index)
+
+        with patch('excel_import.parallel.load_workbook',
+                   wraps=load_workbook) as load:
+            first = prepare_band(file, 0, 1, 2, 17, merged_index, 5)
+            second = prepare_band(file, 0, 3, 5, 17, merged_index, 5)
+        self.assertEqual(1, load.call_count)
+        self.assertListEqual(rows, first[0] + second[0])
+        self.assertSetEqual(colors, first[1] | second[1])
+
+        # An earlier band reads the sheet from the top again.
+        with patch('excel_import.parallel.load_workbook',
+                   wraps=load_workbook) as load:
+            self.assertListEqual(
+                second[0],
+                prepare_band(file, 0, 3, 5, 17, merged_index, 5)[0])
+            self.assertListEqual(
+                first[0], prepare_band(file, 0, 1, 2, 17, merged_index, 5)[0])
+        self.assertEqual(2, load.call_count)
+
+    def test_get_bands(self):
+        self.assertListEqual([(1, 2), (3, 4), (5, 5)], get_bands(5, 2))
+        self.assertListEqual([(1, 5)], get_bands(5, 10))
+
+    @override_settings(EXCEL_IMPORT_STREAMING=True, EXCEL_IMPORT_CHUNK_SIZE=10)
+    def test_streaming_import_in_chunks(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+
+        self.assertEqual(67, document.cell_set.count())
+        self.assertEqual(5, document.cell_set.filter(first_cell=True).count())
+        self.assertEqual(1, document.cell_set.filter(last_cell=True).count())
+        self.assertTrue(document.cell_set.last().last_cell)
+
+    @override_settings(
+        EXCEL_IMPORT_CELL_WRITER='excel_import.writers.BulkCreateCellWriter')
+    def test_import_with_bulk_create_writer(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        Document.objects.create(file=file, name="test")
+
+        self.assertEqual(67, Cell.objects.count())
+        self.assertEqual(1, Cell.objects.filter(last_cell=True).count())
+
+    def test_read_merged_cell_ranges(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        with ZipFile(file) as archive:
+            with archive.open('xl/worksheets/sheet1.xml') as xml_source:
+                ranges = read_merged_cell_ranges(xml_source)
+
+        self.assertListEqual(['A1:Q1', 'A2:A4', 'A5:A7'], ranges)
+
+    def test_read_sheet_size(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        with ZipFile(file) as archive:
+            xml = archive.read('xl/worksheets/sheet1.xml')
+
+        self.assertEqual((5, 17, 3), read_sheet_size(BytesIO(xml)))
+        # Without <dimension> the size is taken from the cells.
+        xml = xml.replace(b'<dimension ref="A1:Q5"/>', b'')
+        self.assertEqual((5, 17, 3), read_sheet_size(BytesIO(xml)))
+
+    def test_import_tracks_status_and_progress(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+
+        document.refresh_from_db()
+        self.assertEqual(Document.READY, document.import_status)
+        self.assertEqual(5, document.rows_total)
+        self.assertEqual(5, document.rows_imported)
+        self.assertEqual(100, document.import_progress)
+
+    @override_settings(EXCEL_IMPORT_CHUNK_SIZE=10)
+    def test_failed_import_removes_cells(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+
+        with patch('excel_import.models.Document.save_colors',
+                   side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                document.import_file()
+
+        document.refresh_from_db()
+        self.assertEqual(Document.FAILED, document.import_status)
+        self.assertEqual(0, document.cell_set.count())
+
+    @override_settings(EXCEL_IMPORT_ASYNC=True)
+    def test_async_import_queues_task(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        with patch('frontend.signals.import_document') as import_document:
+            document = Document.objects.create(file=file, name="test")
+
+        import_document.delay.assert_called_once_with(document.pk)
+        self.assertEqual(Document.QUEUED, document.import_status)
+        self.assertEqual(0, document.cell_set.count())
+
+    def test_import_task_waits_for_commit(self):
+        with patch.object(import_document, 'retry',
+                          side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                import_document(0)
+
+        retry.assert_called_once_with(exc=ANY)
+        self.assertIsInstance(retry.call_args[1]['exc'],
+                              Document.DoesNotExist)
+
+    def test_import_drops_trailing_empty_rows_and_columns(self):
+        workbook = Workbook()
+        work_sheet = workbook.active
+        work_sheet['A1'] = 'value'
+        work_sheet['C2'].fill = PatternFill(fill_type='solid',
+                                            fgColor='FF99CCFF')
+        work_sheet['Z100'].alignment = Alignment(horizontal='center')
+        work_sheet['AA200'] = ''
+        media_root = tempfile.mkdtemp()
+        file = os.path.join(media_root, 'trailing.xlsx')
+        workbook.save(file)
+
+        for streaming in (False, True):
+            with self.settings(EXCEL_IMPORT_STREAMING=streaming,
+                               MEDIA_ROOT=media_root):
+                document = Document.objects.create(file=file, name="test")
+
+            self.assertListEqual(
+                ['A1', 'B1', 'C1', 'A2', 'B2', 'C2'],
+                list(document.cell_set.values_list('coordinate', flat=True)))
+
+    def test_cell_styles_are_resolved_once_per_style(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        with patch('excel_import.models.Document.get_color_value',
+                   return_value=None) as get_color:
+            document = Document.objects.create(file=file, name="test")
+
+        work_sheet = load_workbook(file, read_only=True).active
+        styles = set(get_style_key(cell) for row
+                     in work_sheet.get_squared_range(1, 1, 17, 5)
+                     for cell in row)
+        self.assertEqual(67, document.cell_set.count())
+        self.assertTrue(0 < get_color.call_count <= len(styles))
+
+    def test_import_records_statistics(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        with patch('frontend.signals.logger') as logger:
+            document = Document.objects.create(file=file, name="test")
+
+        document.refresh_from_db()
+        statistics = document.get_import_statistics()
+        self.assertEqual('parse', statistics['method'])
+        self.assertEqual((67, 3, 3), (statistics['cells'],
+                                      statistics['colors'],
+                                      statistics['merged_cells']))
+        self.assertListEqual(['load_workbook', 'merged_index', 'cells',
+                              'write', 'save_colors', 'formulas', 'total'],
+                             list(statistics['seconds']))
+        extra = logger.info.call_args[1]['extra']
+        self.assertEqual(statistics, extra['import_statistics'])
+
+        copy = Document.objects.create(file=file, name="copy")
+        copy.refresh_from_db()
+        statistics = copy.get_import_statistics()
+        self.assertEqual(('copy', 67), (statistics['method'],
+                                        statistics['cells']))
+
+    def test_admin_shows_import_statistics(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+        user = User.objects.create_user('admin', '', 'password')
+        user.is_staff = True
+        user.save()
+        user.user_permissions.add(
+            Permission.objects.get(codename='change_document'))
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(
+            reverse('admin:excel_import_document_changelist'))
+        self.assertContains(response, 'Import seconds')
+        response = self.client.get(
+            reverse('admin:excel_import_document_change',
+                    args=[document.pk]))
+        self.assertContains(response, '&quot;cells&quot;: 67')
+
+    def test_import_state_is_released_after_import(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+
+        self.assertIsNone(document._context)
+        self.assertEqual(3, document.documentcolors_set.count())
+
+    def test_import_empty_sheet(self):
+        media_root = tempfile.mkdtemp()
+        file = os.path.join(media_root, 'empty.xlsx')
+        Workbook().save(file)
+        with self.settings(MEDIA_ROOT=media_root):
+            document = Document.objects.create(file=file, name="empty")
+
+        document.refresh_from_db()
+        self.assertTrue(document.is_ready)
+        self.assertEqual(0, document.cell_set.count())
+
+    def test_colors_do_not_leak_into_later_imports(self):
+        workbook = Workbook()
+        workbook.active['A1'].fill = PatternFill(fill_type='solid',
+                                                 fgColor='FF123456')
+        media_root = tempfile.mkdtemp()
+        file = os.path.join(media_root, 'colored.xlsx')
+        workbook.save(file)
+        with self.settings(MEDIA_ROOT=media_root):
+            Document.objects.create(file=file, name="colored")
+
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+
+        self.assertNotIn('FF123456', document.documentcolors_set
+                         .values_list('color', flat=True))
+        self.assertEqual(3, document.documentcolors_set.count())
+
+    def test_colors_are_saved_with_one_insert(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        with patch('excel_import.models.DocumentColors.objects.bulk_create',
+                   wraps=DocumentColors.objects.bulk_create) as bulk_create:
+            Document.objects.create(file=file, name="test")
+
+        bulk_create.assert_called_once_with(ANY)
+
     def test_save_on_existing_current_document_does_parse(self):
         file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
         document = Document.objects.create(file=file, name="test")
@@ -42,3 +339,859 @@ class ImportTest(TestCase):
 
         self.assertIsNotNone(bytes)
         self.assertTrue(len(bytes) > 0)
+
+    def test_iter_xlsx(self):
+        media_root = tempfile.mkdtemp()
+        file = os.path.join(media_root, 'test.xlsx')
+        with open(os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx"),
+                  'rb') as source, open(file, 'wb') as target:
+            target.write(source.read())
+        with self.settings(MEDIA_ROOT=media_root):
+            document = Document.objects.create(file=file, name="test")
+        document.refresh_from_db()
+        # The original file is not needed.
+        os.remove(file)
+
+        work_sheet = load_workbook(BytesIO(b''.join(
+            document.iter_xlsx()))).active
+        self.assertEqual('Sheet1', work_sheet.title)
+        self.assertSetEqual({'A1:Q1', 'A2:A4', 'A5:A7'},
+                            set(work_sheet.merged_cell_ranges))
+        colors = dict(document.documentcolors_set.values_list('name',
+                                                               'color'))
+        for cell in document.cell_set.all():
+            exported = work_sheet[cell.coordinate]
+            self.assertEqual(cell.value, exported.value or '')
+            self.assertEqual(cell.horizontal_alignment,
+                             exported.alignment.horizontal)
+            if cell.color_name:
+                self.assertEqual(colors[cell.color_name],
+                                 exported.fill.fgColor.rgb)
+
+    def test_iter_patched_xlsx(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+        document.cell_set.filter(coordinate='B2').update(value='changed',
+                                                         changed=True)
+        Cell.objects.create(document=document, coordinate='C30', row=30,
+                            column=3, value='new row', changed=True)
+        Cell.objects.create(document=document, coordinate='T2', row=2,
+                            column=20, value='=B2', formula='=B2',
+                            changed=True)
+        # Not changed cells are not read from the database.
+        document.cell_set.filter(coordinate='C3').update(value='ignored')
+
+        work_sheet = load_workbook(BytesIO(b''.join(
+            document.iter_patched_xlsx()))).active
+        original = load_workbook(file).active
+        self.assertEqual('changed', work_sheet['B2'].value)
+        self.assertEqual(original['B2'].fill.fgColor.rgb,
+                         work_sheet['B2'].fill.fgColor.rgb)
+        self.assertEqual('new row', work_sheet['C30'].value)
+        self.assertEqual('=B2', work_sheet['T2'].value)
+        self.assertEqual(original['C3'].value, work_sheet['C3'].value)
+        self.assertSetEqual(set(original.merged_cell_ranges),
+                            set(work_sheet.merged_cell_ranges))
+
+    def test_patch_row(self):
+        row = patch_row(b'<row r="2" spans="1:3"><c r="A2" s="1"><v>1</v>'
+                        b'</c><c><v>2</v></c><c r="D2"/></row>', 2,
+                        {2: ('b', ''), 3: ('c', ''), 5: ('', '')})
+
+        self.assertEqual(
+            b'<row r="2"><c r="A2" s="1"><v>1</v></c>'
+            b'<c r="B2" t="inlineStr"><is><t xml:space="preserve">b</t>'
+            b'</is></c><c r="C2" t="inlineStr"><is><t xml:space="preserve">'
+            b'c</t></is></c><c r="D2"/><c r="E2"/></row>', row)
+        self.assertEqual(b'<row r="3"><c r="A3"/></row>',
+                         patch_row(b'<row r="3"/>', 3, {1: ('', '')}))
+
+    def test_iter_rows(self):
+        cells = [(1, 2, 'b1'), (3, 1, 'a3'), (3, 3, 'c3')]
+
+        rows = list(iter_rows(iter(cells)))
+        self.assertListEqual([['', 'b1'], [], ['a3', '', 'c3']], rows)
+        self.assertEqual(',b1\r\n\r\na3,,c3\r\n', ''.join(iter_csv(rows)))
+        self.assertEqual(rows, json.loads(''.join(iter_json(rows))))
+        self.assertListEqual([], list(iter_rows([])))
+
+    def test_get_changed_cells(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="test")
+        formula = Cell.objects.create(document=document, coordinate='T2',
+                                      row=2, column=20, formula='=B2*2')
+        document.recalculate([formula])
+        cell = document.cell_set.at('B2')
+        cell.value, cell.changed = '1', True
+        cell.save()
+        document.recalculate([cell])
+
+        self.assertListEqual([(2, 2, '1', ''), (2, 20, '2', '=B2*2')],
+                             sorted(document.get_changed_cells()))
+
+        # The formula reads no changed cell anymore.
+        document.reset_cells(['B2'])
+        self.assertListEqual([], list(document.get_changed_cells()))
+        self.assertEqual('0', document.cell_set.at('T2').value)
+
+
+@override_settings(MEDIA_ROOT=os.path.join(BASE_DIR, "excel_import/testdata/"),
+                   CELERY_ALWAYS_EAGER=True)
+class GridStorageTest(TestCase):
+    fields = ('coordinate', 'value', 'color_name', 'row_span', 'column_span',
+              'horizontal_alignment', 'first_cell', 'last_cell')
+
+    def values(self, cells):
+        return [tuple(getattr(cell, field) for field in self.fields)
+                for cell in cells]
+
+    def test_grid_dumps_and_loads(self):
+        grid = Grid()
+        grid.append(Cell(coordinate='A1', value='a', color_name='color-1',
+                         column_span=2))
+        grid.append(Cell(coordinate='C1', value='', color_name='color-1'))
+        grid.append(Cell(coordinate='A2', value='b', color_name='',
+                         horizontal_alignment='center', row_span=3))
+
+        loaded = Grid.loads(grid.dumps())
+
+        self.assertEqual(3, len(loaded))
+        self.assertEqual(2, len(loaded.styles))
+        self.assertListEqual(self.values(grid), self.values(loaded))
+        self.assertEqual('C1', loaded.find(1, 3).coordinate)
+        self.assertTrue(loaded.find(2, 1).first_cell)
+        self.assertTrue(loaded.find(2, 1).last_cell)
+        self.assertIsNone(loaded.find(1, 2))
+
+    def test_grid_import_matches_row_import(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        rows = Document.objects.create(file=file, name="rows")
+        with self.settings(EXCEL_IMPORT_GRID_STORAGE=True):
+            grid = Document.objects.create(file=file, name="grid")
+
+        self.assertEqual(Document.GRID, grid.storage)
+        self.assertEqual(0, grid.cell_set.count())
+        self.assertEqual(1, DocumentGrid.objects.filter(document=grid).count())
+        self.assertListEqual(self.values(rows.get_cells()),
+                             self.values(grid.get_cells()))
+
+    @override_settings(EXCEL_IMPORT_GRID_STORAGE=True)
+    def test_get_cell_materializes_grid_cell(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="grid")
+
+        cell = document.get_cell('A2')
+        cell.value = 'changed'
+        cell.save()
+
+        self.assertEqual(cell, document.get_cell('A2'))
+        self.assertEqual(1, document.cell_set.count())
+        self.assertEqual(3, cell.row_span)
+        cells = list(document.get_cells())
+        self.assertEqual(67, len(cells))
+        self.assertIn(cell, cells)
+        self.assertRaises(Cell.DoesNotExist, document.get_cell, 'A3')
+        self.assertRaises(Cell.DoesNotExist, document.get_cell, 'Z99')
+
+    @override_settings(EXCEL_IMPORT_GRID_STORAGE=True)
+    def test_create_xlsx_from_grid(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="grid")
+
+        bytes = document.create_xlsx()
+
+        self.assertTrue(len(bytes) > 0)
+
+    @override_settings(EXCEL_IMPORT_GRID_STORAGE=True)
+    def test_iter_xlsx_from_grid(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        document = Document.objects.create(file=file, name="grid")
+        document.get_cell('B2')
+        Cell.objects.filter(document=document).update(value='changed')
+
+        work_sheet = load_workbook(BytesIO(b''.join(
+            document.iter_xlsx()))).active
+        self.assertEqual('changed', work_sheet['B2'].value)
+        self.assertEqual(3, len(work_sheet.merged_cell_ranges))
+
+
+@override_settings(MEDIA_ROOT=os.path.join(BASE_DIR, "excel_import/testdata/"),
+                   CELERY_ALWAYS_EAGER=True)
+class CellQuerySetTest(TestCase):
+
+    def setUp(self):
+        file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+        self.document = Document.objects.create(file=file, name="test")
+
+    def test_import_sets_row_and_column(self):
+        cell = self.document.cell_set.get(coordinate='C3')
+
+        self.assertEqual((3, 3), (cell.row, cell.column))
+        self.assertFalse(self.document.cell_set.filter(row__isnull=True)
+                         .exists())
+
+    def test_in_rows_and_columns(self):
+        cells = self.document.cell_set
+
+        self.assertEqual(1, cells.in_rows(1).count())
+        self.assertEqual(17 + 16 * 2, cells.in_rows(2, 4).count())
+        self.assertEqual(3, cells.in_columns(1).count())
+        self.assertListEqual(['B2', 'C2', 'B3', 'C3'],
+                             [cell.coordinate for cell
+                              in cells.in_range('b2:c3')])
+
+    def test_at(self):
+        self.assertEqual('Q5', self.document.cell_set.at('Q5').coordinate)
+        self.assertRaises(Cell.DoesNotExist, self.document.cell_set.at, 'A3')
+        self.assertRaises(Cell.DoesNotExist, self.document.cell_set.at, 'A')
+
+    def test_in_bulk_coordinates(self):
+        cells = self.document.cell_set.in_bulk_coordinates(
+            ['A2', 'Q5', 'A3'])
+
+        self.assertListEqual(['A2', 'Q5'], sorted(cells))
+        self.assertEqual('Q5', cells['Q5'].coordinate)
+        self.assertEqual({}, self.document.cell_set.in_bulk_coordinates([]))
+
+    def test_in_bulk_coordinates_reads_only_the_cells(self):
+        with CaptureQueriesContext(connection) as queries:
+            cells = self.document.cell_set.in_bulk_coordinates(
+                ['A1', 'Q5'])
+
+        self.assertListEqual(['A1', 'Q5'], sorted(cells))
+        self.assertEqual(1, len(queries))
+        self.assertNotIn('>=', queries[0]['sql'])
+
+    def test_migration_sets_row_and_column_per_column(self):
+        self.document.cell_set.update(row=None, column=None)
+        migration = import_module(
+            'excel_import.migrations.0015_cell_row_column')
+
+        with CaptureQueriesContext(connection) as queries:
+            migration.set_row_and_column(apps, None)
+
+        cell = self.document.cell_set.get(coordinate='Q5')
+        self.assertEqual((5, 17), (cell.row, cell.column))
+        self.assertFalse(self.document.cell_set.filter(row__isnull=True)
+                         .exists())
+        columns = self.document.cell_set.values('column').distinct().count()
+        updates = [query for query in queries if 'UPDATE' in query['sql']]
+        self.assertEqual(columns, len(updates))
+
+
+@override_settings(MEDIA_ROOT=os.path.join(BASE_DIR, "excel_import/testdata/"),
+                   CELERY_ALWAYS_EAGER=True)
+class DeduplicationTest(TestCase):
+    file = os.path.join(BASE_DIR, "excel_import/testdata/test.xlsx")
+    fields = ('coordinate', 'row', 'column', 'value', 'color_name',
+              'row_span', 'column_span', 'horizontal_alignment',
+              'first_cell', 'last_cell')
+
+    def test_import_stores_content_hash(self):
+        document = Document.objects.create(file=self.file, name="test")
+
+        with open(self.file, 'rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(),
+                             document.content_hash)
+
+    def test_identical_file_copies_cells(self):
+        first = Document.objects.create(file=self.file, name="first")
+        with patch('excel_import.models.Document.parse_file') as parse_file:
+            second = Document.objects.create(file=self.file, name="second")
+
+        self.assertFalse(parse_file.called)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(second.is_ready)
+        self.assertEqual(first.rows_total, second.rows_total)
+        self.assertListEqual(list(first.cell_set.values_list(*self.fields)),
+                             list(second.cell_set.values_list(*self.fields)))
+        self.assertEqual(3, second.documentcolors_set.count())
+
+    def test_other_worksheet_is_parsed(self):
+        Document.objects.create(file=self.file, name="first")
+        with patch('excel_import.models.Document.parse_file') as parse_file:
+            Document.objects.create(file=self.file, name="second",
+                                    worksheet=1)
+
+        self.assertTrue(parse_file.called)
+
+    @override_settings(EXCEL_IMPORT_DEDUPLICATE=False)
+    def test_deduplicate_setting(self):
+        Document.objects.create(file=self.file, name="first")
+        with patch('excel_import.models.Document.parse_file') as parse_file:
+            Document.objects.create(file=self.file, name="second")
+
+        self.assertTrue(parse_file.called)
+
+    @override_settings(EXCEL_IMPORT_GRID_STORAGE=True)
+    def test_identical_file_copies_grid(self):
+        first = Document.objects.create(file=self.file, name="first")
+        first.get_cell('A2')
+        second = Document.objects.create(file=self.file, name="second")
+
+        self.assertEqual(first.documentgrid.data, second.documentgrid.data)
+        self.assertEqual(0, second.cell_set.count())
+
+    def test_reset_cells(self):
+        document = Document.objects.create(file=self.file, name="test")
+        value = document.cell_set.at('C3').value
+        document.cell_set.filter(coordinate__in=['C3', 'Q5']) \
+            .update(value='changed')
+
+        document.reset_cells(['C3'])
+
+        self.assertEqual(value, document.cell_set.at('C3').value)
+        self.assertEqual('changed', document.cell_set.at('Q5').value)
+
+    def test_content_addressed_path(self):
+        document = Document(content_hash='ab' * 32)
+
+        self.assertEqual('documents/ab/%s.xlsx' % document.content_hash,
+                         content_addressed_path(document, 'Test.XLSX'))
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True, EXCEL_IMPORT_DEDUPLICATE=False)
+class IncrementalImportTest(TestCase):
+    fields = ('coordinate', 'row', 'column', 'value', 'color_name',
+              'row_span', 'column_span', 'horizontal_alignment',
+              'first_cell', 'last_cell')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.base_file = self.save_workbook('base.xlsx', rows=3)
+        self.revision_file = self.save_workbook('revision.xlsx', rows=2,
+                                                B2='changed')
+
+    def save_workbook(self, name, rows, **values):
+        workbook = Workbook()
+        work_sheet = workbook.active
+        for row in range(1, rows + 1):
+            for column in 'ABC':
+                work_sheet['%s%d' % (column, row)] = 'value %s%d' % (column,
+                                                                    row)
+        for coordinate, value in values.items():
+            work_sheet[coordinate] = value
+        file = os.path.join(self.media_root, name)
+        workbook.save(file)
+        return file
+
+    def test_import_revision_writes_differences(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.base_file,
+                                               name="test")
+            with patch('excel_import.models.Document.import_file'):
+                revision = Document.objects.create(file=self.revision_file,
+                                                   name="test",
+                                                   replaces=document)
+            summary = revision.import_revision(document)
+
+        self.assertDictEqual({'added': 0, 'changed': 2, 'removed': 3,
+                              'unchanged': 4}, summary)
+        self.assertEqual(9, document.cell_set.count())
+        self.assertEqual('changed', revision.cell_set.at('B2').value)
+        self.assertTrue(revision.cell_set.at('C2').last_cell)
+
+    @override_settings(EXCEL_IMPORT_INCREMENTAL=True)
+    def test_import_revision_keeps_differences_in_statistics(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.base_file,
+                                               name="test")
+            revision = Document.objects.create(file=self.revision_file,
+                                               name="test",
+                                               replaces=document)
+
+        revision.refresh_from_db()
+        statistics = revision.get_import_statistics()
+        self.assertEqual('revision', statistics['method'])
+        self.assertDictEqual({'added': 0, 'changed': 2, 'removed': 3,
+                              'unchanged': 4}, statistics['diff'])
+        self.assertNotIn('diff', document.get_import_statistics())
+
+    @override_settings(EXCEL_IMPORT_CHUNK_SIZE=2)
+    def test_import_revision_loads_cells_in_row_bands(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.base_file,
+                                               name="test")
+            with patch('excel_import.models.Document.import_file'):
+                revision = Document.objects.create(file=self.revision_file,
+                                                   name="test",
+                                                   replaces=document)
+            with patch('excel_import.writers.DiffCellWriter.load_rows',
+                       autospec=True,
+                       side_effect=DiffCellWriter.load_rows) as load_rows:
+                summary = revision.import_revision(document)
+
+        # Batches of two cells, loaded up to the row of their last cell.
+        self.assertListEqual([1, 2, 2],
+                             [call[0][1] for call in load_rows.call_args_list])
+        self.assertDictEqual({'added': 0, 'changed': 2, 'removed': 3,
+                              'unchanged': 4}, summary)
+        self.assertEqual('changed', revision.cell_set.at('B2').value)
+
+    def test_import_revision_matches_full_import(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.revision_file,
+                                               name="test")
+            revision = Document.objects.create(file=self.base_file,
+                                               name="test",
+                                               replaces=document)
+            with self.settings(EXCEL_IMPORT_INCREMENTAL=False):
+                full = Document.objects.create(file=self.base_file,
+                                               name="full")
+
+        self.assertListEqual(list(full.cell_set.values_list(*self.fields)),
+                             list(revision.cell_set.values_list(*self.fields)))
+        self.assertEqual(6, document.cell_set.count())
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+class MultipleWorksheetsTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        workbook = Workbook()
+        workbook.active.title = 'First'
+        workbook.create_sheet(title='Second')
+        workbook.create_sheet(title='Third')
+        for index, work_sheet in enumerate(workbook.worksheets):
+            work_sheet['A1'] = 'sheet %d' % index
+            work_sheet['B2'] = index
+        self.file = os.path.join(self.media_root, 'sheets.xlsx')
+        workbook.save(self.file)
+
+    def test_list_worksheets_from_file(self):
+        expected = [(0, 'First'), (1, 'Second'), (2, 'Third')]
+        self.assertListEqual(expected, list_worksheets_from_file(self.file))
+        with open(self.file, 'rb') as file:
+            self.assertListEqual(expected, list_worksheets_from_file(file))
+            self.assertEqual(0, file.tell())
+
+    def test_import_extra_worksheets_in_one_pass(self):
+        for streaming in (False, True):
+            with self.settings(MEDIA_ROOT=self.media_root,
+                               EXCEL_IMPORT_STREAMING=streaming), \
+                    patch('excel_import.importers.load_workbook',
+                          wraps=load_workbook) as load:
+                document = Document.objects.create(file=self.file,
+                                                   name="test",
+                                                   extra_worksheets='2,0')
+
+            self.assertEqual(1, load.call_count)
+            document.refresh_from_db()
+            self.assertEqual('First', document.worksheet_name)
+            sheet = document.sheets.get()
+            self.assertEqual((2, 'Third', 'test - Third'),
+                             (sheet.worksheet, sheet.worksheet_name,
+                              sheet.name))
+            self.assertTrue(sheet.is_ready)
+            self.assertEqual('sheet 2', sheet.cell_set.at('A1').value)
+            self.assertEqual('sheet 0', document.cell_set.at('A1').value)
+
+    def test_new_revision_replaces_sheets(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.file, name="test",
+                                               extra_worksheets='1,2')
+            revision = Document.objects.create(file=self.file, name="test",
+                                               extra_worksheets='1',
+                                               replaces=document)
+
+        self.assertFalse(document.sheets.filter(current=True).exists())
+        sheet = revision.sheets.get()
+        self.assertEqual(document.sheets.get(worksheet=1).pk,
+                         sheet.replaces_id)
+        self.assertEqual(2, Document.objects.filter(current=True).count())
+
+
+    def test_revision_of_sheet_is_imported(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.file, name="test",
+                                               extra_worksheets='2')
+            sheet = document.sheets.get()
+            revision = Document.objects.create(
+                file=self.file, name=sheet.name, worksheet=1,
+                worksheet_name=sheet.worksheet_name, sheet_of=document,
+                replaces=sheet)
+
+        revision.refresh_from_db()
+        self.assertTrue(revision.is_ready)
+        self.assertEqual('Second', revision.worksheet_name)
+        self.assertEqual('sheet 1', revision.cell_set.at('A1').value)
+        self.assertListEqual([revision], list(
+            document.sheets.filter(current=True)))
+
+    def test_revision_takes_name_of_imported_sheet(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.file, name="test")
+            revision = Document.objects.create(
+                file=self.file, name="test", worksheet=2,
+                worksheet_name=document.worksheet_name, replaces=document)
+
+        document.refresh_from_db()
+        revision.refresh_from_db()
+        self.assertEqual('First', document.worksheet_name)
+        self.assertEqual('Third', revision.worksheet_name)
+
+class FormulaTest(TestCase):
+    values = {
+        (1, 1): '1', (2, 1): '2', (3, 1): 'text', (4, 1): '',
+        (1, 2): '2.5', (2, 2): '#DIV/0!',
+    }
+
+    def evaluate(self, formula):
+        def get_range(min_row, min_column, max_row, max_column):
+            return [self.values.get((row, column), '')
+                    for row in range(min_row, max_row + 1)
+                    for column in range(min_column, max_column + 1)]
+
+        return evaluate(parse_formula(formula), get_range)
+
+    def test_evaluate(self):
+        self.assertEqual('3', self.evaluate('=SUM(A1:A4)'))
+        self.assertEqual('5.5', self.evaluate('=sum(A1:A2, $B$1)'))
+        self.assertEqual('4', self.evaluate('=COUNTA(A:B) - 1'))
+        self.assertEqual('1', self.evaluate('=COUNTIF(A1:A4, ">1")'))
+        self.assertEqual('1', self.evaluate('=COUNTIF(A1:A4, "t*")'))
+        self.assertEqual('7', self.evaluate('=1+2*3'))
+        # Negation binds tighter than ^.
+        self.assertEqual('0.5', self.evaluate('=-(A1-A2*2)^2/6*A1%*100/3'))
+        self.assertEqual('TRUE', self.evaluate('=A2>A1'))
+        self.assertEqual('1text', self.evaluate('=A1&A3'))
+        self.assertEqual('#DIV/0!', self.evaluate('=A1/A4'))
+        self.assertEqual('#DIV/0!', self.evaluate('=SUM(B1:B2)'))
+        self.assertEqual('#VALUE!', self.evaluate('=A3+1'))
+
+    def test_get_references(self):
+        self.assertListEqual(
+            [(1, 1, 3, 2), (2, 3, 2, 3), (1, 4, MAX_ROW, 4)],
+            get_references(parse_formula('=SUM(B3:A1) + C2 * COUNTA(D:D)')))
+
+    def test_unsupported_formula(self):
+        for formula in ('=VLOOKUP(1, A1:B2, 2)', '=Sheet2!A1', '=SUM(A1'):
+            with self.assertRaises(FormulaError):
+                parse_formula(formula)
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+class FormulaImportTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        workbook = Workbook()
+        work_sheet = workbook.active
+        for row, value in enumerate([1, 2, 3], start=1):
+            work_sheet.cell(row=row, column=1).value = value
+        work_sheet['A4'] = '=SUM(A1:A3)'
+        work_sheet['B1'] = '=A4*2'
+        work_sheet['B2'] = '=COUNTIF(A1:A3,">1")'
+        work_sheet['B3'] = '=VLOOKUP(1,A1:A3,1)'
+        work_sheet['B4'] = '=B4+1'
+        work_sheet['C1'] = 'unrelated'
+        work_sheet['C2'] = '=COUNTA(C1)'
+        self.file = os.path.join(self.media_root, 'formulas.xlsx')
+        workbook.save(self.file)
+
+    def import_document(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=self.file, name="test")
+        document.refresh_from_db()
+        return document
+
+    def assertValues(self, document, expected):
+        self.assertDictEqual(expected, dict(
+            (coordinate, document.cell_set.at(coordinate).value)
+            for coordinate in expected))
+
+    def test_import_calculates_formulas(self):
+        for streaming in (False, True):
+            with self.settings(EXCEL_IMPORT_STREAMING=streaming):
+                document = self.import_document()
+
+            self.assertValues(document, {
+                'A4': '6', 'B1': '12', 'B2': '2',
+                'B3': '=VLOOKUP(1,A1:A3,1)', 'B4': '#REF!', 'C2': '1'})
+            self.assertEqual('=SUM(A1:A3)',
+                             document.cell_set.at('A4').formula)
+            self.assertEqual(2, FormulaReference.objects.filter(
+                document=document, formula_cell__formula__contains='A1:A3')
+                .count())
+
+    def test_calculate_updates_values_in_batches(self):
+        document = self.import_document()
+        cells = [Cell.objects.create(document=document, row=row, column=5,
+                                     coordinate='E%d' % row,
+                                     formula='=A1+%d' % (row % 2))
+                 for row in range(1, 11)]
+
+        with CaptureQueriesContext(connection) as queries:
+            document.calculate(cells)
+        updates = [query for query in queries
+                   if 'UPDATE' in query['sql']]
+        self.assertEqual(1, len(updates))
+        self.assertListEqual(['2', '1'] * 5, list(document.cell_set.filter(
+            column=5).order_by('row').values_list('value', flat=True)))
+
+    def test_build_formulas_loads_values_in_one_query(self):
+        workbook = Workbook()
+        work_sheet = workbook.active
+        for row in range(1, 201):
+            work_sheet.cell(row=row, column=1).value = row
+            work_sheet.cell(row=row, column=2).value = 2
+            work_sheet.cell(row=row, column=3).value = '=A%d*B%d' % (row,
+                                                                   row)
+        self.file = os.path.join(self.media_root, 'rows.xlsx')
+        workbook.save(self.file)
+        document = self.import_document()
+
+        with CaptureQueriesContext(connection) as queries:
+            document.build_formulas()
+
+        # Independent of the number of formulas, except for the batches
+        # of inserted references and updated values.
+        self.assertLess(len(queries), 10)
+        self.assertEqual('400', document.cell_set.at('C200').value)
+
+    def test_iter_xlsx_writes_formulas(self):
+        document = self.import_document()
+
+        work_sheet = load_workbook(BytesIO(b''.join(
+            document.iter_xlsx()))).active
+        self.assertEqual('=SUM(A1:A3)', work_sheet['A4'].value)
+        self.assertEqual('1', work_sheet['A1'].value)
+
+    def test_recalculate_dependent_cells(self):
+        document = self.import_document()
+        cell = document.cell_set.at('A2')
+        cell.value = '10'
+        cell.save()
+        document.cell_set.filter(coordinate='C2').update(value='stale')
+
+        document.recalculate([cell])
+        self.assertValues(document, {'A4': '14', 'B1': '28', 'B2': '2',
+                                     'C2': 'stale'})
+
+        cell = document.cell_set.at('A3')
+        cell.value, cell.formula = '=A4', '=A4'
+        cell.save()
+        document.recalculate([cell])
+        # A3 and A4 read each other, B1 and B2 read A4 and A3.
+        self.assertValues(document, {'A3': '#REF!', 'A4': '#REF!',
+                                     'B1': '#REF!', 'B2': '#REF!',
+                                     'C2': 'stale'})
+
+
+ODS_CONTENT = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content
+    xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+    xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0"
+    xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+    xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+    xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0">
+  <office:automatic-styles>
+    <style:style style:name="ce1" style:family="table-cell">
+      <style:table-cell-properties fo:background-color="#ff0000"/>
+      <style:paragraph-properties fo:text-align="center"/>
+    </style:style>
+  </office:automatic-styles>
+  <office:body><office:spreadsheet>
+    <table:table table:name="Data">
+      <table:table-row>
+        <table:table-cell table:number-columns-spanned="2">
+          <text:p>merged</text:p>
+        </table:table-cell>
+        <table:covered-table-cell/>
+        <table:table-cell table:style-name="ce1" office:value-type="float"
+                          office:value="3"><text:p>3</text:p>
+        </table:table-cell>
+        <table:table-cell table:number-columns-repeated="1020"/>
+      </table:table-row>
+      <table:table-row>
+        <table:table-cell><text:p>x</text:p></table:table-cell>
+        <table:table-cell/>
+        <table:table-cell><text:p>z</text:p></table:table-cell>
+      </table:table-row>
+      <table:table-row table:number-rows-repeated="1048574">
+        <table:table-cell table:number-columns-repeated="1024"/>
+      </table:table-row>
+    </table:table>
+    <table:table table:name="Empty"/>
+  </office:spreadsheet></office:body>
+</office:document-content>
+"""
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+class ImporterTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+
+    def save_file(self, name, content):
+        file = os.path.join(self.media_root, name)
+        if name.endswith('.ods'):
+            with ZipFile(file, 'w') as archive:
+                archive.writestr(
+                    'mimetype', 'application/vnd.oasis.opendocument.'
+                                'spreadsheet')
+                archive.writestr('content.xml', content)
+        else:
+            with open(file, 'w') as opened:
+                opened.write(content)
+        return file
+
+    def import_file(self, file):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document = Document.objects.create(file=file, name="test")
+        document.refresh_from_db()
+        self.assertTrue(document.is_ready)
+        return document
+
+    def test_get_importer_class(self):
+        self.assertIs(XlsxImporter, get_importer_class('a/b.XLSX'))
+        self.assertIs(CsvImporter, get_importer_class('b.csv'))
+        self.assertIs(OdsImporter, get_importer_class('b.ods'))
+        self.assertIs(XlsxImporter, get_importer_class('b'))
+        with self.settings(EXCEL_IMPORT_IMPORTERS={
+                '.csv': 'excel_import.importers.OdsImporter'}):
+            self.assertIs(OdsImporter, get_importer_class('b.csv'))
+
+    def test_import_csv(self):
+        file = self.save_file('test.csv', 'a;b;c\n1;2\n\n')
+        self.assertListEqual([(0, 'Sheet1')],
+                             list_worksheets_from_file(file))
+
+        document = self.import_file(file)
+        self.assertListEqual(
+            [('A1', 'a'), ('B1', 'b'), ('C1', 'c'), ('A2', '1'), ('B2', '2'),
+             ('C2', '')],
+            list(document.cell_set.values_list('coordinate', 'value')))
+        self.assertTrue(document.cell_set.at('C2').last_cell)
+
+    def test_import_ods(self):
+        file = self.save_file('test.ods', ODS_CONTENT)
+        self.assertListEqual([(0, 'Data'), (1, 'Empty')],
+                             list_worksheets_from_file(file))
+        self.assertEqual((2, 3, 1), OdsImporter.read_size(file, 0))
+
+        document = self.import_file(file)
+        self.assertListEqual(
+            ['A1', 'C1', 'A2', 'B2', 'C2'],
+            list(document.cell_set.values_list('coordinate', flat=True)))
+        self.assertEqual(2, document.cell_set.at('A1').column_span)
+        cell = document.cell_set.at('C1')
+        self.assertEqual(('3', 'color_FFFF0000', 'center'),
+                         (cell.value, cell.color_name,
+                          cell.horizontal_alignment))
+        self.assertListEqual(['FFFF0000'], list(
+            document.documentcolors_set.values_list('color', flat=True)))
+
+        cell = document.cell_set.at('A2')
+        Cell.objects.filter(pk=cell.pk).update(value='changed')
+        with self.settings(MEDIA_ROOT=self.media_root):
+            document.reset_cells(['A2'])
+            xlsx = document.create_xlsx()
+        cell.refresh_from_db()
+        self.assertEqual('x', cell.value)
+
+        work_sheet = load_workbook(BytesIO(xlsx)).active
+        self.assertEqual('Data', work_sheet.title)
+        self.assertEqual('z', work_sheet['C2'].value)
+        self.assertListEqual(['A1:B1'], work_sheet.merged_cell_ranges)
+
+
+class BenchmarkSuiteTest(TestCase):
+
+    def test_generate_workbook(self):
+        file = os.path.join(tempfile.mkdtemp(), 'generated.xlsx')
+        generate_workbook(file, rows=6, columns=4, merged_density=1.0,
+                          fill_density=1.0, value_size=3)
+
+        work_sheet = load_workbook(file).active
+        self.assertEqual((6, 4), (work_sheet.max_row, work_sheet.max_column))
+        self.assertEqual(6, len(work_sheet.merged_cell_ranges))
+        self.assertEqual('1:1', work_sheet['A1'].value)
+        self.assertSetEqual(
+            {'rgb', 'indexed', 'theme'},
+            set(cell.fill.fgColor.type for row in work_sheet.rows
+                for cell in row))
+
+    def test_run_suite(self):
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            suite = run_suite([{'name': 'tiny', 'rows': 4, 'columns': 3,
+                                'merged_density': 1.0}], isolated=False)
+
+        self.assertListEqual(
+            ['create_merged_index', 'parse_file', 'create_xlsx'],
+            [result['phase'] for result in suite['results']])
+        parse_file = suite['results'][1]
+        self.assertEqual('tiny', parse_file['case'])
+        # 12 cells, 6 of them hidden by A1:B2 and A3:B4.
+        self.assertEqual(6, parse_file['db_rows'])
+        self.assertFalse(Document.objects.exists())
+        json.dumps(suite)
+
+
+class MergedCellIndexTest(TestCase):
+
+    def test_is_hidden(self):
+        index = MergedCellIndex(['A1:Q1', 'A2:A4', 'C3:D4'])
+
+        self.assertFalse(index.is_hidden(1, 1))
+        self.assertTrue(index.is_hidden(1, 2))
+        self.assertTrue(index.is_hidden(1, 17))
+        self.assertFalse(index.is_hidden(1, 18))
+        self.assertFalse(index.is_hidden(2, 1))
+        self.assertTrue(index.is_hidden(4, 1))
+        self.assertFalse(index.is_hidden(3, 3))
+        self.assertTrue(index.is_hidden(3, 4))
+        self.assertTrue(index.is_hidden(4, 3))
+        self.assertFalse(index.is_hidden(4, 2))
+        self.assertFalse(index.is_hidden(5, 1))
+
+    def test_get_span(self):
+        index = MergedCellIndex(['A1:Q1', 'A2:A4', 'C3:D4'])
+
+        self.assertEqual((17, None), index.get_span(1, 1))
+        self.assertEqual((None, 3), index.get_span(2, 1))
+        self.assertEqual((2, 2), index.get_span(3, 3))
+        self.assertEqual((None, None), index.get_span(1, 2))
+        self.assertEqual(3, len(index))
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+class CellWriterTest(TestCase):
+
+    def test_get_cell_writer_for_sqlite(self):
+        writer = get_cell_writer(Cell)
+
+        self.assertIsInstance(writer, ExecuteManyCellWriter)
+
+    @override_settings(
+        EXCEL_IMPORT_CELL_WRITER='excel_import.writers.BulkCreateCellWriter')
+    def test_get_cell_writer_from_settings(self):
+        writer = get_cell_writer(Cell, batch_size=10)
+
+        self.assertIs(BulkCreateCellWriter, type(writer))
+        self.assertEqual(10, writer.batch_size)
+
+    def test_execute_many_writer_writes_batches(self):
+        with patch('excel_import.models.Document.parse_file'):
+            document = Document.objects.create(name="test")
+
+        with ExecuteManyCellWriter(Cell, batch_size=3) as writer:
+            for i in range(7):
+                writer.write(Cell(coordinate='A%d' % (i + 1),
+                                  value=i,
+                                  document=document))
+
+        self.assertEqual(7, writer.rows_written)
+        self.assertListEqual(
+            ['0', '1', '2', '3', '4', '5', '6'],
+            list(document.cell_set.values_list('value', flat=True)))
+
+    def test_format_copy_value(self):
+        self.assertEqual('\\N', format_copy_value(None))
+        self.assertEqual('t', format_copy_value(True))
+        self.assertEqual('f', format_copy_value(False))
+        self.assertEqual('12', format_copy_value(12))
+        self.assertEqual('a\\tb\\nc\\\\', format_copy_value('a\tb\nc\\'))
@@ -1,7 +1,20 @@
-from openpyxl import load_workbook
+from excel_import.importers import get_importer_class
 
 
-def list_worksheets_from_file(filename):
-    workbook = load_workbook(filename)
-    worksheets = workbook.worksheets
-    return [(i, worksheets[i].title) for i in range(0,len(worksheets))]
\ No newline at end of file
+def list_worksheets_from_file(file):
+    """
+    Returns (index, title) of every worksheet of the file, a path or file
+    object, in the order of workbook.worksheets.
+
+    The worksheets are listed by the importer for the type of the file,
+    which does not parse them, see Importer.list_worksheets.
+    """
+    return get_importer_class(file).list_worksheets(file)
+
+
+def read_worksheet_size(file, index):
+    """
+    Returns the number of rows, columns and merged cell ranges of the
+    worksheet at index of the file, see Importer.read_size.
+    """
+    return get_importer_class(file).read_size(file, index)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import ugettext_lazy as _
+
+from excel_import.utils import read_worksheet_size
+
+
+def validate_file_size(file):
+    """
+    Rejects files larger than EXCEL_IMPORT_MAX_FILE_SIZE bytes.
+    """
+    max_size = getattr(settings, 'EXCEL_IMPORT_MAX_FILE_SIZE', None)
+    if max_size and file.size > max_size:
+        raise ValidationError(
+            _("The file is %(size)s large, files may have at most "
+              "%(max_size)s."),
+            code='file_size',
+            params={'size': filesizeformat(file.size),
+                    'max_size': filesizeformat(max_size)})
+
+
+def validate_worksheet_size(file, index, title=None):
+    """
+    Rejects worksheets with more cells than EXCEL_IMPORT_MAX_CELLS or more
+    merged cell ranges than EXCEL_IMPORT_MAX_MERGED_CELLS.
+
+    The size is read from the sheet xml before anything is imported, see
+    read_worksheet_size.
+    """
+    rows, columns, merged_cell_ranges = read_worksheet_size(file, index)
+    title = title or str(index + 1)
+    errors = []
+
+    max_cells = getattr(settings, 'EXCEL_IMPORT_MAX_CELLS', None)
+    if max_cells and rows * columns > max_cells:
+        errors.append(ValidationError(
+            _("Worksheet %(title)s has %(cells)d cells (%(rows)d rows, "
+              "%(columns)d columns), at most %(max_cells)d are allowed."),
+            code='cells',
+            params={'title': title, 'cells': rows * columns, 'rows': rows,
+                    'columns': columns, 'max_cells': max_cells}))
+
+    max_merged = getattr(settings, 'EXCEL_IMPORT_MAX_MERGED_CELLS', None)
+    if max_merged and merged_cell_ranges > max_merged:
+        errors.append(ValidationError(
+            _("Worksheet %(title)s has %(merged)d merged cell ranges, at "
+              "most %(max_merged)d are allowed."),
+            code='merged_cells',
+            params={'title': title, 'merged': merged_cell_ranges,
+                    'max_merged': max_merged}))
+
+    if errors:
+        raise ValidationError(errors)
@@ -0,0 +1,91 @@
+"""
+Exports of the cell values of a document as csv or json, for consumers
+that do not need the formatting of the xlsx export.
+
+Rows are rebuilt from the row and column of the cells while they are
+streamed from the database, see Document.iter_values, so the sheet is
+never held in memory. Positions without a cell, e.g. inside of merged
+cells, are empty strings, rows without a cell empty rows. Rows end with
+their last cell, so they can differ in length.
+"""
+import csv
+import json
+
+# Rows written per chunk of the response.
+CHUNK_ROWS = 500
+
+
+def iter_rows(cells):
+    """
+    Yields a list of values per row of cells, (row, column, value) tuples
+    in row order.
+    """
+    current = None
+    values = []
+    for row, column, value in cells:
+        if row is None:
+            continue
+        if current is None:
+            current = 1
+        while current < row:
+            yield values
+            values = []
+            current += 1
+        values.extend([''] * (column - len(values) - 1))
+        values.append(value)
+    if current is not None:
+        yield values
+
+
+class Echo(object):
+    """
+    File object for csv.writer, which returns what is written.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """
+    Yields rows as csv in chunks.
+    """
+    writer = csv.writer(Echo())
+    chunk = []
+    for values in rows:
+        chunk.append(writer.writerow(values))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+
+def iter_json(rows):
+    """
+    Yields rows as json array of row arrays in chunks.
+    """
+    chunk = ['[']
+    separator = ''
+    for values in rows:
+        chunk.append(separator + json.dumps(values))
+        separator = ','
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+# Writer and content type per format.
+FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'json': (iter_json, 'application/json'),
+}
+
+
+def iter_values(document, format):
+    """
+    Yields the values of document in format, a key of FORMATS.
+    """
+    writer, content_type = FORMATS[format]
+    return writer(iter_rows(document.iter_values()))
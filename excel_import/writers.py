@@ -0,0 +1,330 @@
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from excel_import.grid import Grid
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BulkCreateCellWriter(object):
+    """
+    Buffers model instances and writes them in batches with bulk_create.
+
+    Writers are used as context managers, leaving the block flushes the
+    remaining instances. rows_written, seconds and rows_per_second report
+    the throughput of the database writes.
+    """
+
+    def __init__(self, model, batch_size=None, using='default'):
+        self.model = model
+        self.batch_size = batch_size or \
+            getattr(settings, 'EXCEL_IMPORT_CHUNK_SIZE', 1000)
+        self.using = using
+        self.rows_written = 0
+        self.seconds = 0.0
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            logger.info("Wrote %d rows in %.2fs (%.0f rows/s) with %s"
+                        % (self.rows_written, self.seconds,
+                           self.rows_per_second, type(self).__name__))
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.rows_written / self.seconds
+
+    @property
+    def fields(self):
+        return [field for field in self.model._meta.concrete_fields
+                if not field.primary_key]
+
+    def write(self, instance):
+        self._buffer.append(instance)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        start = time.time()
+        self.write_batch(self._buffer)
+        self.seconds += time.time() - start
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def write_batch(self, instances):
+        self.model.objects.using(self.using).bulk_create(instances)
+
+    def get_db_values(self, instance):
+        connection = connections[self.using]
+        return [field.get_db_prep_save(getattr(instance, field.attname),
+                                       connection)
+                for field in self.fields]
+
+
+class ExecuteManyCellWriter(BulkCreateCellWriter):
+    """
+    Inserts every batch with a single executemany call and keeps all
+    batches in one transaction. Used for SQLite, where large bulk_create
+    statements run into the limit of query variables.
+    """
+
+    def __enter__(self):
+        self._atomic = transaction.atomic(using=self.using)
+        self._atomic.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            super(ExecuteManyCellWriter, self).__exit__(exc_type, exc_value,
+                                                        traceback)
+        finally:
+            self._atomic.__exit__(exc_type, exc_value, traceback)
+
+    def write_batch(self, instances):
+        connection = connections[self.using]
+        quote_name = connection.ops.quote_name
+        fields = self.fields
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            quote_name(self.model._meta.db_table),
+            ', '.join(quote_name(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)))
+
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [self.get_db_values(instance)
+                                     for instance in instances])
+
+
+def format_copy_value(value):
+    """
+    Formats a value for the text format of PostgreSQL's COPY.
+    """
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    return str(value).replace('\\', '\\\\') \
+        .replace('\t', '\\t') \
+        .replace('\n', '\\n') \
+        .replace('\r', '\\r')
+
+
+class CopyCellWriter(BulkCreateCellWriter):
+    """
+    Streams every batch into the table with COPY FROM STDIN on PostgreSQL.
+    """
+
+    def write_batch(self, instances):
+        connection = connections[self.using]
+        quote_name = connection.ops.quote_name
+        sql = 'COPY %s (%s) FROM STDIN' % (
+            quote_name(self.model._meta.db_table),
+            ', '.join(quote_name(field.column) for field in self.fields))
+
+        data = StringIO()
+        for instance in instances:
+            data.write('\t'.join(format_copy_value(value) for value
+                                 in self.get_db_values(instance)))
+            data.write('\n')
+        data.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, data)
+
+
+class GridCellWriter(BulkCreateCellWriter):
+    """
+    Collects the cells of a document in a columnar Grid and saves it as a
+    single row of model, e.g. DocumentGrid, instead of one row per cell.
+    """
+
+    def __init__(self, model, document, batch_size=None, using='default'):
+        super(GridCellWriter, self).__init__(model, batch_size=batch_size,
+                                             using=using)
+        self.document = document
+        self.grid = Grid()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(GridCellWriter, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.model.objects.using(self.using).create(
+                document=self.document,
+                data=self.grid.dumps())
+
+    def write_batch(self, instances):
+        for instance in instances:
+            self.grid.append(instance)
+
+
+class DiffCellWriter(BulkCreateCellWriter):
+    """
+    Applies an import to the cells a document already has, e.g. copied
+    from its previous revision. Cells are matched by row and column:
+    unchanged cells are left alone, changed cells are updated, new cells
+    are inserted with the writer of the database and cells missing from
+    the import are deleted.
+
+    Cells must be written in row order. The existing cells are loaded
+    row band by row band as the import passes them, so only the cells of
+    about one batch are held in memory.
+
+    added, changed, removed and unchanged count the cells of each kind.
+    """
+
+    def __init__(self, model, document, batch_size=None, using='default'):
+        super(DiffCellWriter, self).__init__(model, batch_size=batch_size,
+                                             using=using)
+        self.document = document
+        self.added = self.changed = self.removed = self.unchanged = 0
+        # Existing cells of the loaded rows not matched yet, by position.
+        self._existing = dict()
+        self._loaded_row = 0
+        self._inserter = get_cell_writer(model, batch_size=batch_size,
+                                         using=using)
+
+    def __enter__(self):
+        self._inserter.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._inserter.__exit__(exc_type, exc_value, traceback)
+
+        if exc_type is None:
+            self.delete_removed()
+            logger.info("Applied import to document %d: %s"
+                        % (self.document.pk, self.summary))
+
+    @property
+    def summary(self):
+        return {
+            'added': self.added,
+            'changed': self.changed,
+            'removed': self.removed,
+            'unchanged': self.unchanged,
+        }
+
+    def get_queryset(self):
+        return self.model.objects.using(self.using) \
+            .filter(document=self.document)
+
+    def load_rows(self, max_row):
+        """
+        Loads the existing cells of the rows after the loaded rows up to
+        max_row.
+        """
+        if max_row <= self._loaded_row:
+            return
+        names = [field.attname for field in self.fields]
+        row_index, column_index = names.index('row'), names.index('column')
+        queryset = self.get_queryset() \
+            .filter(row__gt=self._loaded_row, row__lte=max_row) \
+            .values_list('pk', *names)
+        for values in queryset.iterator():
+            pk, values = values[0], list(values[1:])
+            self._existing[(values[row_index], values[column_index])] = \
+                (pk, values)
+        self._loaded_row = max_row
+
+    def write_batch(self, instances):
+        self.load_rows(max(instance.row for instance in instances))
+        queryset = self.model.objects.using(self.using)
+        for instance in instances:
+            existing = self._existing.pop((instance.row, instance.column),
+                                          None)
+            if existing is None:
+                self._inserter.write(instance)
+                self.added += 1
+            elif existing[1] != self.get_db_values(instance):
+                queryset.filter(pk=existing[0]).update(**dict(
+                    (field.attname, getattr(instance, field.attname))
+                    for field in self.fields))
+                self.changed += 1
+            else:
+                self.unchanged += 1
+        # The rows before the last one of the batch are complete.
+        self.delete_removed(instances[-1].row)
+
+    def delete_removed(self, before_row=None):
+        """
+        Deletes the existing cells the import did not contain, of the rows
+        before before_row or, by default, of all rows.
+        """
+        positions = [position for position in self._existing
+                     if before_row is None or position[0] < before_row]
+        pks = [self._existing.pop(position)[0] for position in positions]
+        queryset = self.model.objects.using(self.using)
+        for start in range(0, len(pks), self.batch_size):
+            queryset.filter(pk__in=pks[start:start + self.batch_size]) \
+                .delete()
+        self.removed += len(pks)
+        if before_row is None:
+            # Rows after the last row of the import.
+            remaining = self.get_queryset().filter(
+                Q(row__gt=self._loaded_row) | Q(row__isnull=True))
+            self.removed += remaining.count()
+            remaining.delete()
+
+
+def copy_document_rows(model, source_id, document_id, using='default'):
+    """
+    Copies all rows of model that belong to the document source_id to
+    document_id with a single INSERT ... SELECT.
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    fields = [field for field in model._meta.concrete_fields
+              if not field.primary_key]
+    document_column = model._meta.get_field('document').column
+    sql = ('INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s = %%s '
+           'ORDER BY %s') % (
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join('%s' if field.column == document_column
+                  else quote_name(field.column) for field in fields),
+        quote_name(model._meta.db_table),
+        quote_name(document_column),
+        quote_name(model._meta.pk.column))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [document_id, source_id])
+        return cursor.rowcount
+
+
+CELL_WRITERS = {
+    'postgresql': CopyCellWriter,
+    'sqlite': ExecuteManyCellWriter,
+}
+
+
+def get_cell_writer(model, batch_size=None, using='default'):
+    """
+    Returns the writer class set in EXCEL_IMPORT_CELL_WRITER or the best
+    writer for the database vendor, instantiated for model.
+    """
+    writer_class = getattr(settings, 'EXCEL_IMPORT_CELL_WRITER', None)
+    if writer_class:
+        writer_class = import_string(writer_class)
+    else:
+        writer_class = CELL_WRITERS.get(connections[using].vendor,
+                                        BulkCreateCellWriter)
+    return writer_class(model, batch_size=batch_size, using=using)
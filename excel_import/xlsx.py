@@ -0,0 +1,406 @@
+"""
+xlsx writer for the cells stored in the database.
+
+iter_xlsx yields an xlsx file of a document in chunks. Rows are streamed
+from the database into a temporary file, which is deflated into the zip
+in chunks, so memory use does not depend on the number of cells, only the
+styles and merged ranges are kept until the sheet is complete. The
+original file is not needed.
+
+iter_patched_xlsx yields a copy of the original xlsx file instead, with
+only the changed cells replaced in the xml of the sheet. The other parts of
+the file are copied as they are, so the time it takes depends on the size
+of the file and the number of changed cells, not on the cells stored.
+"""
+import os
+import re
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.reader.workbook import detect_worksheets
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.xml.constants import (
+    ARC_CONTENT_TYPES,
+    ARC_ROOT_RELS,
+    ARC_STYLE,
+    ARC_WORKBOOK,
+    ARC_WORKBOOK_RELS,
+    PKG_REL_NS,
+    REL_NS,
+    SHEET_MAIN_NS,
+)
+
+ARC_SHEET = 'xl/worksheets/sheet1.xml'
+
+# Bytes read from and yielded of temporary files at once.
+CHUNK_SIZE = 64 * 1024
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+CONTENT_TYPES = XML_HEADER + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+    '"application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>')
+
+ROOT_RELS = XML_HEADER + (
+    '<Relationships xmlns="%s">'
+    '<Relationship Id="rId1" Type="%s/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>' % (PKG_REL_NS, REL_NS))
+
+WORKBOOK = XML_HEADER + (
+    '<workbook xmlns="%s" xmlns:r="%s">'
+    '<sheets><sheet name=%%s sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>' % (SHEET_MAIN_NS, REL_NS))
+
+WORKBOOK_RELS = XML_HEADER + (
+    '<Relationships xmlns="%s">'
+    '<Relationship Id="rId1" Type="%s/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="%s/styles" Target="styles.xml"/>'
+    '</Relationships>' % (PKG_REL_NS, REL_NS, REL_NS))
+
+
+class StyleTable(object):
+    """
+    Fills and cell formats of the exported cells, cell formats are
+    numbered in the order they are first used.
+    """
+
+    def __init__(self, colors):
+        # Color value per color name, see Document.get_name_for_color.
+        self.colors = colors
+        self._formats = {(None, None): 0}
+
+    def get_format(self, color_name, horizontal_alignment):
+        key = (self.colors.get(color_name), horizontal_alignment or None)
+        if key not in self._formats:
+            self._formats[key] = len(self._formats)
+        return self._formats[key]
+
+    def to_xml(self):
+        formats = sorted(self._formats, key=self._formats.get)
+        fills = sorted(set(color for color, alignment in formats if color))
+        fill_ids = dict((color, index)
+                        for index, color in enumerate(fills, start=2))
+
+        xml = [XML_HEADER, '<styleSheet xmlns="%s">' % SHEET_MAIN_NS,
+               '<fonts count="1"><font><sz val="11"/><name val="Calibri"/>'
+               '</font></fonts>',
+               '<fills count="%d">' % (len(fills) + 2),
+               '<fill><patternFill patternType="none"/></fill>',
+               '<fill><patternFill patternType="gray125"/></fill>']
+        xml.extend('<fill><patternFill patternType="solid">'
+                   '<fgColor rgb=%s/></patternFill></fill>' % quoteattr(color)
+                   for color in fills)
+        xml.append('</fills><borders count="1"><border><left/><right/>'
+                   '<top/><bottom/><diagonal/></border></borders>'
+                   '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" '
+                   'fillId="0" borderId="0"/></cellStyleXfs>')
+        xml.append('<cellXfs count="%d">' % len(formats))
+        for color, alignment in formats:
+            xml.append('<xf numFmtId="0" fontId="0" fillId="%d" '
+                       'borderId="0" xfId="0"' % fill_ids.get(color, 0))
+            if color:
+                xml.append(' applyFill="1"')
+            if alignment:
+                xml.append(' applyAlignment="1"><alignment horizontal=%s/>'
+                           '</xf>' % quoteattr(alignment))
+            else:
+                xml.append('/>')
+        xml.append('</cellXfs></styleSheet>')
+        return ''.join(xml)
+
+
+def write_member(archive, name, chunks):
+    """
+    Writes chunks of bytes to the member name of archive. They are
+    collected in a temporary file first, which ZipFile.write deflates in
+    chunks, since zip members cannot be written to incrementally before
+    Python 3.6.
+    """
+    handle, path = tempfile.mkstemp(suffix='.xml')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            for data in chunks:
+                file.write(data)
+        archive.write(path, name)
+    finally:
+        os.remove(path)
+
+
+def iter_file(file):
+    """
+    Yields the content of file from its start in chunks.
+    """
+    file.seek(0)
+    while True:
+        data = file.read(CHUNK_SIZE)
+        if not data:
+            return
+        yield data
+
+
+def clean(value):
+    return escape(ILLEGAL_CHARACTERS_RE.sub('', value))
+
+
+def value_to_xml(attributes, value, formula=''):
+    """
+    Returns a <c> element with attributes, values are written as strings
+    like Document.create_xlsx does, formulas with their calculated value.
+    """
+    if formula:
+        return '<c%s t="str"><f>%s</f><v>%s</v></c>' % (
+            attributes, clean(formula[1:]), clean(value))
+    if not value:
+        return '<c%s/>' % attributes
+    return '<c%s t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' \
+        % (attributes, clean(value))
+
+
+def cell_to_xml(cell, styles):
+    """
+    Returns the <c> element of cell.
+    """
+    attributes = ' r="%s"' % cell.coordinate
+    style = styles.get_format(cell.color_name, cell.horizontal_alignment)
+    if style:
+        attributes += ' s="%d"' % style
+    return value_to_xml(attributes, cell.value,
+                        getattr(cell, 'formula', ''))
+
+
+def iter_sheet_xml(cells, styles, merged_cell_ranges, report=None):
+    """
+    Yields the sheet xml of cells, in row order, in chunks. The ranges of
+    cells with spans are appended to merged_cell_ranges. report is called
+    with the number of every row.
+    """
+    yield XML_HEADER + '<worksheet xmlns="%s"><sheetData>' % SHEET_MAIN_NS
+    row = None
+    xml = []
+    size = 0
+    for cell in cells:
+        if cell.row != row:
+            if row is not None:
+                xml.append('</row>')
+            row = cell.row
+            xml.append('<row r="%d">' % row)
+            if report is not None:
+                report(row)
+            if size >= CHUNK_SIZE:
+                yield ''.join(xml)
+                xml = []
+                size = 0
+        element = cell_to_xml(cell, styles)
+        xml.append(element)
+        size += len(element)
+        if cell.column_span or cell.row_span:
+            merged_cell_ranges.append('%s:%s%d' % (
+                cell.coordinate,
+                get_column_letter(cell.column + (cell.column_span or 1) - 1),
+                cell.row + (cell.row_span or 1) - 1))
+    if row is not None:
+        xml.append('</row>')
+    xml.append('</sheetData>')
+    if merged_cell_ranges:
+        xml.append('<mergeCells count="%d">' % len(merged_cell_ranges))
+        xml.extend('<mergeCell ref="%s"/>' % cell_range
+                   for cell_range in merged_cell_ranges)
+        xml.append('</mergeCells>')
+    xml.append('</worksheet>')
+    yield ''.join(xml)
+
+
+def iter_xlsx(cells, colors, title='Sheet1', report=None):
+    """
+    Yields the bytes of an xlsx file with a single sheet titled title
+    holding cells, Cell or GridCell instances in row order. colors maps
+    the color names of the cells to their values. report is called with
+    the number of every row written. The file is built in a temporary file
+    and yielded once it is complete.
+    """
+    styles = StyleTable(colors)
+    merged_cell_ranges = []
+    with tempfile.TemporaryFile() as output:
+        with ZipFile(output, 'w', ZIP_DEFLATED) as archive:
+            archive.writestr(ARC_CONTENT_TYPES, CONTENT_TYPES)
+            archive.writestr(ARC_ROOT_RELS, ROOT_RELS)
+            archive.writestr(ARC_WORKBOOK, WORKBOOK % quoteattr(title[:31]))
+            archive.writestr(ARC_WORKBOOK_RELS, WORKBOOK_RELS)
+            write_member(archive, ARC_SHEET, (
+                xml.encode('utf-8') for xml in iter_sheet_xml(
+                    cells, styles, merged_cell_ranges, report)))
+            # Styles are known once all cells are written.
+            archive.writestr(ARC_STYLE, styles.to_xml())
+        for data in iter_file(output):
+            yield data
+
+
+# Elements of the sheet xml replaced by iter_patched_xlsx, rows are short
+# enough to be matched as a whole.
+SHEET_TOKEN_PATTERN = re.compile(
+    br'<row\b[^>]*/>|<row\b[^>]*>.*?</row>|<sheetData\s*/>|</sheetData>',
+    re.DOTALL)
+CELL_PATTERN = re.compile(br'<c\b[^>]*/>|<c\b[^>]*>.*?</c>', re.DOTALL)
+ROW_NUMBER_PATTERN = re.compile(br'\sr="(\d+)"')
+CELL_REFERENCE_PATTERN = re.compile(br'\sr="([A-Z]+)\d+"')
+STYLE_PATTERN = re.compile(br'\ss="(\d+)"')
+SPANS_PATTERN = re.compile(br'\sspans="[^"]*"')
+
+ARC_CALC_CHAIN = 'xl/calcChain.xml'
+CALC_CHAIN_PATTERN = re.compile(br'<(?:Override|Relationship)\b[^>]*'
+                                br'calcChain[^>]*/>')
+
+
+def patched_cell_to_xml(row, column, value, formula, style=None):
+    attributes = ' r="%s%d"' % (get_column_letter(column), row)
+    if style:
+        attributes += ' s="%s"' % style
+    return value_to_xml(attributes, value, formula).encode('utf-8')
+
+
+def patch_row(xml, row, changes):
+    """
+    Returns the <row> element xml with the cells of changes, a dict
+    mapping columns to (value, formula), replaced or inserted. Replaced
+    cells keep their style.
+    """
+    start = xml[:xml.index(b'>') + 1]
+    if start.endswith(b'/>'):
+        start, body = start[:-2] + b'>', b''
+    else:
+        body = xml[len(start):-len(b'</row>')]
+    # The span of the cells is only a hint and may change.
+    start = SPANS_PATTERN.sub(b'', start)
+
+    patched = [start]
+    position = 0
+    column = 0
+    for match in CELL_PATTERN.finditer(body):
+        reference = CELL_REFERENCE_PATTERN.search(
+            match.group(0)[:match.group(0).index(b'>')])
+        column = column_index_from_string(reference.group(1).decode()) \
+            if reference else column + 1
+        patched.append(body[position:match.start()])
+        position = match.end()
+        for inserted in sorted(key for key in changes if key < column):
+            patched.append(patched_cell_to_xml(
+                row, inserted, *changes.pop(inserted)))
+        if column in changes:
+            style = STYLE_PATTERN.search(
+                match.group(0)[:match.group(0).index(b'>')])
+            patched.append(patched_cell_to_xml(
+                row, column, *changes.pop(column),
+                style=style.group(1).decode() if style else None))
+        else:
+            patched.append(match.group(0))
+    patched.append(body[position:])
+    for inserted in sorted(changes):
+        patched.append(patched_cell_to_xml(row, inserted,
+                                           *changes[inserted]))
+    patched.append(b'</row>')
+    return b''.join(patched)
+
+
+def new_rows(changes, rows):
+    return b''.join(patch_row(('<row r="%d"/>' % row).encode(), row,
+                              changes.pop(row))
+                    for row in rows)
+
+
+def iter_patched_sheet_xml(source, changes, report=None):
+    """
+    Yields the sheet xml read from the file object source in chunks, with
+    the cells of changes, a dict mapping rows to dicts of columns, see
+    patch_row, replaced. Only rows with changes are parsed. report is
+    called with the number of every row of the file.
+    """
+    buffer = b''
+    row = 0
+    while True:
+        data = source.read(CHUNK_SIZE)
+        buffer += data
+        position = 0
+        for match in SHEET_TOKEN_PATTERN.finditer(buffer):
+            token = match.group(0)
+            yield buffer[position:match.start()]
+            position = match.end()
+            if token.startswith(b'<row'):
+                number = ROW_NUMBER_PATTERN.search(
+                    token[:token.index(b'>')])
+                row = int(number.group(1)) if number else row + 1
+                if report is not None:
+                    report(row)
+                yield new_rows(changes, sorted(key for key in changes
+                                               if key < row))
+                if row in changes:
+                    token = patch_row(token, row, changes.pop(row))
+                yield token
+                continue
+            # Rows without cells in the file are added at the end.
+            rows = new_rows(changes, sorted(changes))
+            if token.startswith(b'<sheetData'):
+                yield b'<sheetData>' + rows + b'</sheetData>'
+            else:
+                yield rows + token
+            # The rest of the sheet is copied as it is.
+            yield buffer[position:]
+            while data:
+                data = source.read(CHUNK_SIZE)
+                yield data
+            return
+        # Keeps the part of a row that is not complete yet.
+        buffer = buffer[position:]
+        if not data:
+            yield buffer
+            return
+
+
+def iter_patched_xlsx(file, index, cells, report=None):
+    """
+    Yields the bytes of a copy of the xlsx file with the cells of
+    worksheet index replaced by cells, (row, column, value, formula)
+    tuples. The calculation chain is dropped, Excel rebuilds it, since it
+    must not list replaced formulas. report is called with the number of
+    every row of the worksheet copied. Like iter_xlsx, the copy is yielded
+    once it is complete.
+    """
+    changes = dict()
+    for row, column, value, formula in cells:
+        changes.setdefault(row, dict())[column] = (value, formula)
+
+    with tempfile.TemporaryFile() as output:
+        with ZipFile(file) as source, \
+                ZipFile(output, 'w', ZIP_DEFLATED) as archive:
+            sheet = list(detect_worksheets(source))[index]['path']
+            for info in source.infolist():
+                if info.filename == ARC_CALC_CHAIN:
+                    continue
+                with source.open(info) as member:
+                    if info.filename in (ARC_CONTENT_TYPES,
+                                         ARC_WORKBOOK_RELS):
+                        archive.writestr(info.filename, CALC_CHAIN_PATTERN
+                                         .sub(b'', member.read()))
+                    elif info.filename == sheet:
+                        write_member(archive, info.filename,
+                                     iter_patched_sheet_xml(member, changes,
+                                                            report))
+                    else:
+                        write_member(archive, info.filename, iter(
+                            lambda: member.read(CHUNK_SIZE), b''))
+        for data in iter_file(output):
+            yield data
@@ -327,6 +327,19 @@ LOCALE_PATHS = [
 # Time in seconds after which the editor nofification mail is send.
 EDITOR_MAIL_DELAY = 15 * 60
 
+# Import worksheets with openpyxl's read-only mode and insert the cells
+# in chunks of EXCEL_IMPORT_CHUNK_SIZE.
+EXCEL_IMPORT_STREAMING = True
+EXCEL_IMPORT_CHUNK_SIZE = 1000
+# Dotted path of the class used to insert imported cells, defaults to COPY
+# on PostgreSQL and executemany on SQLite (see excel_import.writers).
+# EXCEL_IMPORT_CELL_WRITER = 'excel_import.writers.BulkCreateCellWriter'
+
+# Parse uploaded documents in a celery task instead of the request.
+EXCEL_IMPORT_ASYNC = True
+# Number of rows after which the import progress is written to the database.
+EXCEL_IMPORT_PROGRESS_INTERVAL = 100
+
 RAVEN_CONFIG = {
     'dsn': os.environ.get("RAVEN_DSN"),
 }
@@ -334,3 +347,57 @@ RAVEN_CONFIG = {
 LANGUAGES = (
     ('de', 'German'),
 )
+
+# Store the cells of new documents as one compressed columnar grid instead
+# of one database row per cell (see excel_import.grid).
+EXCEL_IMPORT_GRID_STORAGE = False
+
+# Copy the cells of a previous document with identical content, worksheet
+# and storage engine instead of parsing the uploaded file again.
+EXCEL_IMPORT_DEDUPLICATE = True
+
+# Import new revisions of a document by applying the differences to the
+# cells of the previous revision instead of writing every cell again.
+EXCEL_IMPORT_INCREMENTAL = True
+
+# Limits checked when the details of an upload are saved, before the import
+# starts. Worksheet sizes are read from the sheet xml (see
+# excel_import.validators), None disables a limit.
+EXCEL_IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+EXCEL_IMPORT_MAX_CELLS = 1000000
+EXCEL_IMPORT_MAX_MERGED_CELLS = 10000
+
+# Number of processes preparing the cells of sheets with at least
+# EXCEL_IMPORT_PARALLEL_MIN_ROWS rows in streaming mode, in bands of
+# EXCEL_IMPORT_CHUNK_SIZE rows (see excel_import.parallel). 1 imports every
+# sheet in the calling process.
+EXCEL_IMPORT_WORKERS = 1
+EXCEL_IMPORT_PARALLEL_MIN_ROWS = 10000
+
+# Importers by file extension in addition to the xlsx, csv and ods
+# importers of excel_import.importers, e.g. {'.tsv': 'app.importers.Tsv'}.
+# csv files are decoded with EXCEL_IMPORT_CSV_ENCODING.
+EXCEL_IMPORT_IMPORTERS = {}
+EXCEL_IMPORT_CSV_ENCODING = 'utf-8-sig'
+
+# Directory of the cached xlsx exports of documents, one file per document
+# and change version (see excel_import.exports).
+EXCEL_EXPORT_CACHE_DIR = os.path.join(DATA_DIR, 'exports')
+
+# Write exports from the cells in the database in constant memory (see
+# excel_import.xlsx) instead of into the original workbook. Only fills and
+# alignment are kept, fonts, borders, number formats and column widths of
+# the original are lost, so it is off by default.
+EXCEL_EXPORT_STREAMING = False
+
+# Export a copy of the original xlsx file with only the changed cells
+# replaced in its sheet xml, which keeps the formatting of the file and
+# scales with the number of changes. Files of other types are exported as
+# configured above.
+EXCEL_EXPORT_PATCH_ORIGINAL = True
+
+# Documents with more rows are exported by a Celery task (see
+# excel_import.models.ExportJob) instead of while they are downloaded, the
+# download shows its progress until the export is cached. None exports all
+# documents while they are downloaded.
+EXCEL_EXPORT_ASYNC_ROWS = 50000
@@ -51,6 +51,10 @@ class FrontendConfig(AppConfig):
     def ready(self):
         from django.db.models.signals import post_migrate, post_save
         from excel_import.models import Document
-        from frontend.signals import document_save_handler
+        from excel_import.signals import document_copied, document_imported
+        from frontend.signals import document_save_handler, \
+            document_imported_handler, document_copied_handler
         post_migrate.connect(set_frontend_group_permissions)
         post_save.connect(document_save_handler, sender=Document)
+        document_imported.connect(document_imported_handler, sender=Document)
+        document_copied.connect(document_copied_handler, sender=Document)
@@ -1,10 +1,16 @@
 from django import forms
+from django.core.exceptions import ValidationError
 from django.forms import ModelForm
+from django.utils.translation import ugettext_lazy as _
 
 from parsley.decorators import parsleyfy
 
 from excel_import.models import Document
 from excel_import.utils import list_worksheets_from_file
+from excel_import.validators import (
+    validate_file_size,
+    validate_worksheet_size,
+)
 from frontend.models import TemporaryDocument
 
 
@@ -37,13 +43,66 @@ class DocumentDetailForm(forms.ModelForm):
         self.file = kwargs.pop("file")
         super(DocumentDetailForm, self).__init__(*args, **kwargs)
 
-        worksheet_choices = list_worksheets_from_file(self.file)
+        temporary_document = getattr(self.file, 'instance', None)
+        if isinstance(temporary_document, TemporaryDocument):
+            worksheet_choices = temporary_document.get_worksheets()
+        else:
+            worksheet_choices = list_worksheets_from_file(self.file)
+        self.worksheet_choices = worksheet_choices
         self.fields["worksheet"].widget = forms.RadioSelect(
             choices=worksheet_choices)
+        if self.instance.sheet_of_id:
+            del self.fields["extra_worksheets"]
+        else:
+            self.fields["extra_worksheets"].choices = worksheet_choices
+            self.initial["extra_worksheets"] = [
+                index for index in
+                self.instance.extra_worksheets.split(',') if index]
+
+    extra_worksheets = forms.TypedMultipleChoiceField(
+        label=_("Further worksheets"),
+        help_text=_("Worksheets imported as further tabs of the document."),
+        coerce=int,
+        required=False,
+        widget=forms.CheckboxSelectMultiple)
+
+    def clean_extra_worksheets(self):
+        return ','.join(str(index) for index
+                        in self.cleaned_data["extra_worksheets"])
+
+    def clean(self):
+        """
+        Checks the size of the file and of the chosen worksheets against
+        the import limits, before saving the document starts the import.
+        """
+        cleaned_data = super(DocumentDetailForm, self).clean()
+        try:
+            validate_file_size(self.file)
+        except ValidationError as error:
+            self.add_error(None, error)
+            return cleaned_data
+
+        titles = dict(self.worksheet_choices)
+        worksheets = [("worksheet", cleaned_data.get("worksheet"))]
+        worksheets.extend(
+            ("extra_worksheets", int(index)) for index
+            in (cleaned_data.get("extra_worksheets") or '').split(',')
+            if index)
+        for field, index in worksheets:
+            if index not in titles:
+                continue
+            try:
+                validate_worksheet_size(self.file, index, titles[index])
+            except ValidationError as error:
+                self.add_error(field, error)
+        return cleaned_data
 
     def save(self, commit=True):
         document = super(DocumentDetailForm, self).save(commit=False)
         document.file = self.file
+        # Hashed on upload, Document.save hashes files of other origin.
+        document.content_hash = getattr(self.file.instance,
+                                        'content_hash', '')
 
         if commit:
             document.save()
@@ -51,4 +110,4 @@ class DocumentDetailForm(forms.ModelForm):
 
     class Meta:
         model = Document
-        fields = ['name', 'status', 'worksheet']
+        fields = ['name', 'status', 'worksheet', 'extra_worksheets']
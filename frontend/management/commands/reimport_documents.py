@@ -0,0 +1,140 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from excel_import.models import Document
+from excel_import.parallel import get_import_workers
+from frontend.models import ChangeRequest
+
+
+def reimport_document(document_id, swap):
+    """
+    Parses the file of a document again and, if swap is True, replaces its
+    cells. Runs in a worker process, returns a result dict for the
+    checkpoint instead of raising.
+    """
+    start = time.time()
+    try:
+        document = Document.objects.get(pk=document_id)
+        scratch = document.parse_scratch_copy()
+        cells = scratch.get_import_statistics().get('cells', 0)
+        orphaned = 0
+        if swap:
+            requests = ChangeRequest.objects.filter(
+                target_cell__document=document)
+            # Accepted values are kept, so are the targets of all requests.
+            orphaned = document.replace_cells(
+                scratch,
+                keep=requests.values_list('target_cell', flat=True),
+                keep_values=requests.filter(status=ChangeRequest.ACCEPTED)
+                .values_list('target_cell', flat=True))
+        else:
+            scratch.delete()
+    except Exception as error:
+        return {'id': document_id, 'error': repr(error),
+                'seconds': round(time.time() - start, 4)}
+    return {'id': document_id, 'cells': cells, 'orphaned': orphaned,
+            'seconds': round(time.time() - start, 4)}
+
+
+class Command(BaseCommand):
+    help = ("Parses the files of current documents again, e.g. after the "
+            "import code changed, and with --swap replaces their cells. "
+            "Change requests keep their target cells. Finished documents "
+            "are recorded in a checkpoint file, so an interrupted run "
+            "resumes where it stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int,
+                            help="Only re-import these documents.")
+        parser.add_argument('--all', action='store_true',
+                            help="Include documents that are not current.")
+        parser.add_argument('--swap', action='store_true',
+                            help="Replace the cells of the documents, "
+                                 "otherwise the files are only parsed.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of processes, defaults to "
+                                 "EXCEL_IMPORT_WORKERS.")
+        parser.add_argument('--checkpoint',
+                            default='reimport_checkpoint.json',
+                            help="File recording finished documents.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore the documents of the checkpoint.")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(import_status=Document.READY) \
+            .exclude(file='').exclude(file__isnull=True).order_by('pk')
+        if not options['all']:
+            documents = documents.filter(current=True)
+        if options['document_ids']:
+            documents = documents.filter(pk__in=options['document_ids'])
+
+        path = options['checkpoint']
+        checkpoint = {'done': [], 'failed': {}}
+        if os.path.exists(path) and not options['restart']:
+            with open(path) as file:
+                checkpoint = json.load(file)
+        done = set(checkpoint['done'])
+        pending = [pk for pk in documents.values_list('pk', flat=True)
+                   if pk not in done]
+        if done:
+            self.stdout.write("Skipping %d documents of checkpoint %s"
+                              % (len(done), path))
+
+        start = time.time()
+        failed = 0
+        for result in self.run(pending, options['swap'],
+                               options['workers'] or get_import_workers()):
+            key = str(result['id'])
+            if 'error' in result:
+                failed += 1
+                checkpoint['failed'][key] = result['error']
+                self.stderr.write("Document %d failed after %.3fs: %s"
+                                  % (result['id'], result['seconds'],
+                                     result['error']))
+            else:
+                checkpoint['done'].append(result['id'])
+                checkpoint['failed'].pop(key, None)
+                self.stdout.write(
+                    "Document %d: %d cells in %.3fs%s"
+                    % (result['id'], result['cells'], result['seconds'],
+                       ', swapped' if options['swap'] else ''))
+                if result['orphaned']:
+                    self.stdout.write(
+                        "  %d change request targets have no cell in the "
+                        "new import and were left unchanged"
+                        % result['orphaned'])
+            self.save_checkpoint(path, checkpoint)
+
+        self.stdout.write("Re-imported %d documents in %.3fs, %d failed"
+                          % (len(pending) - failed, time.time() - start,
+                             failed))
+
+    def run(self, document_ids, swap, workers):
+        """
+        Yields the result of every document, in the order they finish.
+        """
+        if workers <= 1:
+            for document_id in document_ids:
+                yield reimport_document(document_id, swap)
+            return
+
+        # Worker processes must not share the connection of this one.
+        connections.close_all()
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(reimport_document, document_id, swap)
+                       for document_id in document_ids]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def save_checkpoint(self, path, checkpoint):
+        # Written to a temporary file first, so an interrupted write does
+        # not lose the checkpoint.
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary, path)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import excel_import.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0006_auto_20160806_2220'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='temporarydocument',
+            name='content_hash',
+            field=models.CharField(max_length=64, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='temporarydocument',
+            name='file',
+            field=models.FileField(upload_to=excel_import.storage.content_addressed_path),
+        ),
+    ]
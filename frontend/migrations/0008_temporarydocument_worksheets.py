@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0007_temporarydocument_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='temporarydocument',
+            name='worksheets',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+ACCEPTED = 2
+
+
+def flag_accepted_cells(apps, schema):
+    """
+    Flags the target cells of accepted change requests and the formula
+    cells reading them as changed, patched exports write only those.
+    """
+    ChangeRequest = apps.get_model("frontend", "ChangeRequest")
+    Cell = apps.get_model("excel_import", "Cell")
+    FormulaReference = apps.get_model("excel_import", "FormulaReference")
+
+    targets = ChangeRequest.objects.filter(status=ACCEPTED) \
+        .values_list('target_cell', flat=True)
+    Cell.objects.filter(pk__in=list(targets)).update(changed=True)
+
+    documents = Cell.objects.filter(changed=True) \
+        .values_list('document', flat=True).distinct()
+    for document_id in list(documents):
+        changed = set(Cell.objects.filter(document_id=document_id,
+                                          changed=True)
+                      .values_list('row', 'column'))
+        references = {}
+        for reference in FormulaReference.objects.filter(
+                document_id=document_id).values_list(
+                    'formula_cell', 'formula_cell__row',
+                    'formula_cell__column', 'min_row', 'min_column',
+                    'max_row', 'max_column'):
+            references.setdefault(reference[:3], []).append(reference[3:])
+
+        flagged = []
+        found = True
+        while found:
+            found = False
+            for (pk, row, column), ranges in list(references.items()):
+                if any(min_row <= changed_row <= max_row and
+                       min_column <= changed_column <= max_column
+                       for min_row, min_column, max_row, max_column
+                       in ranges
+                       for changed_row, changed_column in changed):
+                    del references[(pk, row, column)]
+                    changed.add((row, column))
+                    flagged.append(pk)
+                    found = True
+        Cell.objects.filter(pk__in=flagged).update(changed=True)
+
+
+def noop(apps, schema):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0008_temporarydocument_worksheets'),
+        ('excel_import', '0022_cell_changed'),
+    ]
+
+    operations = [
+        migrations.RunPython(flag_accepted_cells, noop),
+    ]
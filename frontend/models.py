@@ -1,3 +1,4 @@
+import json
 import logging
 
 from django.contrib.sites.models import Site
@@ -9,9 +10,12 @@ from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
-from django.db import transaction
+from django.db import connection, transaction
 
+from excel_import.formulas import split_formula
 from excel_import.models import Cell
+from excel_import.storage import content_addressed_path, hash_file
+from excel_import.utils import list_worksheets_from_file
 from frontend.tasks import send_new_status_notification_mail, send_editor_mail
 from frontend.utils import get_user_email
 
@@ -68,7 +72,8 @@ class ChangeRequest(models.Model):
         send_mail = False
         if not self.pk:
             if not self.old_value:
-                self.old_value = self.target_cell.value
+                self.old_value = self.target_cell.formula or \
+                    self.target_cell.value
             send_mail = True
         with transaction.atomic():
             super(ChangeRequest, self).save(*args, **kwargs)
@@ -99,9 +104,21 @@ class ChangeRequest(models.Model):
         if commit:
             self.save()
 
+    def _set_target_value(self, value, changed=True):
+        """
+        Sets the value, or formula if value starts with =, of the target
+        cell and recalculates the formulas depending on it. changed tells
+        whether the value differs from the file, see Cell.changed.
+        """
+        cell = self.target_cell
+        cell.value, cell.formula = split_formula(value)
+        cell.changed = changed
+        cell.save()
+        cell.document.recalculate([cell])
+        cell.document.mark_changed()
+
     def accept(self, reviewer, commit=True):
-        self.target_cell.value = self.new_value
-        self.target_cell.save()
+        self._set_target_value(self.new_value)
         self._review(reviewer, ChangeRequest.ACCEPTED, commit)
 
     def decline(self, reviewer, commit=True):
@@ -109,10 +126,51 @@ class ChangeRequest(models.Model):
 
     def revoke(self, commit=True):
         if self.status == ChangeRequest.ACCEPTED:
-            self.target_cell.value = self.old_value or ""
-            self.target_cell.save()
+            # The value of the file is restored, unless another accepted
+            # request changed the cell before.
+            changed = ChangeRequest.objects.filter(
+                target_cell=self.target_cell,
+                status=ChangeRequest.ACCEPTED).exclude(pk=self.pk).exists()
+            self._set_target_value(self.old_value or "", changed)
         self._review(self.author, ChangeRequest.REVOKED, commit)
 
+    @classmethod
+    def move_pending_requests(cls, source_id, document_id):
+        """
+        Moves the pending requests on cells of document source_id to the
+        cells at the same row and column of document document_id with a
+        single UPDATE. Requests without a matching cell stay where they
+        are. Returns the number of moved requests.
+        """
+        quote_name = connection.ops.quote_name
+        cell_table = quote_name(Cell._meta.db_table)
+        row = quote_name(Cell._meta.get_field('row').column)
+        column = quote_name(Cell._meta.get_field('column').column)
+        target_cell = quote_name(cls._meta.get_field('target_cell').column)
+        document = quote_name(Cell._meta.get_field('document').column)
+        matching_cell = (
+            'SELECT next_cell.id FROM {cells} next_cell, {cells} prev_cell '
+            'WHERE prev_cell.id = {target_cell} '
+            'AND next_cell.{document} = %s '
+            'AND next_cell.{row} = prev_cell.{row} '
+            'AND next_cell.{column} = prev_cell.{column}')
+        sql = ('UPDATE {table} SET {target_cell} = (' + matching_cell + ') '
+               'WHERE {status} = %s AND EXISTS (' + matching_cell + ') '
+               'AND {target_cell} IN '
+               '(SELECT id FROM {cells} WHERE {document} = %s)').format(
+            table=quote_name(cls._meta.db_table),
+            cells=cell_table,
+            target_cell=target_cell,
+            status=quote_name(cls._meta.get_field('status').column),
+            document=document,
+            row=row,
+            column=column)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [document_id, ChangeRequest.PENDING,
+                                 document_id, source_id])
+            return cursor.rowcount
+
     def document_url(self):
         domain = Site.objects.get_current().domain
         return ''.join([settings.ACCOUNT_DEFAULT_HTTP_PROTOCOL,
@@ -183,4 +241,32 @@ class ChangeRequest(models.Model):
 
 
 class TemporaryDocument(models.Model):
-    file = models.FileField()
\ No newline at end of file
+    """
+    Uploaded file waiting for its document details. Files are stored
+    under the sha256 digest of their content, identical uploads share a
+    file.
+    """
+    file = models.FileField(upload_to=content_addressed_path)
+    content_hash = models.CharField(max_length=64, blank=True)
+    worksheets = models.TextField(blank=True)
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.content_hash:
+            self.content_hash = hash_file(self.file)
+            name = content_addressed_path(self, self.file.name)
+            if self.file.storage.exists(name):
+                # Reference the stored file instead of saving a copy.
+                self.file.name = name
+                self.file._committed = True
+        super(TemporaryDocument, self).save(*args, **kwargs)
+
+    def get_worksheets(self):
+        """
+        Returns (index, title) of every worksheet of the file. They are
+        read from the file once and cached in worksheets.
+        """
+        if not self.worksheets:
+            self.worksheets = json.dumps(list_worksheets_from_file(self.file))
+            TemporaryDocument.objects.filter(pk=self.pk).update(
+                worksheets=self.worksheets)
+        return [tuple(worksheet) for worksheet in json.loads(self.worksheets)]
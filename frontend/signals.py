@@ -1,5 +1,9 @@
 import logging
 
+from django.conf import settings
+
+from frontend.tasks import import_document
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,4 +18,56 @@ def document_save_handler(sender, **kwargs):
                 extra={
                     'document': instance,
                     'doc_created': created,
-                })
\ No newline at end of file
+                    'import_statistics': instance.get_import_statistics(),
+                })
+
+    # Further sheets of an upload are imported with its first sheet.
+    # Django 1.8 has no transaction.on_commit, the task is retried until
+    # the document is committed, e.g. by the atomic views of the admin.
+    if created and not instance.imported_by_parent and \
+            getattr(settings, 'EXCEL_IMPORT_ASYNC', False):
+        import_document.delay(instance.pk)
+
+
+def document_imported_handler(sender, **kwargs):
+    """
+    Moves pending change requests of the previous revision to the cells
+    with the same coordinate in the new revision.
+    """
+    from excel_import.models import Cell, Document
+    from frontend.models import ChangeRequest
+
+    document = kwargs.get('document')
+    previous = document.get_previous_revision()
+    if previous is None:
+        return
+
+    if document.storage == Document.GRID:
+        # Target cells of a grid have to be materialized first.
+        coordinates = set(ChangeRequest.objects.filter(
+            target_cell__document=previous,
+            status=ChangeRequest.PENDING)
+            .values_list('target_cell__coordinate', flat=True))
+        for coordinate in coordinates:
+            try:
+                document.get_cell(coordinate)
+            except Cell.DoesNotExist:
+                pass
+
+    moved = ChangeRequest.move_pending_requests(previous.pk, document.pk)
+    logger.debug("Moved %d pending change requests to document %s(%d)"
+                 % (moved, document.name, document.pk))
+
+
+def document_copied_handler(sender, **kwargs):
+    """
+    Cells copied from a previous document carry the values of its
+    accepted change requests and the formulas recalculated from them,
+    resets all changed cells to the values of the file.
+    """
+    document = kwargs.get('document')
+
+    coordinates = set(document.cell_set.filter(changed=True)
+                      .values_list('coordinate', flat=True))
+    if coordinates:
+        document.reset_cells(coordinates)
@@ -13,3 +13,22 @@ def send_new_status_notification_mail(request_id):
     from frontend.models import ChangeRequest
     change_request = ChangeRequest.objects.get(pk=request_id)
     change_request.send_new_status_notification_mail()
+
+
+@shared_task(bind=True, max_retries=10, default_retry_delay=1)
+def import_document(self, document_id):
+    from excel_import.models import Document
+    try:
+        document = Document.objects.get(pk=document_id)
+    except Document.DoesNotExist as error:
+        # Queued on post_save, the transaction saving the document might
+        # not have committed yet.
+        raise self.retry(exc=error)
+    document.import_file()
+
+
+@shared_task
+def export_document(job_id):
+    from excel_import.models import ExportJob
+    job = ExportJob.objects.select_related('document').get(pk=job_id)
+    job.run()
@@ -1,10 +1,16 @@
+import json
 import os
+import shutil
 import tempfile
 from unittest.mock import patch
-from io import BytesIO
+from io import BytesIO, StringIO
 
 import time
+from importlib import import_module
+
+from django.apps import apps
 from django.contrib.auth.models import User, Group, Permission
+from django.core.management import call_command
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.core.urlresolvers import reverse
 from django.core import mail
@@ -14,8 +20,11 @@ from django.test import TestCase, override_settings
 from rest_framework import status
 
 from model_mommy import mommy
+from openpyxl import Workbook, load_workbook
 
-from excel_import.models import Document, Cell
+from excel_import.exports import get_export_path, iter_export, \
+    stream_export
+from excel_import.models import Document, Cell, ExportJob
 from frontend.models import ChangeRequest, TemporaryDocument
 from frontend.views import FILE_SESSION_NAME_KEY, FILE_SESSION_PK_KEY
 
@@ -97,6 +106,48 @@ class FrontendTest(TestCase):
 
         self.assertEqual(parse_file.call_count, 1)
 
+    @override_settings(EXCEL_IMPORT_MAX_CELLS=50,
+                       EXCEL_IMPORT_MAX_MERGED_CELLS=2)
+    def test_create_details_rejects_large_worksheet(self):
+        temp_file = mommy.make(TemporaryDocument,
+                               file=self.file)
+        self.user.groups.add(Group.objects.get(name='editor'))
+        session = self.client.session
+        session[FILE_SESSION_NAME_KEY] = "test.xlsx"
+        session[FILE_SESSION_PK_KEY] = temp_file.pk
+        session.save()
+
+        with patch('excel_import.models.load_workbook') as load_workbook:
+            response = self.client.post(reverse('document:create_details'), {
+                'worksheet': 0,
+                'name': 'Test',
+                'status': Document.LOCKED})
+
+        self.assertFalse(load_workbook.called)
+        self.assertFalse(Document.objects.exists())
+        errors = response.context['form'].errors['worksheet']
+        self.assertEqual(2, len(errors))
+        self.assertIn('85 cells', errors[0])
+        self.assertIn('3 merged cell ranges', errors[1])
+
+    @override_settings(EXCEL_IMPORT_MAX_FILE_SIZE=1024)
+    def test_create_details_rejects_large_file(self):
+        temp_file = mommy.make(TemporaryDocument,
+                               file=self.file)
+        self.user.groups.add(Group.objects.get(name='editor'))
+        session = self.client.session
+        session[FILE_SESSION_NAME_KEY] = "test.xlsx"
+        session[FILE_SESSION_PK_KEY] = temp_file.pk
+        session.save()
+
+        response = self.client.post(reverse('document:create_details'), {
+            'worksheet': 0,
+            'name': 'Test',
+            'status': Document.LOCKED})
+
+        self.assertFalse(Document.objects.exists())
+        self.assertIn('1.0\xa0KB', response.context['form'].non_field_errors()[0])
+
     @patch('excel_import.models.Document.parse_file')
     def test_edit_details_sets_correct_replaces_id_on_second_revision(self, parse_file):
         document = Document.objects.create(file=self.file, name="Test", current=False)
@@ -205,6 +256,85 @@ class FrontendTest(TestCase):
 
         self.assertEqual(change_request.target_cell, new_cell)
 
+    def test_edit_details_with_identical_file_resets_accepted_changes(self):
+        document = Document.objects.create(file=self.file,
+                                           name="Test",
+                                           status=Document.REQUEST_ONLY)
+        cell = document.cell_set.get(coordinate='A2')
+        original_value = cell.value
+        temp_file = mommy.make(TemporaryDocument,
+                               file=self.file)
+        self.user.groups.add(Group.objects.get(name='editor'))
+        ChangeRequest.objects.create(author=self.user,
+                                     new_value="test",
+                                     target_cell=cell).accept(self.user)
+
+        session = self.client.session
+        session[FILE_SESSION_NAME_KEY] = "test.xlsx"
+        session[FILE_SESSION_PK_KEY] = temp_file.pk
+        session.save()
+
+        with patch('excel_import.models.Document.parse_file') as parse_file:
+            self.client.post(reverse('document:edit_details',
+                                     args=[document.pk]),
+                             {
+                                 'name': 'Test',
+                                 'worksheet': 0,
+                                 'status': Document.REQUEST_ONLY,
+                             })
+
+        new_document = Document.objects.get(~Q(pk=document.pk))
+        self.assertFalse(parse_file.called)
+        self.assertEqual(document.content_hash, new_document.content_hash)
+        self.assertEqual(67, new_document.cell_set.count())
+        self.assertEqual(original_value,
+                         new_document.cell_set.at('A2').value)
+        self.assertEqual("test", document.cell_set.at('A2').value)
+
+    def test_identical_file_resets_recalculated_formulas(self):
+        workbook = Workbook()
+        for row, value in enumerate([1, 2, '=SUM(A1:A2)'], start=1):
+            workbook.active.cell(row=row, column=1).value = value
+        file = os.path.join(settings.MEDIA_ROOT, 'formulas.xlsx')
+        workbook.save(file)
+        document = Document.objects.create(file=file, name="Test")
+        ChangeRequest.objects.create(
+            author=self.user, new_value='5',
+            target_cell=document.cell_set.at('A1')).accept(self.user)
+        self.assertEqual('7', document.cell_set.at('A3').value)
+
+        copy = Document.objects.create(file=file, name="Copy")
+
+        self.assertEqual('1', copy.cell_set.at('A1').value)
+        self.assertEqual('3', copy.cell_set.at('A3').value)
+        self.assertFalse(copy.cell_set.filter(changed=True).exists())
+        self.assertEqual('7', document.cell_set.at('A3').value)
+
+    @override_settings(EXCEL_EXPORT_PATCH_ORIGINAL=True)
+    def test_migration_flags_accepted_cells(self):
+        workbook = Workbook()
+        for row, value in enumerate([1, 2, '=SUM(A1:A2)'], start=1):
+            workbook.active.cell(row=row, column=1).value = value
+        file = os.path.join(settings.MEDIA_ROOT, 'accepted.xlsx')
+        workbook.save(file)
+        document = Document.objects.create(file=file, name="Test")
+        ChangeRequest.objects.create(
+            author=self.user, new_value='5',
+            target_cell=document.cell_set.at('A1')).accept(self.user)
+        # Flags did not exist when the request was accepted.
+        document.cell_set.update(changed=False)
+
+        migration = import_module(
+            'frontend.migrations.0009_flag_accepted_cells')
+        migration.flag_accepted_cells(apps, None)
+
+        self.assertListEqual(['A1', 'A3'], list(document.cell_set.filter(
+            changed=True).values_list('coordinate', flat=True)))
+        export = load_workbook(BytesIO(b''.join(iter_export(document))),
+                               data_only=True)
+        self.assertEqual('5', export.active['A1'].value)
+        self.assertEqual('7', export.active['A3'].value)
+
     @patch('excel_import.models.Document.parse_file')
     def test_request_on_open_document(self, parse_file):
         cell = mommy.make(Cell, document__status=Document.OPEN, value="test")
@@ -518,6 +648,22 @@ class FrontendTest(TestCase):
 
         self.assertEqual(TemporaryDocument.objects.count(), 1)
 
+    def test_identical_uploads_share_one_file(self):
+        self.user.groups.add(Group.objects.get(name='editor'))
+
+        for i in range(2):
+            self.client.post(reverse('document:create'),
+                             {
+                                 'file': self.file,
+                             })
+
+        first, second = TemporaryDocument.objects.all()
+        self.assertEqual(64, len(first.content_hash))
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertIn(first.content_hash, first.file.name)
+        self.assertEqual(1, len(os.listdir(os.path.dirname(first.file.path))))
+
     def test_create_document_creates_temp_document(self):
         self.user.groups.add(Group.objects.get(name='editor'))
         response = self.client.post(reverse('document:create'),
@@ -539,6 +685,23 @@ class FrontendTest(TestCase):
 
         self.assertTemplateUsed(response, 'frontend/snippets/details_form.html')
 
+    def test_create_details_reads_worksheets_once(self):
+        self.user.groups.add(Group.objects.get(name='editor'))
+        with patch('frontend.models.list_worksheets_from_file',
+                   return_value=[(0, 'Sheet1')]) as list_worksheets:
+            self.client.post(reverse('document:create'),
+                             {
+                                 'file': self.file,
+                             },
+                             HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            response = self.client.get(reverse('document:create_details'))
+
+        self.assertContains(response, 'Sheet1')
+        self.assertEqual(1, list_worksheets.call_count)
+        temp_file = TemporaryDocument.objects.get(
+            pk=self.client.session[FILE_SESSION_PK_KEY])
+        self.assertListEqual([(0, 'Sheet1')], temp_file.get_worksheets())
+
     def test_edit_document_ajax_returns_form(self):
         document = Document.objects.create(file=self.file,
                                            name="Test",
@@ -596,6 +759,80 @@ class FrontendTest(TestCase):
 
         self.assertTemplateUsed(response, "frontend/document_detail.html")
 
+    def test_show_document_with_sheets(self):
+        workbook = Workbook()
+        workbook.create_sheet(title='Second')
+        for work_sheet in workbook.worksheets:
+            work_sheet['A1'] = work_sheet.title
+        file = os.path.join(settings.MEDIA_ROOT, 'sheets.xlsx')
+        workbook.save(file)
+        document = Document.objects.create(file=file,
+                                           name="Test",
+                                           status=Document.REQUEST_ONLY,
+                                           extra_worksheets='1')
+        sheet = document.sheets.get()
+
+        response = self.client.get(reverse('document:document', args=[document.pk]))
+
+        self.assertListEqual([document, sheet], response.context['sheets'])
+        self.assertContains(response, reverse('document:document',
+                                              args=[sheet.pk]))
+        self.assertListEqual(
+            list(document.cell_set.all()), list(response.context['cells']))
+
+        response = self.client.get(reverse('document:document', args=[sheet.pk]))
+
+        self.assertListEqual([document, sheet], response.context['sheets'])
+        self.assertListEqual(
+            list(sheet.cell_set.all()), list(response.context['cells']))
+
+        response = self.client.get(reverse('document:list'))
+
+        self.assertListEqual([document],
+                             list(response.context['documents']))
+
+    @patch('excel_import.models.Document.parse_file')
+    def test_show_document_while_processing(self, parse_file):
+        document = Document.objects.create(file=self.file,
+                                           name="Test",
+                                           status=Document.REQUEST_ONLY)
+        Document.objects.filter(pk=document.pk).update(
+            import_status=Document.PARSING, rows_imported=5, rows_total=10)
+
+        response = self.client.get(reverse('document:document', args=[document.pk]))
+
+        self.assertTemplateUsed(response, "frontend/document_processing.html")
+        self.assertNotIn('cells', response.context)
+        self.assertContains(response, "5 of 10 rows")
+
+    @override_settings(EXCEL_IMPORT_GRID_STORAGE=True)
+    def test_show_grid_document(self):
+        document = Document.objects.create(file=self.file,
+                                           name="Test",
+                                           status=Document.REQUEST_ONLY)
+
+        response = self.client.get(reverse('document:document', args=[document.pk]))
+
+        self.assertTemplateUsed(response, "frontend/document_detail.html")
+        self.assertContains(response, reverse('document:grid_popover',
+                                              args=[document.pk, 'A2']))
+
+    @override_settings(EXCEL_IMPORT_GRID_STORAGE=True)
+    def test_grid_popover_materializes_cell(self):
+        document = Document.objects.create(file=self.file,
+                                           name="Test",
+                                           status=Document.REQUEST_ONLY)
+
+        response = self.client.get(reverse('document:grid_popover',
+                                           args=[document.pk, 'A2']))
+
+        cell = document.cell_set.get(coordinate='A2')
+        self.assertTemplateUsed(response, "frontend/cell_popover.html")
+        self.assertEqual(cell.pk, response.context['cell_id'])
+        response = self.client.get(reverse('document:grid_popover',
+                                           args=[document.pk, 'A3']))
+        self.assertEqual(404, response.status_code)
+
 
 @override_settings(MEDIA_ROOT=tempfile.mkdtemp(),
                    MAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
@@ -647,6 +884,36 @@ class ChangeRequestModelTests(TestCase):
         self.assertIsNotNone(request.reviewed_on)
         self.assertEqual(author, request.reviewed_by)
 
+    def test_accept_and_revoke_recalculate_formulas(self):
+        with patch('excel_import.models.Document.parse_file'):
+            document = mommy.make(Document)
+        for row, value in enumerate(['1', '2', '=SUM(A1:A2)'], start=1):
+            mommy.make(Cell, document=document, coordinate='A%d' % row,
+                       row=row, column=1, value=value,
+                       formula=value if value.startswith('=') else '')
+        document.build_formulas()
+        self.assertEqual('3', document.cell_set.at('A3').value)
+
+        request = mommy.make(ChangeRequest,
+                             target_cell=document.cell_set.at('A1'),
+                             new_value='5')
+        request.accept(mommy.make(User))
+        self.assertEqual('7', document.cell_set.at('A3').value)
+        self.assertListEqual(['A1', 'A3'], list(document.cell_set.filter(
+            changed=True).values_list('coordinate', flat=True)))
+
+        request.revoke()
+        self.assertEqual('3', document.cell_set.at('A3').value)
+        # The original values are restored.
+        self.assertFalse(document.cell_set.filter(changed=True).exists())
+
+        request = mommy.make(ChangeRequest,
+                             target_cell=document.cell_set.at('A3'),
+                             new_value='=A1*10')
+        self.assertEqual('=SUM(A1:A2)', request.old_value)
+        request.accept(mommy.make(User))
+        self.assertEqual('10', document.cell_set.at('A3').value)
+
     def test_accept_declines_other_requests(self):
         with patch('excel_import.models.Document.parse_file'):
             cell = mommy.make(Cell)
@@ -667,6 +934,28 @@ class ChangeRequestModelTests(TestCase):
         self.assertEqual(reviewer, request1.reviewed_by)
         self.assertIsNotNone(request1.reviewed_on)
 
+    @patch('excel_import.models.Document.parse_file')
+    def test_move_pending_requests(self, parse_file):
+        document = mommy.make(Document)
+        revision = mommy.make(Document)
+        cell = mommy.make(Cell, document=document, row=1, column=1)
+        removed_cell = mommy.make(Cell, document=document, row=2, column=1)
+        new_cell = mommy.make(Cell, document=revision, row=1, column=1)
+        pending = mommy.make(ChangeRequest, target_cell=cell)
+        accepted = mommy.make(ChangeRequest, target_cell=cell,
+                              status=ChangeRequest.ACCEPTED)
+        not_moved = mommy.make(ChangeRequest, target_cell=removed_cell)
+
+        moved = ChangeRequest.move_pending_requests(document.pk, revision.pk)
+
+        self.assertEqual(1, moved)
+        pending.refresh_from_db()
+        accepted.refresh_from_db()
+        not_moved.refresh_from_db()
+        self.assertEqual(new_cell, pending.target_cell)
+        self.assertEqual(cell, accepted.target_cell)
+        self.assertEqual(removed_cell, not_moved.target_cell)
+
     def test_save_sets_old_value_if_empty(self):
         with patch('excel_import.models.Document.parse_file'):
             cell = mommy.make(Cell,
@@ -693,3 +982,264 @@ class ChangeRequestModelTests(TestCase):
         request.save()
 
         self.assertEqual("old_value", request.old_value)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CELERY_ALWAYS_EAGER=True)
+class ReimportDocumentsCommandTest(TestCase):
+
+    def setUp(self):
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        file = os.path.join(settings.MEDIA_ROOT, 'test.xlsx')
+        shutil.copy(os.path.join(base_dir, "excel_import/testdata/test.xlsx"),
+                    file)
+        self.document = Document.objects.create(file=file, name="test")
+        self.checkpoint = os.path.join(settings.MEDIA_ROOT, 'checkpoint.json')
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def call(self, *args):
+        stdout = StringIO()
+        call_command('reimport_documents', '--checkpoint', self.checkpoint,
+                     *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_swap_keeps_change_request_targets(self):
+        accepted = mommy.make(ChangeRequest,
+                              target_cell=self.document.cell_set.at('B2'),
+                              new_value='accepted')
+        accepted.accept(mommy.make(User))
+        pending = mommy.make(ChangeRequest,
+                             target_cell=self.document.cell_set.at('C3'))
+        color_name = pending.target_cell.color_name
+        Cell.objects.filter(pk=pending.target_cell_id).update(
+            color_name='stale')
+        cells = set(self.document.cell_set.values_list('pk', flat=True))
+
+        output = self.call('--swap')
+
+        self.assertIn('Document %d: 67 cells' % self.document.pk, output)
+        self.assertEqual(1, Document.objects.count())
+        self.assertEqual(67, self.document.cell_set.count())
+        self.assertSetEqual(
+            {accepted.target_cell_id, pending.target_cell_id},
+            cells & set(self.document.cell_set.values_list('pk', flat=True)))
+        self.assertEqual('accepted', self.document.cell_set.at('B2').value)
+        self.assertEqual(color_name,
+                         self.document.cell_set.at('C3').color_name)
+        self.assertEqual(3, self.document.documentcolors_set.count())
+        with open(self.checkpoint) as file:
+            self.assertListEqual([self.document.pk], json.load(file)['done'])
+
+    def test_swap_flags_formulas_reading_accepted_values(self):
+        workbook = Workbook()
+        for row, value in enumerate([1, 2, '=SUM(A1:A2)'], start=1):
+            workbook.active.cell(row=row, column=1).value = value
+        file = os.path.join(settings.MEDIA_ROOT, 'formulas.xlsx')
+        workbook.save(file)
+        document = Document.objects.create(file=file, name="formulas")
+        mommy.make(ChangeRequest, target_cell=document.cell_set.at('A1'),
+                   new_value='5').accept(mommy.make(User))
+
+        self.call('--swap')
+
+        self.assertEqual('7', document.cell_set.at('A3').value)
+        self.assertListEqual(['A1', 'A3'], list(document.cell_set.filter(
+            changed=True).values_list('coordinate', flat=True)))
+
+    def test_resume_from_checkpoint(self):
+        cells = list(self.document.cell_set.values_list('pk', flat=True))
+        self.assertIn('Re-imported 1 documents', self.call())
+        # Without --swap the cells are left alone.
+        self.assertListEqual(
+            cells, list(self.document.cell_set.values_list('pk', flat=True)))
+
+        output = self.call()
+        self.assertIn('Skipping 1 documents', output)
+        self.assertIn('Re-imported 0 documents', output)
+        self.assertIn('Re-imported 1 documents', self.call('--restart'))
+        self.assertEqual(1, Document.objects.count())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(),
+                   EXCEL_EXPORT_CACHE_DIR=tempfile.mkdtemp(),
+                   CELERY_ALWAYS_EAGER=True)
+class DownloadDocumentTest(TestCase):
+
+    def setUp(self):
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        file = os.path.join(settings.MEDIA_ROOT, 'test.xlsx')
+        shutil.copy(os.path.join(base_dir, "excel_import/testdata/test.xlsx"),
+                    file)
+        self.document = Document.objects.create(file=file, name="test")
+        self.document.refresh_from_db()
+        self.url = reverse('document:download', args=[self.document.pk])
+        User.objects.create_user(username='user', password='password')
+        self.client.login(username='user', password='password')
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        if response.status_code == 200:
+            response.xlsx = b''.join(response.streaming_content)
+        return response
+
+    def test_download_is_cached(self):
+        with patch('excel_import.exports.iter_export',
+                   wraps=iter_export) as export:
+            first = self.download()
+            second = self.download()
+
+        self.assertEqual(1, export.call_count)
+        self.assertEqual(first.xlsx, second.xlsx)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(str(len(first.xlsx)), second['Content-Length'])
+        self.assertIn('Last-Modified', first)
+
+    def test_not_modified(self):
+        etag = self.download()['ETag']
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+    def test_accepted_change_invalidates_export(self):
+        etag = self.download()['ETag']
+        request = mommy.make(ChangeRequest,
+                             target_cell=self.document.cell_set.at('B2'),
+                             new_value='changed')
+        request.accept(mommy.make(User))
+
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        work_sheet = load_workbook(BytesIO(response.xlsx)).active
+        self.assertEqual('changed', work_sheet['B2'].value)
+        self.assertEqual(1, len(os.listdir(settings.EXCEL_EXPORT_CACHE_DIR)))
+
+        request.revoke()
+        self.assertNotEqual(response['ETag'], self.download()['ETag'])
+
+    def test_outdated_export_keeps_newer_export(self):
+        newer = []
+
+        def export(document, report=None):
+            yield b'outdated'
+            # A change request is accepted and downloaded meanwhile.
+            document.mark_changed()
+            newer.append(get_export_path(document))
+            with open(newer[0], 'wb') as file:
+                file.write(b'newer')
+
+        with patch('excel_import.exports.iter_export', export):
+            path = get_export_path(self.document)
+            self.assertEqual(b'outdated', b''.join(
+                stream_export(Document.objects.get(pk=self.document.pk))))
+
+        self.assertFalse(os.path.exists(path))
+        with open(newer[0], 'rb') as file:
+            self.assertEqual(b'newer', file.read())
+
+    def test_export_removed_before_download_is_streamed(self):
+        self.download()
+        # Invalidated by a concurrent change while the download starts.
+        with patch('frontend.views.open', create=True,
+                   side_effect=FileNotFoundError), \
+                patch('excel_import.exports.iter_export',
+                      wraps=iter_export) as export:
+            response = self.download()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, export.call_count)
+        self.assertTrue(load_workbook(BytesIO(response.xlsx)))
+
+    def test_large_document_is_exported_in_background(self):
+        with self.settings(EXCEL_EXPORT_ASYNC_ROWS=1,
+                           EXCEL_EXPORT_CACHE_DIR=tempfile.mkdtemp()), \
+                patch('frontend.views.export_document') as export_document:
+            response = self.download()
+            self.assertEqual(202, response.status_code)
+            self.assertTemplateUsed(response,
+                                    'frontend/document_export.html')
+            self.assertNotIn('ETag', response)
+            job = ExportJob.objects.get(document=self.document)
+            self.assertEqual(ExportJob.QUEUED, job.status)
+            export_document.delay.assert_called_once_with(job.pk)
+
+            self.assertEqual(202, self.download().status_code)
+            self.assertEqual(1, export_document.delay.call_count)
+
+            job.run()
+            response = self.download()
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(load_workbook(BytesIO(response.xlsx)))
+        job.refresh_from_db()
+        self.assertEqual(ExportJob.READY, job.status)
+        self.assertEqual(100, job.progress)
+
+    def test_background_export_is_served_when_ready(self):
+        with self.settings(EXCEL_EXPORT_ASYNC_ROWS=1,
+                           EXCEL_EXPORT_CACHE_DIR=tempfile.mkdtemp()):
+            response = self.download()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(ExportJob.READY,
+                         ExportJob.objects.get(document=self.document).status)
+
+    def test_failed_background_export(self):
+        with self.settings(EXCEL_EXPORT_ASYNC_ROWS=1,
+                           EXCEL_EXPORT_CACHE_DIR=tempfile.mkdtemp()), \
+                patch('excel_import.models.stream_export',
+                      side_effect=ValueError):
+            response = self.download()
+
+        self.assertContains(response, 'could not be exported',
+                            status_code=202)
+        # Removed, so that the next download tries again.
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_download_values(self):
+        self.document.cell_set.filter(coordinate='B2').update(value='a,"b"')
+
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual('text/csv; charset=utf-8', response['Content-Type'])
+        self.assertIn('filename="test.csv"', response['Content-Disposition'])
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(5, len(rows))
+        self.assertTrue(rows[1].startswith('1,"a,""b""",'))
+
+        response = self.client.get(self.url, {'format': 'json'})
+        rows = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(5, len(rows))
+        self.assertListEqual(['line1'], rows[0])
+        self.assertEqual('a,"b"', rows[1][1])
+        # Positions inside of merged cells are empty.
+        self.assertEqual('', rows[2][0])
+        self.assertEqual(404, self.client.get(self.url,
+                                              {'format': 'pdf'}).status_code)
+
+    def test_download_values_has_own_etag(self):
+        etag = self.download()['ETag']
+        response = self.client.get(self.url, {'format': 'csv'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_document_being_imported_is_not_exported(self):
+        Document.objects.filter(pk=self.document.pk).update(
+            import_status=Document.PARSING)
+        with self.settings(EXCEL_EXPORT_ASYNC_ROWS=1):
+            response = self.download()
+        self.assertEqual(202, response.status_code)
+        self.assertTemplateUsed(response,
+                                'frontend/document_processing.html')
+        self.assertNotIn('ETag', response)
+        self.assertFalse(ExportJob.objects.exists())
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(202, response.status_code)
+
+    def test_import_changes_export_key(self):
+        # Exports made while the document was imported have version 0.
+        self.assertEqual(1, self.document.change_version)
+
+    def test_small_document_is_not_exported_in_background(self):
+        with self.settings(EXCEL_EXPORT_ASYNC_ROWS=1000):
+            self.assertEqual(200, self.download().status_code)
+        self.assertFalse(ExportJob.objects.exists())
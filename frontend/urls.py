@@ -16,5 +16,8 @@ urlpatterns = [
         name='download'),
 
     url(r'^popover/(?P<pk>[0-9]+)/$', views.popover, name='popover'),
+    url(r'^(?P<pk>[0-9]+)/popover/(?P<coordinate>[A-Z]+[0-9]+)/$',
+        views.grid_popover,
+        name='grid_popover'),
     url(r'^$', views.list_documents, name='list'),
 ]
\ No newline at end of file
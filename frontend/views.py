@@ -12,8 +12,10 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect, HttpResponse,\
-                        HttpResponseForbidden
+                        HttpResponseForbidden, FileResponse, \
+                        StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.http import condition
 from django.views.generic import DetailView
 from django.views.generic.edit import CreateView, UpdateView
 from django.http import Http404
@@ -25,10 +27,14 @@ from rest_framework import viewsets
 from rest_framework import status
 from rest_framework.response import Response
 
-from excel_import.models import Document, Cell
+from excel_import.exports import export_in_background, get_export_key, \
+    get_export_path, stream_export
+from excel_import.models import Document, Cell, ExportJob
+from excel_import.values import FORMATS, iter_values
 from frontend.forms import TempFileForm, DocumentDetailForm, DocumentForm
 from frontend.models import ChangeRequest, TemporaryDocument
 from frontend.serializers import ChangeRequestSerializer
+from frontend.tasks import export_document
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +54,8 @@ class PermissionRequiredMixin(object):
 
 @login_required
 def list_documents(request):
-    document_list = Document.objects.all_current().order_by("-created")
+    document_list = Document.objects.all_current() \
+        .filter(sheet_of__isnull=True).order_by("-created")
     paginator = Paginator(document_list, 15)
 
     page = request.GET.get('page')
@@ -111,6 +118,7 @@ class TempFileMixin(object):
 class DocumentView(DetailView):
     model = Document
     template_name = "frontend/document_detail.html"
+    processing_template_name = "frontend/document_processing.html"
 
     def get_object(self, queryset=None):
         try:
@@ -123,9 +131,24 @@ class DocumentView(DetailView):
                         self.get_queryset().model._meta.verbose_name
                 })
 
+    def get_template_names(self):
+        if not self.object.is_ready:
+            return [self.processing_template_name]
+        return super(DocumentView, self).get_template_names()
+
     def get_context_data(self, **kwargs):
         context = super(DocumentView, self).get_context_data(**kwargs)
-        context['cells'] = Cell.objects.filter(document=self.object)
+        if not self.object.is_ready:
+            return context
+
+        context['cells'] = self.object.get_cells()
+        # Other sheets are linked only, their cells are loaded when the
+        # tab is opened.
+        first_sheet = self.object.sheet_of or self.object
+        sheets = list(first_sheet.sheets.filter(current=True)
+                      .order_by('worksheet'))
+        if sheets:
+            context['sheets'] = [first_sheet] + sheets
 
         pending_requests = ChangeRequest.objects.filter(
             target_cell__document=self.object,
@@ -151,27 +174,16 @@ document_view = login_required(DocumentView.as_view())
 
 
 def update_document_file(document):
-    pk = document.pk
+    """
+    Saves document as a new revision. Pending change requests are moved
+    to the new cells by frontend.signals.document_imported_handler once
+    the import has finished.
+    """
     document.replaces_id = document.replaces_id or document.pk
     document.pk = None
     document.created = None
     document.save()
 
-    requests = ChangeRequest.objects.filter(
-        target_cell__document_id=document.replaces_id,
-        status=ChangeRequest.PENDING)
-
-    for request in requests:
-        try:
-            request.target_cell = document.cell_set.get(
-                coordinate=request.target_cell.coordinate)
-            request.save()
-        except Cell.DoesNotExist:
-            logger.debug("Cannot find cell with coordinate %s in new "
-                         "document %s(%d)"
-                         % (request.target_cell.coordinate,
-                            document.name, pk))
-
 
 def edit_document(request, pk):
     document = get_object_or_404(Document, pk=pk)
@@ -194,7 +206,8 @@ def edit_document(request, pk):
 
             if request.is_ajax():
                 context = {
-                    "form": DocumentDetailForm(file=file, instance=document),
+                    "form": DocumentDetailForm(file=instance.file,
+                                               instance=document),
                     "button_title": _("Save"),
                     "action": detail_success_url,
                 }
@@ -275,7 +288,7 @@ class DocumentCreate(PermissionRequiredMixin,
 
         if self.request.is_ajax():
             context = {
-                "form": DocumentDetailForm(file=file),
+                "form": DocumentDetailForm(file=self.object.file),
                 "button_title": _("Save"),
                 "action": self.get_success_url(),
             }
@@ -475,7 +488,83 @@ def popover(request, pk):
 
 
 @login_required
+def grid_popover(request, pk, coordinate):
+    """
+    Popover for a cell of a document with grid storage that has no Cell row
+    yet. The cell is materialized, so change requests can target it.
+    """
+    document = get_object_or_404(Document, pk=pk)
+    try:
+        cell = document.get_cell(coordinate)
+    except Cell.DoesNotExist:
+        raise Http404
+    return popover(request, cell.pk)
+
+
+def get_download_format(request):
+    return request.GET.get('format', 'xlsx')
+
+
+def is_export_pending(request, document):
+    return get_download_format(request) == 'xlsx' and \
+        export_in_background(document) and \
+        not os.path.exists(get_export_path(document))
+
+
+def get_download_etag(request, pk):
+    document = Document.objects.filter(pk=pk).first()
+    # The processing page and the progress page of an export job must not
+    # be cached.
+    if document is None or not document.is_ready or \
+            is_export_pending(request, document):
+        return None
+    return '%s-%s' % (get_export_key(document), get_download_format(request))
+
+
+def get_download_last_modified(request, pk):
+    document = Document.objects.filter(pk=pk).first()
+    if document is None or not document.is_ready or \
+            is_export_pending(request, document):
+        return None
+    return document.last_modified
+
+
+def get_export_job(document):
+    """
+    Returns the ExportJob of the current change version of document,
+    which is queued when it is created.
+    """
+    job, created = ExportJob.objects.get_or_create(
+        document=document, key=get_export_key(document),
+        defaults={'rows_total': document.rows_total or 0})
+    if created:
+        export_document.delay(job.pk)
+        job.refresh_from_db()
+    return job
+
+
+@login_required
+@condition(etag_func=get_download_etag,
+           last_modified_func=get_download_last_modified)
 def download_document(request, pk):
+    """
+    Serves the cached export of the current change version of the
+    document, or streams it while it is cached, see excel_import.exports.
+    Clients holding it get a 304.
+
+    Large documents, see export_in_background, are exported by an
+    ExportJob instead. Until it is ready, a page showing its progress is
+    returned, which reloads itself.
+
+    With ?format=csv or ?format=json only the values are streamed from
+    the database, see excel_import.values.
+
+    Documents that are not imported completely are not exported, the
+    processing page is shown instead.
+    """
+    format = get_download_format(request)
+    if format != 'xlsx' and format not in FORMATS:
+        raise Http404
     try:
         document = Document.objects.get(pk=pk)
     except Document.DoesNotExist:
@@ -486,11 +575,36 @@ def download_document(request, pk):
                     "document": document,
                     "request": request,
                 })
-    xlsx_bytes = document.create_xlsx()
-    response = HttpResponse(xlsx_bytes)
+    if not document.is_ready:
+        return render(request, "frontend/document_processing.html",
+                      {'document': document}, status=202)
+
+    if format in FORMATS:
+        response = StreamingHttpResponse(iter_values(document, format),
+                                         content_type=FORMATS[format][1])
+        response['Content-Disposition'] = \
+            'attachment; filename="%s.%s"' % (document.name, format)
+        return response
+
+    path = get_export_path(document)
+    if not os.path.exists(path) and export_in_background(document):
+        job = get_export_job(document)
+        if job.status == ExportJob.FAILED:
+            # The next download tries again.
+            job.delete()
+        if not os.path.exists(path):
+            return render(request, "frontend/document_export.html",
+                          {'document': document, 'job': job}, status=202)
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        # Not cached yet, or removed by a concurrent change.
+        response = StreamingHttpResponse(stream_export(document))
+    else:
+        response = FileResponse(file)
+        response["Content-Length"] = os.fstat(file.fileno()).st_size
     response["Content-Type"] = \
         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    response["Content-Length"] = len(xlsx_bytes)
     response['Content-Disposition'] = \
         'attachment; filename="%s.xlsx"' % document.name
     return response
@@ -191,7 +191,7 @@ var VIEWER = VIEWER || {};
         },
         addPopover: function ($cell) {
             $.ajax({
-                url: '/document/popover/' + $cell.attr('data-id') + '/'
+                url: $cell.attr('data-popover-url')
             })
                 .done(function (data) {
                     $cell.on('inserted.bs.popover', function () {